@@ -0,0 +1,18 @@
+from django.db.models import Exists, OuterRef
+from .models import Folder, FolderAccess
+
+
+def accessible_folders(user):
+    # Folders the user owns or that are shared with them, directly or through
+    # an ancestor: a single semi-join on FolderAccess (user, folder).
+    return Folder.objects.filter(Exists(FolderAccess.objects.filter(user=user, folder=OuterRef('pk'))))
+
+
+def shared_with_me(user):
+    return Folder.objects.filter(
+        Exists(FolderAccess.objects.filter(user=user, role=FolderAccess.SHARED, folder=OuterRef('pk')))
+    ).exclude(user=user)
+
+
+def accessible_items(model, user):
+    return model.objects.filter(Exists(FolderAccess.objects.filter(user=user, folder=OuterRef('folder_id'))))
@@ -0,0 +1,56 @@
+from django.core.cache import cache
+from .models import Folder, FolderAccess
+
+ACL_CACHE_TIMEOUT = 60 * 60
+
+
+def acl_cache_key(folder_id, version, user_id):
+    return 'backupss:acl:{0}:{1}:{2}'.format(folder_id, version, user_id)
+
+
+def get_folder_roles(request, folder_ids, versions=None):
+    # Resolves the caller's role (FolderAccess.OWNER / SHARED, or None) for
+    # each folder. Answers are memoized on the request, and shared across
+    # requests in the cache under the folder's acl_version, so a share change
+    # makes old entries unreachable without having to delete them.
+    roles = request.__dict__.setdefault('_folder_roles', {})
+    missing = {pk for pk in folder_ids if pk not in roles}
+    if not missing:
+        return roles
+    versions = dict(versions or {})
+    unknown = [pk for pk in missing if pk not in versions]
+    if unknown:
+        versions.update(Folder.objects.filter(pk__in=unknown).values_list('pk', 'acl_version'))
+    user_id = request.user.pk
+    keys = {pk: acl_cache_key(pk, versions[pk], user_id) for pk in missing if pk in versions}
+    cached = cache.get_many(list(keys.values()))
+    uncached = []
+    for pk in missing:
+        if pk not in keys:
+            roles[pk] = None
+        elif keys[pk] in cached:
+            roles[pk] = cached[keys[pk]] or None
+        else:
+            uncached.append(pk)
+    if uncached:
+        found = {}
+        for folder_id, role in FolderAccess.objects.filter(user_id=user_id, folder_id__in=uncached).values_list('folder_id', 'role'):
+            if found.get(folder_id) != FolderAccess.OWNER:
+                found[folder_id] = role
+        for pk in uncached:
+            roles[pk] = found.get(pk)
+        # '' marks "no access" so misses are cached too.
+        cache.set_many({keys[pk]: roles[pk] or '' for pk in uncached}, ACL_CACHE_TIMEOUT)
+    return roles
+
+
+def get_folder_role(request, folder_id, version=None):
+    versions = {folder_id: version} if version is not None else None
+    return get_folder_roles(request, [folder_id], versions)[folder_id]
+
+
+def get_object_folder(obj):
+    # (folder id, acl_version if already loaded) for a Folder or a media item.
+    if isinstance(obj, Folder):
+        return obj.pk, obj.acl_version
+    return obj.folder_id, None
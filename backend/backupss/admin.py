@@ -1,8 +1,10 @@
 from django.contrib import admin
-from .models import Folder, File, ImageFile, VideoFile
+from .models import Folder, FolderAccess, FolderDeletion, File, ImageFile, VideoFile
 
 # Register your models here.
 admin.site.register(Folder)
 admin.site.register(File)
 admin.site.register(ImageFile)
-admin.site.register(VideoFile)
\ No newline at end of file
+admin.site.register(VideoFile)
+admin.site.register(FolderAccess)
+admin.site.register(FolderDeletion)
\ No newline at end of file
@@ -0,0 +1,68 @@
+import os
+from collections import Counter
+from functools import partial
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_image_file_extension
+from django.db import transaction
+from .derivatives import schedule_derivatives
+from .metadata import extract_image_metadata
+from .models import Blob, Change, Folder, ImageFile, TimelineBucket, add_to_user_storage, timeline_day
+from .serializers import get_storage_quota
+
+INVALID_IMAGE = 'Upload a valid image. The file was either not an image or a corrupted image.'
+QUOTA_EXCEEDED = 'Storage quota exceeded.'
+
+
+def ingest_images(user, folder, uploads, workers=None):
+    # Creates one ImageFile per upload. Headers are probed and new content is
+    # written to storage concurrently, then every row goes in with one
+    # bulk_create. Returns (upload, image, error) per upload, in order, so a
+    # bad file only fails itself.
+    outcomes = []
+    candidates = []
+    for upload in uploads:
+        image = ImageFile(user=user, folder=folder, name=os.path.basename(upload.name)[:150], image=upload)
+        try:
+            validate_image_file_extension(upload)
+        except ValidationError as error:
+            outcomes.append([upload, None, error.messages[0]])
+            continue
+        outcomes.append([upload, image, None])
+        candidates.append(image)
+
+    probed = {id(image) for image in extract_image_metadata(candidates, workers)}
+    quota = get_storage_quota(user)
+    with transaction.atomic():
+        # Holding the owner's row makes concurrent uploads take turns at the
+        # quota check, so each one sees the others' usage.
+        used = get_user_model().objects.select_for_update().filter(pk=user.pk).values_list('storage', flat=True).first() or 0
+        accepted = []
+        for outcome in outcomes:
+            image = outcome[1]
+            if image is None:
+                continue
+            if id(image) not in probed:
+                outcome[1:] = [None, INVALID_IMAGE]
+                continue
+            image.size = image.image.size
+            if used + image.size > quota:
+                outcome[1:] = [None, QUOTA_EXCEEDED]
+                continue
+            used += image.size
+            accepted.append(image)
+
+        if accepted:
+            blobs = Blob.objects.store_many(user.pk, [image.image for image in accepted], workers)
+            for image, blob in zip(accepted, blobs):
+                image.blob = blob
+                image.set_timeline_at()
+            ImageFile.objects.bulk_create(accepted)
+            TimelineBucket.objects.add_counts(Counter((user.pk, timeline_day(image.timeline_at)) for image in accepted))
+            Change.objects.record(Change.IMAGE, Change.CREATED, [(user.pk, image.pk, folder.pk) for image in accepted], [folder.pk])
+            total = sum(image.size for image in accepted)
+            Folder.add_size(folder.pk, total)
+            add_to_user_storage(user.pk, total)
+            for image in accepted:
+                transaction.on_commit(partial(schedule_derivatives, image.pk))
+    return outcomes
@@ -0,0 +1,56 @@
+import hashlib
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_sha256(fileobj):
+    # Fallback for content that did not arrive through the hashing upload
+    # handlers below (e.g. assembled resumable uploads).
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for block in iter(lambda: fileobj.read(HASH_BLOCK_SIZE), b''):
+        digest.update(block)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def blob_directory_path(instance, filename):
+    return 'files/{0}/blobs/{1}/{2}'.format(instance.user_id, instance.sha256[:2], filename)
+
+
+class HashingMemoryFileUploadHandler(MemoryFileUploadHandler):
+    # Computes the SHA-256 of an upload while it streams in, so storing it
+    # in the blob store needs no second pass over the bytes.
+
+    def new_file(self, *args, **kwargs):
+        # Set up first: the parent may raise StopFutureHandlers.
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.activated:
+            self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        if uploaded is not None:
+            uploaded.sha256 = self.sha256.hexdigest()
+        return uploaded
+
+
+class HashingTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+
+    def new_file(self, *args, **kwargs):
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        uploaded.sha256 = self.sha256.hexdigest()
+        return uploaded
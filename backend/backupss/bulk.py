@@ -0,0 +1,141 @@
+from collections import defaultdict
+from django.db import transaction
+from django.db.models.functions import Now
+from rest_framework.exceptions import ValidationError
+from .derivatives import discard_derivatives
+from .models import Blob, Change, Folder, ImageFile, TimelineBucket, add_to_user_storage
+
+BULK_CHUNK_SIZE = 1000
+# Flags that can be switched in bulk, with the timestamp recording when.
+TIMESTAMPED_FLAGS = {'is_trashed': 'trashed_at', 'is_starred': 'starred_at'}
+
+
+def chunked_pks(pks):
+    for start in range(0, len(pks), BULK_CHUNK_SIZE):
+        yield pks[start:start + BULK_CHUNK_SIZE]
+
+
+def lock_rows(queryset, *fields):
+    # The selected rows, locked for the rest of the transaction, so the size
+    # bookkeeping is computed from exactly the rows that get updated.
+    return list(queryset.select_for_update().values_list('pk', *fields))
+
+
+def update_rows(model, pks, **values):
+    for chunk in chunked_pks(pks):
+        model.objects.filter(pk__in=chunk).update(**values)
+
+
+def set_flag(model, queryset, flag, value):
+    # One UPDATE per chunk; the timestamp comes from the database clock and is
+    # cleared again when the flag is turned off. Trashing and restoring media
+    # moves its size out of and back into the folder totals, and images off
+    # and back onto the timeline.
+    timestamp = TIMESTAMPED_FLAGS[flag]
+    media = model is not Folder
+    with transaction.atomic():
+        rows = lock_rows(queryset.exclude(**{flag: value}), 'user_id', *(('folder_id', 'size') if media else ()))
+        if flag == 'is_trashed' and model is ImageFile:
+            for chunk in chunked_pks([row[0] for row in rows]):
+                TimelineBucket.objects.add_images(ImageFile.objects.filter(pk__in=chunk), -1 if value else 1)
+        update_rows(model, [row[0] for row in rows], **{flag: value, timestamp: Now() if value else None})
+        if flag == 'is_trashed' and media:
+            deltas = defaultdict(float)
+            for _, _, folder_id, size in rows:
+                deltas[folder_id] += -(size or 0) if value else (size or 0)
+            Folder.add_sizes(deltas)
+        if flag == 'is_trashed':
+            action = Change.TRASHED if value else Change.RESTORED
+        else:
+            action = Change.UPDATED
+        Change.objects.record(model.change_kind, action, [(row[1], row[0], row[2] if media else row[0]) for row in rows], {row[2] if media else row[0] for row in rows})
+    return len(rows)
+
+
+def move_items(model, queryset, folder):
+    with transaction.atomic():
+        rows = lock_rows(queryset.exclude(folder=folder), 'folder_id', 'size', 'is_trashed', 'user_id')
+        update_rows(model, [pk for pk, _, _, _, _ in rows], folder=folder)
+        deltas = defaultdict(float)
+        for _, folder_id, size, is_trashed, _ in rows:
+            if not is_trashed:
+                deltas[folder_id] -= size or 0
+                deltas[folder.pk] += size or 0
+        Folder.add_sizes(deltas)
+        folders = {row[1] for row in rows} | ({folder.pk} if rows else set())
+        # Listed under both folders, so viewers of either one hear about it.
+        items = [(row[4], row[0], folder_id) for row in rows for folder_id in (row[1], folder.pk)]
+        Change.objects.record(model.change_kind, Change.UPDATED, items, folders)
+    return len(rows)
+
+
+def delete_items(model, queryset, collect=True, journal=True):
+    # Hard-deletes media rows without loading them as instances. This does
+    # in aggregate what the per-row post_delete receivers would: folder sizes,
+    # the owners' storage and blob references are adjusted once per batch,
+    # and image thumbnails are deleted after commit. Pass collect=False to
+    # leave unreferenced blobs to Blob.objects.collect_many() and thumbnails
+    # to the caller, and journal=False when a folder deletion entry already
+    # covers the rows.
+    with transaction.atomic():
+        rows = lock_rows(queryset, 'folder_id', 'user_id', 'size', 'is_trashed', 'blob_id')
+        folder_deltas = defaultdict(float)
+        user_deltas = defaultdict(float)
+        for _, folder_id, user_id, size, is_trashed, _ in rows:
+            if not is_trashed:
+                folder_deltas[folder_id] -= size or 0
+            user_deltas[user_id] -= size or 0
+        derivatives = []
+        for chunk in chunked_pks([row[0] for row in rows]):
+            if model is ImageFile:
+                TimelineBucket.objects.add_images(
+                    ImageFile.objects.filter(pk__in=chunk, is_trashed=False, folder__is_deleted=False), -1,
+                )
+                if collect:
+                    derivatives.extend(ImageFile.objects.filter(pk__in=chunk).values_list('blob_id', 'thumbnails'))
+            # Media rows have no dependents, so nothing needs collecting.
+            model.objects.filter(pk__in=chunk)._raw_delete(model.objects.db)
+        discard_derivatives(derivatives)
+        Folder.add_sizes(folder_deltas)
+        for user_id, delta in user_deltas.items():
+            add_to_user_storage(user_id, delta)
+        Blob.objects.release_many([row[5] for row in rows], collect=collect)
+        if journal:
+            Change.objects.record(model.change_kind, Change.DELETED, [(row[2], row[0], row[1]) for row in rows], {row[1] for row in rows})
+    return len(rows)
+
+
+def top_level(folders):
+    # Drops folders that sit inside another selected folder.
+    folders = sorted(folders, key=lambda folder: folder.path)
+    roots = []
+    for folder in folders:
+        if not roots or not folder.path.startswith(roots[-1].path):
+            roots.append(folder)
+    return roots
+
+
+def move_folders(queryset, parent):
+    # Each moved subtree is re-rooted by Folder.save(), which also carries
+    # its size between the old and new ancestors and rebuilds inherited
+    # access; that is a fixed number of queries per selected folder.
+    folders = top_level(queryset.exclude(pk=parent.pk).only('pk', 'path', 'depth', 'parent_folder_id'))
+    if any(parent.path.startswith(folder.path) for folder in folders):
+        raise ValidationError({'folder': 'A folder cannot be moved into itself or one of its subfolders.'})
+    moved = 0
+    with transaction.atomic():
+        for folder in Folder.objects.filter(pk__in=[f.pk for f in folders]).exclude(parent_folder=parent):
+            folder.parent_folder = parent
+            folder.save()
+            moved += 1
+    return moved
+
+
+def set_folders_trashed(queryset, trashed):
+    # Folder.save() takes the rest of each selected subtree along.
+    folders = top_level(queryset.exclude(is_trashed=trashed).only('pk', 'path'))
+    with transaction.atomic():
+        for folder in Folder.objects.filter(pk__in=[f.pk for f in folders]):
+            folder.is_trashed = trashed
+            folder.save()
+    return len(folders)
@@ -0,0 +1,61 @@
+import hashlib
+from django.http import HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+from .access import accessible_folders
+from .models import File, UserVersion
+from .response_cache import cached_response, response_cache
+from .signed_urls import get_url_window
+
+
+def get_folder_version(user, folder_id):
+    # The folder's version if the user can see it (one lookup on the primary
+    # key plus the FolderAccess semi-join), else None.
+    return accessible_folders(user).filter(pk=folder_id).values_list('version', flat=True).first()
+
+
+def get_user_version(user):
+    # Creating the row on first use means every version ever handed out is
+    # backed by a row that Folder.bump_versions() can bump.
+    return UserVersion.objects.get_or_create(user=user)[0].value
+
+
+def get_representation(request):
+    # What besides the data decides the rendered bytes: URL, format and the
+    # media URL window.
+    window = get_url_window(File._meta.get_field('file').storage)
+    renderer = getattr(request, 'accepted_renderer', None)
+    return [request.get_full_path(), getattr(renderer, 'format', ''), window]
+
+
+def make_etag(request, scope, version):
+    # Strong validator for a rendered listing: the same URL, caller, format,
+    # version and media URL window always render byte for byte the same.
+    parts = get_representation(request) + [request.user.pk, scope, version]
+    return quote_etag(hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()[:32])
+
+
+def not_modified(request, etag):
+    # None unless the client already holds this representation.
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return None
+    etags = parse_etags(if_none_match)
+    if '*' not in etags and etag not in etags:
+        return None
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    return response
+
+
+def get_cached_response(request):
+    # Returns (key, response): the cached body, or a 304 when the client holds
+    # it already, on a hit; None on a miss, to be stored under `key`. The
+    # generation is read first, before anything that renders the response.
+    generation = response_cache.get_generation(request.user.pk)
+    key = response_cache.make_key(request.user.pk, generation, *get_representation(request))
+    entry = response_cache.get(key)
+    if entry is None:
+        return key, None
+    response = not_modified(request, entry[0]) or cached_response(entry)
+    response['X-Cache'] = 'HIT'
+    return key, response
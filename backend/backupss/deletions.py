@@ -0,0 +1,99 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models.functions import Now
+from .bulk import delete_items, top_level
+from .models import Change, File, Folder, FolderAccess, FolderDeletion, ImageFile, TimelineBucket, UploadSession, VideoFile
+from .uploads import abort_session
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='deletions')
+    return _executor
+
+
+def schedule_deletion(deletion_id):
+    get_executor().submit(run_deletion, deletion_id)
+
+
+def queue_folder_deletion(folder, schedule=True):
+    # Takes the subtree out of view right away: it is detached from its parent
+    # (moving its size off the old ancestors), every access grant on it is
+    # dropped, its photos leave the timeline and its folders are flagged
+    # deleted. The rows and stored files are then removed in the background
+    # by run_deletion(), unless the caller runs it itself (schedule=False).
+    with transaction.atomic():
+        folder = Folder.objects.select_for_update().get(pk=folder.pk)
+        Folder.bump_versions([folder.pk])
+        if folder.parent_folder_id:
+            Folder.objects.filter(pk=folder.pk).update(parent_folder=None)
+            folder.parent_folder = None
+            folder.update_path('/')
+        FolderAccess.objects.bump_versions(folder)
+        # Journaled while the grants still exist, so the users the folder is
+        # shared with get the entry; users who only saw part of the subtree
+        # are told to resync.
+        deletion, created = FolderDeletion.objects.get_or_create(folder=folder, defaults={'user_id': folder.user_id})
+        if created:
+            Change.objects.record(Change.FOLDER, Change.DELETED, [(folder.user_id, folder.pk, folder.pk)])
+            subtree_users = set(
+                FolderAccess.objects.filter(folder__path__startswith=folder.path, role=FolderAccess.SHARED)
+                .values_list('user_id', flat=True)
+            )
+            Change.objects.reset(sorted(subtree_users - FolderAccess.objects.get_shared_users(folder)))
+        FolderAccess.objects.filter(folder__path__startswith=folder.path).delete()
+        TimelineBucket.objects.add_images(
+            ImageFile.objects.filter(folder__path__startswith=folder.path, folder__is_deleted=False, is_trashed=False), -1,
+        )
+        Folder.objects.filter(path__startswith=folder.path).update(is_deleted=True, deleted_at=Now())
+        if schedule:
+            transaction.on_commit(partial(schedule_deletion, deletion.pk))
+    return deletion
+
+
+def delete_folders(queryset):
+    folders = top_level(queryset.only('pk', 'path'))
+    for folder in folders:
+        queue_folder_deletion(folder)
+    return len(folders)
+
+
+def run_deletion(deletion_id):
+    # Media first, in bounded batches through the set-based delete_items(),
+    # then the folders deepest first so no batch has children left outside it.
+    # Safe to re-run after an interruption: it just picks up what is left.
+    close_old_connections()
+    try:
+        deletion = FolderDeletion.objects.select_related('folder').filter(pk=deletion_id).first()
+        if deletion is None:
+            return False
+        path = deletion.folder.path
+        batch_size = settings.DELETION_BATCH_SIZE
+        for model in (File, ImageFile, VideoFile):
+            while True:
+                pks = list(model.objects.filter(folder__path__startswith=path).values_list('pk', flat=True)[:batch_size])
+                if not pks:
+                    break
+                delete_items(model, model.objects.filter(pk__in=pks), journal=False)
+        for session in UploadSession.objects.filter(folder__path__startswith=path).iterator():
+            abort_session(session)
+        while True:
+            pks = list(Folder.objects.filter(path__startswith=path).order_by('-depth').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            with transaction.atomic():
+                Folder.objects.filter(pk__in=pks).delete()
+        return True
+    except Exception:
+        logger.exception('Folder deletion %s did not finish', deletion_id)
+        return False
+    finally:
+        close_old_connections()
@@ -0,0 +1,131 @@
+import base64
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+from .models import Change, ImageFile, user_image_directory_path
+from .similarity import dhash, hash_fields
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER_SIZE = 16
+FORMAT_EXTENSIONS = {'WEBP': 'webp', 'JPEG': 'jpg'}
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=settings.THUMBNAIL_WORKERS, thread_name_prefix='thumbnails')
+    return _executor
+
+
+def schedule_derivatives(image_id):
+    # Called from transaction.on_commit so the worker always sees the row.
+    get_executor().submit(generate_derivatives, image_id)
+
+
+def encode(img, image_format, **options):
+    if image_format == 'JPEG' and img.mode != 'RGB':
+        img = img.convert('RGB')
+    buffer = BytesIO()
+    img.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def render_derivatives(source, sizes, image_format):
+    # Decodes the original once, at the smallest scale JPEG draft mode allows
+    # for the largest size, then downsizes progressively from there. The
+    # perceptual hash is taken from the smallest derivative.
+    img = Image.open(source)
+    img.draft('RGB', (max(sizes), max(sizes)))
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+    rendered = {}
+    for size in sorted(sizes, reverse=True):
+        img = img.copy()
+        img.thumbnail((size, size), Image.LANCZOS)
+        rendered[size] = encode(img, image_format, quality=80)
+    perceptual_hash = dhash(img)
+    img.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.BILINEAR)
+    placeholder = 'data:image/jpeg;base64,' + base64.b64encode(encode(img, 'JPEG', quality=50)).decode('ascii')
+    return rendered, placeholder, perceptual_hash
+
+
+def derivative_name(image, size, extension):
+    # Per image, not per blob: duplicates never share or overwrite thumbnails.
+    return user_image_directory_path(image, 'thumbnails/{0}_{1}.{2}'.format(image.pk, size, extension))
+
+
+def unreferenced_derivatives(rows):
+    # Thumbnail names of deleted or re-rendered images, given as (blob_id,
+    # thumbnails) pairs, that no remaining image uses. Thumbnails from before
+    # they were named per image were named after the blob and can still be
+    # shared with a duplicate.
+    names = {name for _, thumbnails in rows for name in thumbnails.values()}
+    blob_ids = {blob_id for blob_id, thumbnails in rows if blob_id and thumbnails}
+    if names and blob_ids:
+        for thumbnails in ImageFile.objects.filter(blob_id__in=blob_ids).values_list('thumbnails', flat=True):
+            names.difference_update(thumbnails.values())
+    return sorted(names)
+
+
+def delete_files(storage, names):
+    for name in names:
+        try:
+            storage.delete(name)
+        except OSError:
+            logger.exception('Could not delete derivative %s', name)
+
+
+def discard_derivatives(rows):
+    # Deletes the thumbnails of images whose rows are being deleted, once
+    # that commits.
+    names = unreferenced_derivatives(rows)
+    if names:
+        storage = ImageFile._meta.get_field('image').storage
+        transaction.on_commit(partial(delete_files, storage, names))
+
+
+def generate_derivatives(image_id):
+    close_old_connections()
+    try:
+        image = ImageFile.objects.select_related('user').filter(pk=image_id).first()
+        if image is None or not image.image:
+            return False
+        image_format = settings.THUMBNAIL_FORMAT.upper()
+        storage = image.image.storage
+        with image.image.open('rb') as source:
+            rendered, placeholder, perceptual_hash = render_derivatives(source, settings.THUMBNAIL_SIZES, image_format)
+        extension = FORMAT_EXTENSIONS.get(image_format, image_format.lower())
+        names = {str(size): derivative_name(image, size, extension) for size in rendered}
+        # Overwrite in place so regenerating never leaves orphaned copies.
+        delete_files(storage, names.values())
+        thumbnails = {
+            str(size): storage.save(names[str(size)], ContentFile(data))
+            for size, data in rendered.items()
+        }
+        # A queryset update, so the upload's own save() hooks are not re-run.
+        with transaction.atomic():
+            updated = ImageFile.objects.filter(pk=image_id).update(
+                thumbnails=thumbnails, placeholder=placeholder, **hash_fields(perceptual_hash),
+            )
+            if not updated:
+                # Deleted while rendering.
+                transaction.on_commit(partial(delete_files, storage, list(thumbnails.values())))
+                return False
+            Change.objects.record(Change.IMAGE, Change.UPDATED, [(image.user_id, image_id, image.folder_id)], [image.folder_id])
+            stale = {size: name for size, name in image.thumbnails.items() if name not in thumbnails.values()}
+            discard_derivatives([(image.blob_id, stale)])
+        return True
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.exception('Could not generate derivatives for image %s', image_id)
+        return False
+    finally:
+        close_old_connections()
@@ -0,0 +1,207 @@
+import base64
+import hashlib
+import os
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+from .blobs import HASH_BLOCK_SIZE, blob_directory_path
+from .models import Blob
+from .serving import is_s3_storage, s3_key
+from .uploads import UPLOAD_MODELS
+
+# S3 multipart limits: every part but the last is at least 5 MB, and there
+# are at most 10,000 of them.
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PART_COUNT = 10000
+
+
+def get_bucket_storage(kind):
+    model = UPLOAD_MODELS[kind]
+    storage = model._meta.get_field(model.stored_file_field).storage
+    if not is_s3_storage(storage):
+        raise ValidationError({'kind': 'Direct uploads need the S3 storage backend.'})
+    return storage
+
+
+def get_client(storage):
+    return storage.bucket.meta.client
+
+
+def choose_part_size(size):
+    part_size = max(settings.DIRECT_UPLOAD_PART_SIZE, MIN_PART_SIZE, -(-size // MAX_PART_COUNT))
+    return part_size if size > part_size else None
+
+
+def presign(storage, method, **params):
+    return get_client(storage).generate_presigned_url(
+        method,
+        Params=dict(params, Bucket=storage.bucket.name),
+        ExpiresIn=settings.DIRECT_UPLOAD_URL_EXPIRY,
+    )
+
+
+def start_direct_upload(upload):
+    # Skips the transfer when the user already stores this content; otherwise
+    # reserves a blob name and, for large files, opens a multipart upload.
+    storage = get_bucket_storage(upload.kind)
+    if Blob.objects.filter(user_id=upload.user_id, sha256=upload.sha256, ref_count__gt=0).exists():
+        return upload
+    extension = os.path.splitext(upload.filename)[1].lower()
+    # Named after the upload rather than the hash, so an upload that fails
+    # verification can never overwrite an existing blob.
+    upload.key = blob_directory_path(Blob(user_id=upload.user_id, sha256=upload.sha256), str(upload.pk) + extension)
+    upload.part_size = choose_part_size(upload.size)
+    if upload.part_size:
+        open_multipart_upload(storage, upload)
+    upload.save(update_fields=['key', 'part_size', 'multipart_upload_id'])
+    return upload
+
+
+def open_multipart_upload(storage, upload):
+    upload.multipart_upload_id = get_client(storage).create_multipart_upload(
+        Bucket=storage.bucket.name, Key=s3_key(storage, upload.key),
+    )['UploadId']
+
+
+def get_uploaded_parts(storage, upload):
+    parts = []
+    params = {'Bucket': storage.bucket.name, 'Key': s3_key(storage, upload.key), 'UploadId': upload.multipart_upload_id}
+    while True:
+        page = get_client(storage).list_parts(**params)
+        parts.extend({'PartNumber': part['PartNumber'], 'ETag': part['ETag'], 'Size': part['Size']} for part in page.get('Parts', []))
+        if not page.get('IsTruncated'):
+            return parts
+        params['PartNumberMarker'] = page['NextPartNumberMarker']
+
+
+def get_upload_instructions(upload):
+    # What the client should PUT, and where. For multipart uploads only the
+    # parts S3 does not have yet are listed, so an interrupted upload resumes
+    # by asking again.
+    if not upload.key:
+        return {'exists': True}
+    storage = get_bucket_storage(upload.kind)
+    key = s3_key(storage, upload.key)
+    if not upload.multipart_upload_id:
+        checksum = base64.b64encode(bytes.fromhex(upload.sha256)).decode('ascii')
+        return {
+            'exists': False,
+            'url': presign(storage, 'put_object', Key=key, ChecksumSHA256=checksum),
+            'headers': {'x-amz-checksum-sha256': checksum},
+        }
+    uploaded = {part['PartNumber'] for part in get_uploaded_parts(storage, upload)}
+    return {
+        'exists': False,
+        'part_size': upload.part_size,
+        'parts': [
+            {
+                'number': number,
+                'url': presign(storage, 'upload_part', Key=key, UploadId=upload.multipart_upload_id, PartNumber=number),
+            }
+            for number in range(1, upload.part_count + 1)
+            if number not in uploaded
+        ],
+    }
+
+
+def get_object_sha256(storage, key):
+    digest = hashlib.sha256()
+    body = get_client(storage).get_object(Bucket=storage.bucket.name, Key=key)['Body']
+    for block in body.iter_chunks(HASH_BLOCK_SIZE):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def verify_object(storage, upload):
+    # Assembles a multipart upload and checks the object is all there and is
+    # the content the client declared. Single PUTs must carry the SHA-256
+    # checksum header, which S3 verifies on write; the stored checksum is
+    # compared here since the header is not signed. Multipart objects only
+    # get a checksum of their part checksums, so they are hashed here, as is
+    # any object stored without a checksum.
+    client = get_client(storage)
+    key = s3_key(storage, upload.key)
+    multipart = bool(upload.multipart_upload_id)
+    if multipart:
+        parts = get_uploaded_parts(storage, upload)
+        if [part['PartNumber'] for part in parts] != list(range(1, upload.part_count + 1)):
+            raise ValidationError({'parts': 'Not every part has been uploaded.'})
+        client.complete_multipart_upload(
+            Bucket=storage.bucket.name, Key=key, UploadId=upload.multipart_upload_id,
+            MultipartUpload={'Parts': [{'PartNumber': part['PartNumber'], 'ETag': part['ETag']} for part in parts]},
+        )
+        upload.multipart_upload_id = ''
+        upload.save(update_fields=['multipart_upload_id'])
+    try:
+        head = client.head_object(Bucket=storage.bucket.name, Key=key, ChecksumMode='ENABLED')
+    except client.exceptions.ClientError:
+        raise ValidationError({'detail': 'The object has not been uploaded.'})
+    if head['ContentLength'] == upload.size:
+        if multipart or not head.get('ChecksumSHA256'):
+            matches = get_object_sha256(storage, key) == upload.sha256
+        else:
+            matches = head['ChecksumSHA256'] == base64.b64encode(bytes.fromhex(upload.sha256)).decode('ascii')
+        if matches:
+            return
+        error = {'sha256': 'The uploaded content does not match the checksum.'}
+    else:
+        error = {'size': 'Expected {0} bytes, found {1}.'.format(upload.size, head['ContentLength'])}
+    if multipart:
+        # The parts are gone once assembled: start over with a fresh upload
+        # under the same key, which the instructions then point at.
+        storage.delete(upload.key)
+        open_multipart_upload(storage, upload)
+        upload.save(update_fields=['multipart_upload_id'])
+    raise ValidationError(error)
+
+
+def finalize_direct_upload(upload, serializer):
+    # Turns the uploaded object into a blob (or reuses the user's existing
+    # one) and creates the File / ImageFile / VideoFile row for it. The object
+    # goes through the same field checks, quota and clean() as a chunked
+    # upload (see uploads.complete_session); a rejected one is deleted along
+    # with the upload.
+    storage = get_bucket_storage(upload.kind)
+    if upload.key:
+        verify_object(storage, upload)
+    model = UPLOAD_MODELS[upload.kind]
+    try:
+        with transaction.atomic():
+            get_user_model().objects.select_for_update().get(pk=upload.user_id)
+            blob = Blob.objects.acquire(upload.user_id, upload.sha256)
+            if blob is None:
+                if not upload.key:
+                    raise ValidationError({'detail': 'The content is no longer stored; start a new upload.'})
+                blob = Blob.objects.create(user_id=upload.user_id, sha256=upload.sha256, size=upload.size, file=upload.key, ref_count=1)
+            elif upload.key:
+                transaction.on_commit(lambda: storage.delete(upload.key))
+            serializer.validate_stored_file(blob.file, upload.user)
+            blob.file.close()
+            instance = model(folder=upload.folder, user=upload.user, name=upload.name, blob=blob, size=blob.size)
+            setattr(instance, model.stored_file_field, blob.file.name)
+            try:
+                instance.clean()
+            except DjangoValidationError as error:
+                raise ValidationError({model.stored_file_field: error.messages})
+            instance.save()
+            upload.delete()
+    except ValidationError:
+        if upload.key:
+            storage.delete(upload.key)
+            upload.delete()
+        raise
+    return instance
+
+
+def abort_direct_upload(upload):
+    if upload.key:
+        storage = get_bucket_storage(upload.kind)
+        if upload.multipart_upload_id:
+            get_client(storage).abort_multipart_upload(
+                Bucket=storage.bucket.name, Key=s3_key(storage, upload.key), UploadId=upload.multipart_upload_id,
+            )
+        elif not Blob.objects.filter(user_id=upload.user_id, file=upload.key).exists():
+            storage.delete(upload.key)
+    upload.delete()
@@ -0,0 +1,76 @@
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef, Q
+from .models import Change, ChangeSequence
+
+CHANGES_PAGE_SIZE = 500
+CHANGES_MAX_PAGE_SIZE = 5000
+# Folder entries that stand for a whole subtree; a later entry for the same
+# folder does not carry that information, so they are only dropped by age.
+SUBTREE_ACTIONS = (Change.TRASHED, Change.RESTORED, Change.DELETED)
+
+
+def get_head(user):
+    return ChangeSequence.objects.filter(user=user).values_list('value', flat=True).first() or 0
+
+
+def get_changes(user, since, page_size):
+    # One range scan on (user, seq). Returns (entries, has_more, resync). A
+    # RESET after the cursor, whether left by compaction or by a share that
+    # added or removed folders, means the client has to list everything again.
+    rows = list(
+        Change.objects.filter(user=user, seq__gt=since).order_by('seq')
+        .values_list('seq', 'kind', 'object_id', 'action', 'created_at')[:page_size + 1]
+    )
+    if any(action == Change.RESET for _, _, _, action, _ in rows):
+        return [], False, True
+    entries = [
+        {'seq': seq, 'kind': kind, 'id': object_id, 'action': action, 'created_at': created_at}
+        for seq, kind, object_id, action, created_at in rows[:page_size]
+    ]
+    return entries, len(rows) > page_size, False
+
+
+def drop_superseded(batch_size):
+    # An entry followed by a later one for the same object tells a client
+    # nothing the later one does not, whatever its cursor.
+    later = Change.objects.filter(
+        user_id=OuterRef('user_id'), kind=OuterRef('kind'), object_id=OuterRef('object_id'), seq__gt=OuterRef('seq'),
+    )
+    superseded = (
+        Change.objects.filter(object_id__isnull=False)
+        .exclude(Q(kind=Change.FOLDER, action__in=SUBTREE_ACTIONS))
+        .filter(Exists(later))
+    )
+    dropped = 0
+    while True:
+        pks = list(superseded.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return dropped
+        dropped += Change.objects.filter(pk__in=pks).delete()[0]
+
+
+def truncate_user(user_id, horizon, batch_size):
+    # Cuts the journal up to `horizon` oldest first. Each batch turns its
+    # newest entry into the RESET marker and deletes what is below it in the
+    # same transaction, so at every commit a cursor that points into the
+    # removed range reads the marker first and is told to resync.
+    dropped = 0
+    while True:
+        with transaction.atomic():
+            seqs = list(
+                Change.objects.filter(user_id=user_id, seq__lte=horizon).order_by('seq')
+                .values_list('seq', flat=True)[:batch_size + 1]
+            )
+            if len(seqs) <= 1:
+                return dropped
+            marker = seqs[-1]
+            Change.objects.filter(user_id=user_id, seq=marker).update(kind='', object_id=None, action=Change.RESET)
+            dropped += Change.objects.filter(user_id=user_id, seq__lt=marker).delete()[0]
+
+
+def compact_changes(cutoff, batch_size):
+    dropped = drop_superseded(batch_size)
+    horizons = Change.objects.filter(created_at__lt=cutoff).values('user_id').annotate(horizon=Max('seq'))
+    for row in horizons.values_list('user_id', 'horizon'):
+        dropped += truncate_user(row[0], row[1], batch_size)
+    return dropped
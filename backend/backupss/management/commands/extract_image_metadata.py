@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from backupss.metadata import IMAGE_METADATA_FIELDS, extract_image_metadata
+from backupss.models import Change, ImageFile, TimelineBucket
+
+
+class Command(BaseCommand):
+    help = 'Read dimensions, capture time, camera and GPS from the EXIF headers of stored images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.THUMBNAIL_WORKERS)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--force', action='store_true', help='Re-read images whose headers were read before.')
+
+    def handle(self, *args, **options):
+        queryset = ImageFile.objects.exclude(image='').only('pk', 'image', 'size', 'user_id', 'folder_id', 'created_at', 'metadata_probed').order_by('pk')
+        if not options['force']:
+            queryset = queryset.filter(metadata_probed=False)
+        batch_size = options['batch_size']
+        updated = 0
+        last_pk = 0
+        while True:
+            # Walk by primary key so rows updated in a batch are never revisited.
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            probed = extract_image_metadata(batch, options['workers'])
+            for item in probed:
+                item.set_timeline_at()
+            # Unreadable files are marked too, so later runs skip them.
+            unreadable = [item for item in batch if not item.metadata_probed]
+            for item in unreadable:
+                item.metadata_probed = True
+            # A new capture time moves the image to another timeline day.
+            on_timeline = ImageFile.objects.filter(pk__in=[item.pk for item in probed], is_trashed=False, folder__is_deleted=False)
+            with transaction.atomic():
+                TimelineBucket.objects.add_images(on_timeline, -1)
+                ImageFile.objects.bulk_update(probed, IMAGE_METADATA_FIELDS + ['metadata_probed', 'timeline_at'])
+                ImageFile.objects.bulk_update(unreadable, ['metadata_probed'])
+                TimelineBucket.objects.add_images(on_timeline, 1)
+                Change.objects.record(
+                    Change.IMAGE, Change.UPDATED,
+                    [(item.user_id, item.pk, item.folder_id) for item in probed],
+                    {item.folder_id for item in probed},
+                )
+            updated += len(probed)
+        self.stdout.write(self.style.SUCCESS('Updated metadata for {0} images.'.format(updated)))
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from backupss.metadata import VIDEO_METADATA_FIELDS, extract_video_metadata
+from backupss.models import Change, VideoFile
+
+
+class Command(BaseCommand):
+    help = 'Read duration, resolution, codec and recording time from the container headers of stored videos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.THUMBNAIL_WORKERS)
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--force', action='store_true', help='Re-read videos that already have a duration.')
+
+    def handle(self, *args, **options):
+        queryset = VideoFile.objects.exclude(video='').only('pk', 'video', 'size', 'user_id', 'folder_id').order_by('pk')
+        if not options['force']:
+            queryset = queryset.filter(duration__isnull=True)
+        batch_size = options['batch_size']
+        updated = 0
+        last_pk = 0
+        while True:
+            # Walk by primary key so rows updated in a batch are never revisited.
+            batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            probed = extract_video_metadata(batch, options['workers'])
+            with transaction.atomic():
+                VideoFile.objects.bulk_update(probed, VIDEO_METADATA_FIELDS)
+                Change.objects.record(
+                    Change.VIDEO, Change.UPDATED,
+                    [(item.user_id, item.pk, item.folder_id) for item in probed],
+                    {item.folder_id for item in probed},
+                )
+            updated += len(probed)
+        self.stdout.write(self.style.SUCCESS('Updated metadata for {0} videos.'.format(updated)))
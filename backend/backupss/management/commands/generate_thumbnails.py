@@ -0,0 +1,28 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from backupss.derivatives import generate_derivatives
+from backupss.models import ImageFile
+
+
+class Command(BaseCommand):
+    help = 'Generate thumbnails, placeholders and perceptual hashes for images that do not have them yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.THUMBNAIL_WORKERS)
+        parser.add_argument('--force', action='store_true', help='Regenerate derivatives for every image.')
+
+    def handle(self, *args, **options):
+        queryset = ImageFile.objects.all()
+        if not options['force']:
+            queryset = queryset.filter(Q(thumbnails={}) | Q(phash__isnull=True))
+        image_ids = queryset.values_list('pk', flat=True).iterator(chunk_size=2000)
+        generated = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for ok in executor.map(generate_derivatives, image_ids):
+                if ok:
+                    generated += 1
+                else:
+                    failed += 1
+        self.stdout.write(self.style.SUCCESS('Generated derivatives for {0} images ({1} failed).'.format(generated, failed)))
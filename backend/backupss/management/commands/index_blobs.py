@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from backupss.blobs import file_sha256
+from backupss.models import Blob, Change, File, ImageFile, VideoFile
+
+
+def hash_stored_file(stored_file):
+    try:
+        with stored_file.storage.open(stored_file.name, 'rb') as fileobj:
+            return file_sha256(fileobj)
+    except OSError:
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Hash files stored before the blob store existed and attach them to blobs, dropping duplicate copies.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        for model in (File, ImageFile, VideoFile):
+            indexed = self.index_model(model, options['workers'], options['batch_size'])
+            self.stdout.write('{0}: indexed {1} rows.'.format(model.__name__, indexed))
+
+    def index_model(self, model, workers, batch_size):
+        field = model.stored_file_field
+        queryset = model.objects.filter(blob__isnull=True).exclude(**{field: ''}).only('pk', 'user_id', 'folder_id', 'size', field).order_by('pk')
+        indexed = 0
+        last_pk = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+                if not batch:
+                    return indexed
+                last_pk = batch[-1].pk
+                digests = executor.map(hash_stored_file, [getattr(row, field) for row in batch])
+                for row, digest in zip(batch, digests):
+                    if digest is not None:
+                        self.attach(model, field, row, digest)
+                        indexed += 1
+
+    def attach(self, model, field, row, digest):
+        stored_file = getattr(row, field)
+        with transaction.atomic():
+            blob = Blob.objects.acquire(row.user_id, digest)
+            if blob is None:
+                # First copy of this content: adopt the existing object as the blob.
+                size = row.size if row.size is not None else stored_file.size
+                blob = Blob.objects.create(user_id=row.user_id, sha256=digest, size=size, file=stored_file.name, ref_count=1)
+            model.objects.filter(pk=row.pk).update(blob=blob, **{field: blob.file.name})
+            if blob.file.name != stored_file.name:
+                Change.objects.record(model.change_kind, Change.UPDATED, [(row.user_id, row.pk, row.folder_id)], [row.folder_id])
+                duplicate = stored_file.name
+                transaction.on_commit(lambda: stored_file.storage.delete(duplicate))
@@ -0,0 +1,28 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from backupss.purge import TrashPurger
+
+
+class Command(BaseCommand):
+    help = 'Permanently delete files, images, videos and folders that have been in the trash past the retention period.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.TRASH_RETENTION_DAYS)
+        parser.add_argument('--batch-size', type=int, default=settings.TRASH_PURGE_BATCH_SIZE)
+        parser.add_argument('--workers', type=int, default=settings.TRASH_PURGE_WORKERS)
+        parser.add_argument('--pause', type=float, default=settings.TRASH_PURGE_PAUSE, help='Seconds to wait between batches.')
+        parser.add_argument('--limit', type=int, default=None, help='Stop after purging this many items.')
+
+    def handle(self, *args, **options):
+        purger = TrashPurger(
+            timezone.now() - timedelta(days=options['days']),
+            options['batch_size'],
+            options['workers'],
+            pause=options['pause'],
+            limit=options['limit'],
+        )
+        for name, count in purger.run().items():
+            self.stdout.write('{0}: purged {1}.'.format(name, count))
+        self.stdout.write(self.style.SUCCESS('Purged {0} trashed items.'.format(purger.purged)))
@@ -0,0 +1,24 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from backupss.direct import abort_direct_upload
+from backupss.models import DirectUpload, UploadSession
+from backupss.uploads import abort_session
+
+
+class Command(BaseCommand):
+    help = 'Delete resumable upload sessions that were never completed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-hours', type=int, default=48)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(hours=options['older_than_hours'])
+        count = 0
+        for session in UploadSession.objects.filter(created_at__lt=cutoff).iterator():
+            abort_session(session)
+            count += 1
+        for upload in DirectUpload.objects.filter(created_at__lt=cutoff).iterator():
+            abort_direct_upload(upload)
+            count += 1
+        self.stdout.write(self.style.SUCCESS('Removed {0} abandoned upload sessions.'.format(count)))
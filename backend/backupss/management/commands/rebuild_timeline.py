@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import Coalesce, TruncDate
+from backupss.models import ImageFile, TimelineBucket
+
+
+class Command(BaseCommand):
+    help = 'Fill in missing ImageFile.timeline_at values and recount the timeline buckets from the stored images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            filled = ImageFile.objects.filter(timeline_at__isnull=True).update(timeline_at=Coalesce('taken_at', 'created_at'))
+            rows = (
+                ImageFile.objects.filter(is_trashed=False, folder__is_deleted=False).annotate(day=TruncDate('timeline_at'))
+                .values('user_id', 'day').annotate(total=Count('pk')).values_list('user_id', 'day', 'total')
+            )
+            buckets = [TimelineBucket(user_id=user_id, day=day, count=total) for user_id, day, total in rows]
+            TimelineBucket.objects.all().delete()
+            TimelineBucket.objects.bulk_create(buckets, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Filled {0} timeline dates and rebuilt {1} timeline buckets.'.format(filled, len(buckets))
+        ))
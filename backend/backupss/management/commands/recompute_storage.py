@@ -0,0 +1,63 @@
+from collections import defaultdict
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from backupss.models import Folder, File, ImageFile, VideoFile, path_ids
+
+MEDIA_MODELS = [(File, 'file'), (ImageFile, 'image'), (VideoFile, 'video')]
+
+
+class Command(BaseCommand):
+    help = 'Recompute Folder.size and CustomUser.storage from the stored items.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fill-missing-sizes', action='store_true', help='Read sizes from storage for items that have none recorded.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if options['fill_missing_sizes']:
+            for model, field in MEDIA_MODELS:
+                self.fill_missing_sizes(model, field, batch_size)
+
+        direct_sizes = defaultdict(float)
+        user_storage = defaultdict(float)
+        for model, _ in MEDIA_MODELS:
+            for row in model.objects.filter(is_trashed=False).values('folder_id').annotate(total=Sum('size')):
+                direct_sizes[row['folder_id']] += row['total'] or 0
+            for row in model.objects.values('user_id').annotate(total=Sum('size')):
+                user_storage[row['user_id']] += row['total'] or 0
+
+        # Roll every folder's own bytes up into each of its ancestors.
+        folder_sizes = defaultdict(float)
+        for pk, path in Folder.objects.values_list('pk', 'path').iterator(chunk_size=batch_size):
+            size = direct_sizes.get(pk)
+            if size:
+                for ancestor_id in path_ids(path) or [pk]:
+                    folder_sizes[ancestor_id] += size
+
+        with transaction.atomic():
+            folders = [Folder(pk=pk, size=folder_sizes.get(pk, 0.0)) for pk in Folder.objects.values_list('pk', flat=True)]
+            Folder.objects.bulk_update(folders, ['size'], batch_size=batch_size)
+            User = get_user_model()
+            users = [User(pk=pk, storage=user_storage.get(pk, 0.0)) for pk in User.objects.values_list('pk', flat=True)]
+            User.objects.bulk_update(users, ['storage'], batch_size=batch_size)
+
+        self.stdout.write(self.style.SUCCESS('Recomputed sizes for {0} folders and {1} users.'.format(len(folders), len(users))))
+
+    def fill_missing_sizes(self, model, field, batch_size):
+        queryset = model.objects.filter(size__isnull=True).exclude(**{field: ''}).only('pk', field)
+        batch = []
+        for item in queryset.iterator(chunk_size=batch_size):
+            try:
+                item.size = getattr(item, field).size
+            except (OSError, ValueError):
+                self.stderr.write('Could not read {0} {1}.'.format(model.__name__, item.pk))
+                continue
+            batch.append(item)
+            if len(batch) >= batch_size:
+                model.objects.bulk_update(batch, ['size'])
+                batch = []
+        if batch:
+            model.objects.bulk_update(batch, ['size'])
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from backupss.deletions import run_deletion
+from backupss.models import FolderDeletion
+
+
+class Command(BaseCommand):
+    help = 'Finish folder deletions that were queued but not completed, e.g. after a restart.'
+
+    def handle(self, *args, **options):
+        finished = failed = 0
+        for deletion_id in list(FolderDeletion.objects.order_by('created_at').values_list('pk', flat=True)):
+            if run_deletion(deletion_id):
+                finished += 1
+            else:
+                failed += 1
+        self.stdout.write(self.style.SUCCESS('Finished {0} folder deletions, {1} failed.'.format(finished, failed)))
@@ -0,0 +1,59 @@
+import json
+import re
+from .models import Blob
+
+MANIFEST_CHUNK_SIZE = 1000
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+
+def validate_entry(entry):
+    if not isinstance(entry, dict):
+        return 'Entry must be an object.'
+    if not isinstance(entry.get('hash'), str) or not SHA256_PATTERN.match(entry['hash'].lower()):
+        return 'hash must be a hex SHA-256 digest.'
+    if not isinstance(entry.get('size'), int) or entry['size'] < 0:
+        return 'size must be a non-negative integer.'
+    return None
+
+
+def iter_ndjson_entries(stream):
+    # One manifest entry per line; malformed lines come back with an 'error'.
+    for number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield {'line': number, 'error': 'Invalid JSON.'}
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def find_missing(user, entries):
+    # Yields the entries whose content the user does not have yet, checking
+    # each chunk of the manifest with a single lookup on the (user, sha256)
+    # blob index. Invalid entries are yielded back with an 'error' key.
+    for chunk in chunked(entries, MANIFEST_CHUNK_SIZE):
+        valid = []
+        for entry in chunk:
+            error = entry.get('error') if isinstance(entry, dict) else None
+            error = error or validate_entry(entry)
+            if error:
+                yield {**entry, 'error': error} if isinstance(entry, dict) else {'entry': entry, 'error': error}
+            else:
+                valid.append(entry)
+        hashes = {entry['hash'].lower() for entry in valid}
+        stored = dict(Blob.objects.filter(user=user, sha256__in=hashes, ref_count__gt=0).values_list('sha256', 'size'))
+        for entry in valid:
+            if stored.get(entry['hash'].lower()) != entry['size']:
+                yield entry
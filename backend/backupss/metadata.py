@@ -0,0 +1,257 @@
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.utils import timezone
+from PIL import Image, UnidentifiedImageError
+from .serving import open_stored_file
+
+ORIENTATION = 0x0112
+MAKE = 0x010F
+MODEL = 0x0110
+EXIF_IFD = 0x8769
+GPS_IFD = 0x8825
+DATETIME_ORIGINAL = 0x9003
+OFFSET_TIME_ORIGINAL = 0x9011
+DATETIME = 0x0132
+# EXIF orientations that rotate the image by 90 degrees one way or the other.
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+
+IMAGE_METADATA_FIELDS = ['image_width', 'image_height', 'taken_at', 'camera_model', 'latitude', 'longitude']
+
+
+def parse_exif_datetime(value, offset=None):
+    try:
+        parsed = datetime.strptime(str(value).strip('\x00 '), '%Y:%m:%d %H:%M:%S')
+    except ValueError:
+        return None
+    if offset:
+        try:
+            sign = -1 if offset[0] == '-' else 1
+            hours, minutes = offset[1:].split(':')
+            return parsed.replace(tzinfo=dt_timezone(sign * timedelta(hours=int(hours), minutes=int(minutes))))
+        except (ValueError, IndexError):
+            pass
+    return timezone.make_aware(parsed, timezone.get_default_timezone())
+
+
+def parse_gps_coordinate(value, ref):
+    try:
+        degrees, minutes, seconds = (float(part) for part in value)
+    except (TypeError, ValueError, ZeroDivisionError):
+        return None
+    coordinate = degrees + minutes / 60 + seconds / 3600
+    return -coordinate if ref in ('S', 'W') else coordinate
+
+
+def probe_image(fileobj):
+    # Image.open only parses the headers (including the EXIF segment); the
+    # pixel data is never decoded here.
+    with Image.open(fileobj) as img:
+        width, height = img.size
+        exif = img.getexif()
+    metadata = dict.fromkeys(IMAGE_METADATA_FIELDS)
+    if exif.get(ORIENTATION) in TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+    metadata['image_width'], metadata['image_height'] = width, height
+
+    exif_ifd = exif.get_ifd(EXIF_IFD)
+    taken_at = exif_ifd.get(DATETIME_ORIGINAL) or exif.get(DATETIME)
+    if taken_at:
+        metadata['taken_at'] = parse_exif_datetime(taken_at, exif_ifd.get(OFFSET_TIME_ORIGINAL))
+
+    model = str(exif.get(MODEL) or '').strip('\x00 ')
+    make = str(exif.get(MAKE) or '').strip('\x00 ')
+    if model and make and not model.startswith(make):
+        model = '{0} {1}'.format(make, model)
+    metadata['camera_model'] = model[:100]
+
+    gps = exif.get_ifd(GPS_IFD)
+    if 2 in gps and 4 in gps:
+        metadata['latitude'] = parse_gps_coordinate(gps[2], gps.get(1))
+        metadata['longitude'] = parse_gps_coordinate(gps[4], gps.get(3))
+    return metadata
+
+
+def read_image_metadata(image):
+    # Probes an ImageFile's stored (or still uploading) file, leaving the
+    # file positioned at the start for whoever reads it next.
+    field = image.image
+    try:
+        if not field._committed:
+            field.file.seek(0)
+            return probe_image(field.file)
+        with open_stored_file(field.storage, field.name, image.size or None) as fileobj:
+            return probe_image(fileobj)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError, ValueError):
+        return None
+    finally:
+        if not field._committed:
+            field.file.seek(0)
+
+
+def apply_image_metadata(image, metadata):
+    for name, value in metadata.items():
+        if name == 'camera_model':
+            value = value or ''
+        setattr(image, name, value)
+    image.metadata_probed = True
+
+
+def extract_image_metadata(images, workers=None):
+    # Probes a batch of ImageFile instances concurrently and fills in their
+    # metadata fields in memory; returns the ones that could be read.
+    images = list(images)
+    with ThreadPoolExecutor(max_workers=workers or settings.THUMBNAIL_WORKERS) as executor:
+        results = list(executor.map(read_image_metadata, images))
+    probed = []
+    for image, metadata in zip(images, results):
+        if metadata is not None:
+            apply_image_metadata(image, metadata)
+            probed.append(image)
+    return probed
+
+
+VIDEO_METADATA_FIELDS = ['duration', 'video_width', 'video_height', 'video_codec', 'recorded_at']
+# MP4 / QuickTime timestamps count seconds from 1904-01-01 UTC.
+MP4_EPOCH = datetime(1904, 1, 1, tzinfo=dt_timezone.utc)
+# Limits that keep a malformed or hostile file from turning the probe into a scan.
+MAX_BOXES_PER_LEVEL = 256
+BOX_PAYLOAD_LIMIT = 128
+
+
+def iter_boxes(fileobj, start, end):
+    # (type, payload start, box end) for the boxes between start and end,
+    # reading only each 8 or 16 byte header and seeking over the rest.
+    offset = start
+    for _ in range(MAX_BOXES_PER_LEVEL):
+        if end is not None and offset + 8 > end:
+            return
+        fileobj.seek(offset)
+        header = fileobj.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            large_size = fileobj.read(8)
+            if len(large_size) < 8:
+                return
+            size, header_size = struct.unpack('>Q', large_size)[0], 16
+        elif size == 0:
+            # Runs to the end of the enclosing box (or of the file).
+            size = (end if end is not None else fileobj.seek(0, 2)) - offset
+        if size < header_size:
+            return
+        yield box_type, offset + header_size, offset + size
+        offset += size
+
+
+def find_box(fileobj, start, end, box_type):
+    for found_type, payload_start, box_end in iter_boxes(fileobj, start, end):
+        if found_type == box_type:
+            return payload_start, box_end
+    return None
+
+
+def read_box_payload(fileobj, start, end):
+    fileobj.seek(start)
+    return fileobj.read(min(end - start, BOX_PAYLOAD_LIMIT))
+
+
+def parse_mvhd(payload, metadata):
+    if payload[0] == 1:
+        created, _, timescale, duration = struct.unpack('>QQIQ', payload[4:32])
+        unknown = 0xFFFFFFFFFFFFFFFF
+    else:
+        created, _, timescale, duration = struct.unpack('>IIII', payload[4:20])
+        unknown = 0xFFFFFFFF
+    if timescale and duration != unknown:
+        metadata['duration'] = duration / timescale
+    if created:
+        metadata['recorded_at'] = MP4_EPOCH + timedelta(seconds=created)
+
+
+def parse_tkhd(payload):
+    matrix_offset = 52 if payload[0] == 1 else 40
+    a, b = struct.unpack('>ii', payload[matrix_offset:matrix_offset + 8])
+    width, height = struct.unpack('>II', payload[matrix_offset + 36:matrix_offset + 44])
+    width, height = width >> 16, height >> 16
+    if a == 0 and b != 0:
+        # The display matrix rotates the track by 90 degrees either way.
+        width, height = height, width
+    return width, height
+
+
+def parse_track(fileobj, start, end):
+    # (handler type, width, height, codec fourcc) of one trak box.
+    handler = codec = None
+    width = height = None
+    for box_type, payload_start, box_end in iter_boxes(fileobj, start, end):
+        if box_type == b'tkhd':
+            width, height = parse_tkhd(read_box_payload(fileobj, payload_start, box_end))
+        elif box_type == b'mdia':
+            hdlr = find_box(fileobj, payload_start, box_end, b'hdlr')
+            if hdlr:
+                handler = read_box_payload(fileobj, *hdlr)[8:12]
+            minf = find_box(fileobj, payload_start, box_end, b'minf')
+            stbl = minf and find_box(fileobj, *minf, b'stbl')
+            stsd = stbl and find_box(fileobj, *stbl, b'stsd')
+            if stsd:
+                entry = read_box_payload(fileobj, *stsd)
+                if len(entry) >= 16 and struct.unpack('>I', entry[4:8])[0]:
+                    codec = entry[12:16].decode('latin-1').strip('\x00 ')
+    return handler, width, height, codec
+
+
+def probe_video(fileobj):
+    # Reads duration, creation time, display size and codec from the moov
+    # box of an MP4 / MOV file. Only box headers and a handful of small
+    # boxes are read; mdat is skipped with a seek wherever it sits.
+    moov = find_box(fileobj, 0, None, b'moov')
+    if moov is None:
+        return None
+    metadata = dict.fromkeys(VIDEO_METADATA_FIELDS)
+    for box_type, payload_start, box_end in iter_boxes(fileobj, *moov):
+        if box_type == b'mvhd':
+            parse_mvhd(read_box_payload(fileobj, payload_start, box_end), metadata)
+        elif box_type == b'trak' and metadata['video_codec'] is None:
+            handler, width, height, codec = parse_track(fileobj, payload_start, box_end)
+            if handler == b'vide':
+                metadata['video_width'], metadata['video_height'] = width, height
+                metadata['video_codec'] = (codec or '')[:16]
+    return metadata
+
+
+def read_video_metadata(video):
+    field = video.video
+    try:
+        if not field._committed:
+            field.file.seek(0)
+            return probe_video(field.file)
+        with open_stored_file(field.storage, field.name, video.size) as fileobj:
+            return probe_video(fileobj)
+    except (OSError, struct.error, ValueError, OverflowError):
+        return None
+    finally:
+        if not field._committed:
+            field.file.seek(0)
+
+
+def apply_video_metadata(video, metadata):
+    for name, value in metadata.items():
+        if name == 'video_codec':
+            value = value or ''
+        setattr(video, name, value)
+
+
+def extract_video_metadata(videos, workers=None):
+    videos = list(videos)
+    with ThreadPoolExecutor(max_workers=workers or settings.THUMBNAIL_WORKERS) as executor:
+        results = list(executor.map(read_video_metadata, videos))
+    probed = []
+    for video, metadata in zip(videos, results):
+        if metadata is not None:
+            apply_video_metadata(video, metadata)
+            probed.append(video)
+    return probed
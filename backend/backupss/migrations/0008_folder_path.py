@@ -0,0 +1,39 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:30
+
+from django.db import migrations, models
+
+
+def backfill_paths(apps, schema_editor):
+    Folder = apps.get_model('backupss', 'Folder')
+    level = list(Folder.objects.filter(parent_folder__isnull=True))
+    parent_paths = {}
+    depth = 0
+    while level:
+        for folder in level:
+            folder.path = '{0}{1}/'.format(parent_paths.get(folder.parent_folder_id, '/'), folder.pk)
+            folder.depth = depth
+        Folder.objects.bulk_update(level, ['path', 'depth'], batch_size=500)
+        parent_paths = {folder.pk: folder.path for folder in level}
+        level = list(Folder.objects.filter(parent_folder_id__in=list(parent_paths)))
+        depth += 1
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backupss', '0007_imagefile_image_height_imagefile_image_width'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, default='', editable=False, max_length=500),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:31
+
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backupss', '0008_folder_path'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagefile',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='videofile',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='backupss_fi_user_id_bca573_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['folder', '-created_at', '-id'], name='backupss_fi_folder__f12ddd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='imagefile',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='backupss_im_user_id_bc0ad2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='imagefile',
+            index=models.Index(fields=['folder', '-created_at', '-id'], name='backupss_im_folder__4065f2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='videofile',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='backupss_vi_user_id_2295cb_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='videofile',
+            index=models.Index(fields=['folder', '-created_at', '-id'], name='backupss_vi_folder__51d358_idx'),
+        ),
+    ]
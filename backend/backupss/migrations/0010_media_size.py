@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backupss', '0009_media_created_at_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagefile',
+            name='size',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='videofile',
+            name='size',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:34
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_access(apps, schema_editor):
+    Folder = apps.get_model('backupss', 'Folder')
+    FolderAccess = apps.get_model('backupss', 'FolderAccess')
+    FolderAccess.objects.bulk_create(
+        [
+            FolderAccess(user_id=user_id, folder_id=pk, granted_via_id=pk, role='owner')
+            for pk, user_id in Folder.objects.values_list('pk', 'user_id').iterator()
+        ],
+        batch_size=1000,
+    )
+    for folder in Folder.objects.filter(is_shared=True):
+        user_ids = list(folder.shared_with.values_list('pk', flat=True))
+        subtree_ids = Folder.objects.filter(path__startswith=folder.path).values_list('pk', flat=True)
+        FolderAccess.objects.bulk_create(
+            [
+                FolderAccess(user_id=user_id, folder_id=folder_id, granted_via_id=folder.pk, role='shared')
+                for folder_id in subtree_ids
+                for user_id in user_ids
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backupss', '0010_media_size'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FolderAccess',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('owner', 'Owner'), ('shared', 'Shared')], max_length=10)),
+                ('folder', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='access', to='backupss.folder')),
+                ('granted_via', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='granted_access', to='backupss.folder')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='folder_access', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'role', 'folder'], name='backupss_fo_user_id_82e310_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='folderaccess',
+            constraint=models.UniqueConstraint(fields=('user', 'folder', 'granted_via'), name='unique_folder_access_grant'),
+        ),
+        migrations.RunPython(backfill_access, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backupss', '0011_folderaccess'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='acl_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backupss', '0012_folder_acl_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagefile',
+            name='placeholder',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='imagefile',
+            name='thumbnails',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:37
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backupss', '0013_imagefile_derivatives'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagefile',
+            name='camera_model',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='imagefile',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='imagefile',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='imagefile',
+            name='taken_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='imagefile',
+            index=models.Index(fields=['user', '-taken_at', '-id'], name='backupss_im_user_id_806767_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='imagefile',
+            index=models.Index(fields=['user', 'camera_model'], name='backupss_im_user_id_2d7158_idx'),
+        ),
+    ]
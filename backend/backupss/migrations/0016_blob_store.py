@@ -0,0 +1,65 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:40
+
+import backupss.blobs
+import backupss.models
+import django.core.validators
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backupss', '0015_upload_sessions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='file',
+            name='file',
+            field=models.FileField(max_length=255, upload_to=backupss.models.user_directory_path),
+        ),
+        migrations.AlterField(
+            model_name='imagefile',
+            name='image',
+            field=models.ImageField(max_length=255, upload_to=backupss.models.user_image_directory_path),
+        ),
+        migrations.AlterField(
+            model_name='videofile',
+            name='video',
+            field=models.FileField(max_length=255, upload_to=backupss.models.user_video_directory_path, validators=[django.core.validators.FileExtensionValidator(allowed_extensions=['mp4', 'avi', 'mov', 'wmv'])]),
+        ),
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64)),
+                ('size', models.BigIntegerField()),
+                ('file', models.FileField(max_length=255, upload_to=backupss.blobs.blob_directory_path)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blobs', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='blob',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='+', to='backupss.blob'),
+        ),
+        migrations.AddField(
+            model_name='imagefile',
+            name='blob',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='+', to='backupss.blob'),
+        ),
+        migrations.AddField(
+            model_name='videofile',
+            name='blob',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='+', to='backupss.blob'),
+        ),
+        migrations.AddConstraint(
+            model_name='blob',
+            constraint=models.UniqueConstraint(fields=('user', 'sha256'), name='unique_user_blob'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backupss', '0016_blob_store'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagefile',
+            name='phash',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='imagefile',
+            name='phash_0',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='imagefile',
+            name='phash_1',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='imagefile',
+            name='phash_2',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='imagefile',
+            name='phash_3',
+            field=models.IntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='imagefile',
+            index=models.Index(fields=['user', 'phash_0'], name='backupss_im_user_id_a2936b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='imagefile',
+            index=models.Index(fields=['user', 'phash_1'], name='backupss_im_user_id_98cfcd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='imagefile',
+            index=models.Index(fields=['user', 'phash_2'], name='backupss_im_user_id_ffc7ce_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='imagefile',
+            index=models.Index(fields=['user', 'phash_3'], name='backupss_im_user_id_30561a_idx'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:50
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backupss', '0018_folder_deletion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(condition=models.Q(('is_trashed', True)), fields=['trashed_at'], name='file_trashed_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(condition=models.Q(('is_trashed', True)), fields=['trashed_at'], name='folder_trashed_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='imagefile',
+            index=models.Index(condition=models.Q(('is_trashed', True)), fields=['trashed_at'], name='imagefile_trashed_at_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='videofile',
+            index=models.Index(condition=models.Q(('is_trashed', True)), fields=['trashed_at'], name='videofile_trashed_at_idx'),
+        ),
+    ]
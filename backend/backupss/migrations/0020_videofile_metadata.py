@@ -0,0 +1,56 @@
+# Generated by Django 5.0.6 on 2026-10-18 15:54
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backupss', '0019_trashed_at_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='videofile',
+            name='duration',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='videofile',
+            name='recorded_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='videofile',
+            name='video_codec',
+            field=models.CharField(blank=True, default='', max_length=16),
+        ),
+        migrations.AddField(
+            model_name='videofile',
+            name='video_height',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='videofile',
+            name='video_width',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='videofile',
+            index=models.Index(fields=['user', '-recorded_at', '-id'], name='backupss_vi_user_id_aca7fd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='videofile',
+            index=models.Index(fields=['user', 'duration'], name='backupss_vi_user_id_ed63c4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='videofile',
+            index=models.Index(fields=['user', 'video_height'], name='backupss_vi_user_id_d83a89_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='videofile',
+            index=models.Index(fields=['user', 'video_codec'], name='backupss_vi_user_id_97c0dc_idx'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.0.6 on 2026-10-18 16:15
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Coalesce, TruncDate
+
+
+def backfill_timeline(apps, schema_editor):
+    ImageFile = apps.get_model('backupss', 'ImageFile')
+    TimelineBucket = apps.get_model('backupss', 'TimelineBucket')
+    ImageFile.objects.update(timeline_at=Coalesce('taken_at', 'created_at'))
+    rows = (
+        ImageFile.objects.filter(is_trashed=False).annotate(day=TruncDate('timeline_at'))
+        .values('user_id', 'day').annotate(total=Count('pk')).values_list('user_id', 'day', 'total')
+    )
+    TimelineBucket.objects.bulk_create(
+        [TimelineBucket(user_id=user_id, day=day, count=total) for user_id, day, total in rows.iterator()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backupss', '0023_content_versions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='imagefile',
+            name='timeline_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='imagefile',
+            index=models.Index(condition=models.Q(('is_trashed', False)), fields=['user', '-timeline_at', '-id'], name='imagefile_timeline_idx'),
+        ),
+        migrations.AddField(
+            model_name='timelinebucket',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_buckets', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddConstraint(
+            model_name='timelinebucket',
+            constraint=models.UniqueConstraint(fields=('user', 'day'), name='unique_timeline_bucket'),
+        ),
+        migrations.RunPython(backfill_timeline, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.0.6 on 2026-10-18 16:27
+
+from django.db import migrations, models
+
+
+def mark_probed(apps, schema_editor):
+    # Images with a capture time were read before; the rest get one more try.
+    ImageFile = apps.get_model('backupss', 'ImageFile')
+    ImageFile.objects.filter(taken_at__isnull=False).update(metadata_probed=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('backupss', '0024_timeline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagefile',
+            name='metadata_probed',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(mark_probed, migrations.RunPython.noop),
+    ]
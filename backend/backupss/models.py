@@ -1,9 +1,23 @@
-from datetime import timezone
-from django.db import models
+import os
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Concat, Substr, TruncDate
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
 from django.core.exceptions import ValidationError
 from django.core.validators import FileExtensionValidator
-from PIL import Image
+from .metadata import (
+    IMAGE_METADATA_FIELDS, VIDEO_METADATA_FIELDS, apply_image_metadata, apply_video_metadata, read_image_metadata,
+    read_video_metadata,
+)
+from .blobs import blob_directory_path, file_sha256
+from .response_cache import response_cache
+
+MAX_VIDEO_SIZE = 1024 * 1024 * 1024 * 4  # 4 GB limit
 
 # Utility functions to generate file paths
 def user_directory_path(instance, filename):
@@ -18,6 +32,36 @@ def user_video_directory_path(instance, filename):
 def user_thumbnail_directory_path(instance, filename):
     return 'files/{0}/videos/thumbnails/{1}'.format(instance.user.id, filename)
 
+def path_ids(path):
+    # '/1/5/12/' -> [1, 5, 12]
+    return [int(pk) for pk in path.strip('/').split('/') if pk]
+
+def add_to_user_storage(user_id, delta):
+    if delta:
+        get_user_model().objects.filter(pk=user_id).update(storage=Coalesce(F('storage'), Value(0.0)) + delta)
+
+def apply_size_change(previous, current):
+    # Each state is a dict of folder_id/user_id/size/is_trashed (or None for a
+    # row that does not exist). Trashed items still use the owner's storage but
+    # no longer count towards their folder.
+    folder_deltas = defaultdict(float)
+    user_deltas = defaultdict(float)
+    for state, sign in ((previous, -1), (current, 1)):
+        if state is None:
+            continue
+        size = state['size'] or 0
+        if not state['is_trashed']:
+            folder_deltas[state['folder_id']] += sign * size
+        user_deltas[state['user_id']] += sign * size
+    for folder_id, delta in folder_deltas.items():
+        Folder.add_size(folder_id, delta)
+    for user_id, delta in user_deltas.items():
+        add_to_user_storage(user_id, delta)
+
+def timeline_day(value):
+    # The day a timeline timestamp falls on in TIME_ZONE, as TruncDate() has it.
+    return timezone.localtime(value).date()
+
 class Folder(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     parent_folder = models.ForeignKey('self', on_delete=models.CASCADE, related_name='subfolders', null=True, blank=True)
@@ -43,6 +87,22 @@ class Folder(models.Model):
     locked_at = models.DateTimeField(null=True, blank=True)
     is_protected = models.BooleanField(default=False)
     protected_at = models.DateTimeField(null=True, blank=True)
+    # Materialized path of ancestor ids, e.g. '/1/5/12/' for folder 12 under 5 under 1.
+    path = models.CharField(max_length=500, default='', blank=True, editable=False, db_index=True)
+    depth = models.PositiveIntegerField(default=0, editable=False)
+    # Bumped whenever the set of users with access to this folder changes.
+    acl_version = models.PositiveIntegerField(default=0, editable=False)
+    # Bumped on any change to the folder or anything below it; see bump_versions().
+    version = models.PositiveBigIntegerField(default=0, editable=False)
+
+    # Maintained with queryset updates; a plain save() must never write them back.
+    maintained_fields = ('size', 'path', 'depth', 'acl_version', 'version')
+    change_kind = 'folder'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['trashed_at'], condition=Q(is_trashed=True), name='folder_trashed_at_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if self.is_trashed and not self.trashed_at:
@@ -57,12 +117,437 @@ class Folder(models.Model):
             self.locked_at = timezone.now()
         if self.is_protected and not self.protected_at:
             self.protected_at = timezone.now()
-        super().save(*args, **kwargs)
+        current = None
+        if self.pk and not kwargs.get('force_insert'):
+            current = Folder.objects.filter(pk=self.pk).values(
+                'is_shared', 'is_trashed', 'trashed_at', *self.maintained_fields
+            ).first()
+        if current:
+            for name in self.maintained_fields:
+                setattr(self, name, current[name])
+            if current['is_trashed'] and not self.is_trashed:
+                self.trashed_at = None
+            if kwargs.get('update_fields') is None:
+                kwargs['update_fields'] = [
+                    field.name for field in self._meta.concrete_fields
+                    if not field.primary_key and field.name not in self.maintained_fields
+                ]
+        parent_path = self.get_parent_path()
+        if self.pk and self.path and parent_path.startswith(self.path):
+            raise ValidationError("A folder cannot be moved into itself or one of its subfolders.")
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            moved = self.update_path(parent_path)
+            if current is None:
+                FolderAccess.objects.grant_owner(self)
+            if moved:
+                FolderAccess.objects.rebuild_inherited(self, reset=current is not None)
+            if current is not None and current['is_shared'] != self.is_shared:
+                FolderAccess.objects.sync_shares(self)
+            if current is not None and current['is_trashed'] != self.is_trashed:
+                if self.is_trashed:
+                    self.trash_subtree(self.trashed_at)
+                else:
+                    self.restore_subtree(current['trashed_at'])
+            Change.objects.record_save(self, current['is_trashed'] if current else None, path_ids(current['path']) if current else ())
+
+    def get_parent_path(self):
+        # Read from the database rather than self.parent_folder, which may be stale.
+        if not self.parent_folder_id:
+            return '/'
+        return Folder.objects.filter(pk=self.parent_folder_id).values_list('path', flat=True).first() or '/'
+
+    def update_path(self, parent_path):
+        # Keeps the path index in sync after a create or a move, re-rooting the
+        # whole subtree with a single UPDATE.
+        new_path = '{0}{1}/'.format(parent_path, self.pk)
+        old_path = self.path
+        if new_path == old_path:
+            return False
+        new_depth = new_path.count('/') - 2
+        Folder.objects.filter(pk=self.pk).update(path=new_path, depth=new_depth)
+        if old_path:
+            Folder.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (new_depth - self.depth),
+            )
+            if self.size:
+                Folder.objects.filter(pk__in=path_ids(old_path)[:-1]).update(size=Coalesce(F('size'), Value(0.0)) - self.size)
+                Folder.objects.filter(pk__in=path_ids(new_path)[:-1]).update(size=Coalesce(F('size'), Value(0.0)) + self.size)
+        self.path = new_path
+        self.depth = new_depth
+        return True
+
+    def trash_subtree(self, trashed_at):
+        # Trashes everything below this folder with one UPDATE per model. The
+        # shared trashed_at marks what went to the trash together, so that
+        # restore_subtree() leaves items that were trashed on their own alone.
+        Folder.objects.filter(path__startswith=self.path, is_trashed=False).exclude(pk=self.pk).update(
+            is_trashed=True, trashed_at=trashed_at,
+        )
+        deltas = defaultdict(float)
+        for model in (File, ImageFile, VideoFile):
+            items = model.objects.filter(folder__path__startswith=self.path, is_trashed=False)
+            for folder_id, total in items.values('folder_id').annotate(total=Sum('size')).values_list('folder_id', 'total'):
+                deltas[folder_id] -= total or 0
+            if model is ImageFile:
+                TimelineBucket.objects.add_images(items, -1)
+            items.update(is_trashed=True, trashed_at=trashed_at)
+        Folder.add_sizes(deltas)
+
+    def restore_subtree(self, trashed_at):
+        Folder.objects.filter(path__startswith=self.path, is_trashed=True, trashed_at=trashed_at).exclude(pk=self.pk).update(
+            is_trashed=False, trashed_at=None,
+        )
+        deltas = defaultdict(float)
+        for model in (File, ImageFile, VideoFile):
+            items = model.objects.filter(folder__path__startswith=self.path, is_trashed=True, trashed_at=trashed_at)
+            for folder_id, total in items.values('folder_id').annotate(total=Sum('size')).values_list('folder_id', 'total'):
+                deltas[folder_id] += total or 0
+            if model is ImageFile:
+                TimelineBucket.objects.add_images(items, 1)
+            items.update(is_trashed=False, trashed_at=None)
+        Folder.add_sizes(deltas)
+
+    @classmethod
+    def bump_versions(cls, folder_ids, subtrees=()):
+        # Marks the folders and their ancestors, plus everything below the
+        # folders in `subtrees`, as changed: their version goes up, and so does
+        # the UserVersion of everyone with access to any of them. Call it before
+        # access rows are dropped so that users losing access are reached too.
+        paths = dict(cls.objects.filter(pk__in=set(folder_ids) | set(subtrees)).values_list('pk', 'path'))
+        if not paths:
+            return
+        changed_ids = set()
+        for pk, path in paths.items():
+            changed_ids.update(path_ids(path) or [pk])
+        condition = Q(pk__in=changed_ids)
+        for pk in subtrees:
+            if paths.get(pk):
+                condition |= Q(path__startswith=paths[pk])
+        changed = cls.objects.filter(condition)
+        UserVersion.objects.bump(FolderAccess.objects.filter(folder__in=changed.values('pk')).values_list('user_id', flat=True))
+        changed.update(version=F('version') + 1)
+
+    @classmethod
+    def add_size(cls, folder_id, delta):
+        # Rolls a size change up through the folder and all of its ancestors.
+        if not delta:
+            return
+        path = cls.objects.filter(pk=folder_id).values_list('path', flat=True).first()
+        if path is None:
+            return
+        cls.objects.filter(pk__in=path_ids(path) or [folder_id]).update(size=Coalesce(F('size'), Value(0.0)) + delta)
+
+    @classmethod
+    def add_sizes(cls, deltas):
+        # Bulk add_size(): {folder_id: delta} rolled up into every ancestor and
+        # applied with one UPDATE.
+        totals = defaultdict(float)
+        for folder_id, path in cls.objects.filter(pk__in=[pk for pk, delta in deltas.items() if delta]).values_list('pk', 'path'):
+            for ancestor_id in path_ids(path) or [folder_id]:
+                totals[ancestor_id] += deltas[folder_id]
+        totals = {pk: delta for pk, delta in totals.items() if delta}
+        if totals:
+            cls.objects.filter(pk__in=totals).update(size=Coalesce(F('size'), Value(0.0)) + Case(
+                *[When(pk=pk, then=Value(delta)) for pk, delta in totals.items()],
+                output_field=models.FloatField(),
+            ))
 
     def __str__(self):
         return self.name
 
-class File(models.Model):
+class FolderAccessManager(models.Manager):
+
+    def bump_versions(self, folder):
+        # Invalidates cached ACL answers for the folder and everything below it,
+        # and the listings of everyone who could see it until now.
+        Folder.objects.filter(path__startswith=folder.path).update(acl_version=F('acl_version') + 1)
+        Folder.bump_versions([folder.pk], subtrees=[folder.pk])
+
+    def grant_owner(self, folder):
+        self.get_or_create(user_id=folder.user_id, folder=folder, granted_via=folder, defaults={'role': FolderAccess.OWNER})
+
+    def get_shared_users(self, folder):
+        return set(self.filter(folder=folder, role=FolderAccess.SHARED).values_list('user_id', flat=True))
+
+    def sync_shares(self, folder):
+        # Re-grants `folder`'s shared_with users on its whole subtree. Users
+        # who gain or lose the subtree are told to resync.
+        before = self.get_shared_users(folder)
+        self.grant_shares(folder)
+        Change.objects.reset(sorted(before ^ self.get_shared_users(folder)))
+
+    def grant_shares(self, folder):
+        self.bump_versions(folder)
+        self.filter(granted_via=folder, role=FolderAccess.SHARED).delete()
+        if not folder.is_shared or folder.is_deleted:
+            return
+        user_ids = list(folder.shared_with.values_list('pk', flat=True))
+        if not user_ids:
+            return
+        UserVersion.objects.bump(user_ids)
+        subtree_ids = Folder.objects.filter(path__startswith=folder.path).values_list('pk', flat=True)
+        self.bulk_create(
+            [
+                FolderAccess(user_id=user_id, folder_id=folder_id, granted_via=folder, role=FolderAccess.SHARED)
+                for folder_id in subtree_ids.iterator()
+                for user_id in user_ids
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    def rebuild_inherited(self, folder, reset=True):
+        # After a create or move, replaces the grants the subtree inherited from
+        # its old ancestors with the ones held by its new parent. Users who gain
+        # or lose the moved subtree are told to resync; a new folder's created
+        # entry already reaches its viewers (reset=False).
+        before = self.get_shared_users(folder)
+        self.inherit_grants(folder)
+        if reset:
+            Change.objects.reset(sorted(before ^ self.get_shared_users(folder)))
+
+    def inherit_grants(self, folder):
+        subtree = Folder.objects.filter(path__startswith=folder.path)
+        self.bump_versions(folder)
+        self.filter(folder__in=subtree, role=FolderAccess.SHARED).exclude(granted_via__in=subtree).delete()
+        if not folder.parent_folder_id:
+            return
+        grants = list(self.filter(folder_id=folder.parent_folder_id, role=FolderAccess.SHARED).values_list('user_id', 'granted_via_id'))
+        if not grants:
+            return
+        UserVersion.objects.bump({user_id for user_id, _ in grants})
+        self.bulk_create(
+            [
+                FolderAccess(user_id=user_id, folder_id=folder_id, granted_via_id=granted_via_id, role=FolderAccess.SHARED)
+                for folder_id in subtree.values_list('pk', flat=True).iterator()
+                for user_id, granted_via_id in grants
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+class FolderAccess(models.Model):
+    # Denormalized "who can see which folder": one owner row per folder plus
+    # one row per shared_with user on every folder below a shared folder.
+    # `granted_via` is the folder whose share produced the row.
+    OWNER = 'owner'
+    SHARED = 'shared'
+    ROLE_CHOICES = [(OWNER, 'Owner'), (SHARED, 'Shared')]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='folder_access')
+    folder = models.ForeignKey(Folder, on_delete=models.CASCADE, related_name='access')
+    granted_via = models.ForeignKey(Folder, on_delete=models.CASCADE, related_name='granted_access')
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES)
+
+    objects = FolderAccessManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'folder', 'granted_via'], name='unique_folder_access_grant'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'role', 'folder']),
+        ]
+
+    def __str__(self):
+        return '{0} {1} {2}'.format(self.user_id, self.role, self.folder_id)
+
+class BlobManager(models.Manager):
+
+    def store(self, user_id, stored_file):
+        # Points `stored_file` at the user's blob for its content, writing the
+        # bytes to storage only if no identical blob exists yet.
+        content = stored_file.file
+        digest = getattr(content, 'sha256', None) or file_sha256(content)
+        blob = self.acquire(user_id, digest)
+        if blob is None:
+            extension = os.path.splitext(stored_file.name)[1].lower()
+            blob = Blob(user_id=user_id, sha256=digest, size=stored_file.size, ref_count=1)
+            blob.file.save(digest + extension, content, save=False)
+            try:
+                with transaction.atomic():
+                    blob.save()
+            except IntegrityError:
+                # Lost a race with an identical upload; keep theirs.
+                blob.file.storage.delete(blob.file.name)
+                blob = self.acquire(user_id, digest)
+        stored_file.name = blob.file.name
+        stored_file._committed = True
+        return blob
+
+    def store_many(self, user_id, stored_files, workers=None):
+        # Batch version of store(): one query for the blobs that already exist,
+        # concurrent storage writes for new content and a single bulk insert.
+        # Call it inside a transaction; returns the blobs in input order.
+        digests = [getattr(f.file, 'sha256', None) or file_sha256(f.file) for f in stored_files]
+        counts = Counter(digests)
+        sources = {}
+        for digest, stored_file in zip(digests, stored_files):
+            sources.setdefault(digest, stored_file)
+        known = set(self.filter(user_id=user_id, sha256__in=counts).values_list('sha256', flat=True))
+        new_blobs = [
+            Blob(user_id=user_id, sha256=digest, size=sources[digest].size, ref_count=counts[digest])
+            for digest in counts if digest not in known
+        ]
+
+        def write(blob):
+            extension = os.path.splitext(sources[blob.sha256].name)[1].lower()
+            blob.file.save(blob.sha256 + extension, sources[blob.sha256].file, save=False)
+
+        with ThreadPoolExecutor(max_workers=workers or settings.BATCH_UPLOAD_WORKERS) as executor:
+            list(executor.map(write, new_blobs))
+
+        blobs = {}
+        by_count = defaultdict(list)
+        for digest in known:
+            by_count[counts[digest]].append(digest)
+        for count, group in by_count.items():
+            self.filter(user_id=user_id, sha256__in=group).update(ref_count=F('ref_count') + count)
+        blobs.update((blob.sha256, blob) for blob in self.filter(user_id=user_id, sha256__in=known))
+        try:
+            with transaction.atomic():
+                self.bulk_create(new_blobs)
+            blobs.update((blob.sha256, blob) for blob in new_blobs)
+        except IntegrityError:
+            # Raced with identical uploads; settle each new blob on its own.
+            for blob in new_blobs:
+                existing = self.acquire(user_id, blob.sha256, blob.ref_count)
+                if existing is None:
+                    blob.save()
+                else:
+                    blob.file.storage.delete(blob.file.name)
+                blobs[blob.sha256] = existing or blob
+        for digest in counts:
+            if digest not in blobs:
+                # Collected between the lookup and the update above.
+                blob = self.store(user_id, sources[digest])
+                self.filter(pk=blob.pk).update(ref_count=F('ref_count') + counts[digest] - 1)
+                blobs[digest] = blob
+        for digest, stored_file in zip(digests, stored_files):
+            stored_file.name = blobs[digest].file.name
+            stored_file._committed = True
+        return [blobs[digest] for digest in digests]
+
+    def acquire(self, user_id, digest, count=1):
+        if self.filter(user_id=user_id, sha256=digest).update(ref_count=F('ref_count') + count):
+            return self.get(user_id=user_id, sha256=digest)
+        return None
+
+    def release(self, blob_id):
+        self.filter(pk=blob_id).update(ref_count=F('ref_count') - 1)
+        transaction.on_commit(lambda: self.collect(blob_id))
+
+    def release_many(self, blob_ids, collect=True):
+        # release() for a batch of references, one UPDATE per distinct count.
+        # With collect=False, unreferenced blobs are left for collect_many().
+        by_count = defaultdict(list)
+        for blob_id, count in Counter(pk for pk in blob_ids if pk).items():
+            by_count[count].append(blob_id)
+        for count, group in by_count.items():
+            self.filter(pk__in=group).update(ref_count=F('ref_count') - count)
+        released = [pk for group in by_count.values() for pk in group]
+        if collect:
+            transaction.on_commit(lambda: [self.collect(blob_id) for blob_id in released])
+        return released
+
+    def collect_many(self, blob_ids):
+        # Removes the rows of the given blobs that are no longer referenced and
+        # returns {id: storage name} for them; deleting the stored objects is
+        # up to the caller.
+        with transaction.atomic():
+            rows = dict(self.select_for_update().filter(pk__in=blob_ids, ref_count__lte=0).values_list('pk', 'file'))
+            self.filter(pk__in=rows).delete()
+        return rows
+
+    def collect(self, blob_id):
+        # The conditional delete loses to any concurrent acquire().
+        name = self.filter(pk=blob_id, ref_count__lte=0).values_list('file', flat=True).first()
+        if name and self.filter(pk=blob_id, ref_count__lte=0).delete()[0]:
+            Blob._meta.get_field('file').storage.delete(name)
+
+class Blob(models.Model):
+    # One stored object per distinct content per user, shared by every File,
+    # ImageFile and VideoFile row with those bytes and reference counted.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='blobs')
+    sha256 = models.CharField(max_length=64)
+    size = models.BigIntegerField()
+    file = models.FileField(upload_to=blob_directory_path, max_length=255)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = BlobManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'sha256'], name='unique_user_blob'),
+        ]
+
+    def __str__(self):
+        return self.sha256
+
+class ContentAddressedMixin:
+    # Routes new uploads through the blob store and drops the reference to
+    # the previous blob when the file is replaced; deletes are released by
+    # the post_delete receiver in signals.py.
+
+    def save(self, *args, **kwargs):
+        stored_file = getattr(self, self.stored_file_field)
+        previous_blob_id = previous_name = None
+        if self.pk:
+            previous_blob_id, previous_name = type(self).objects.filter(pk=self.pk).values_list(
+                'blob_id', self.stored_file_field
+            ).first() or (None, None)
+        with transaction.atomic():
+            if stored_file and not stored_file._committed:
+                self.blob = Blob.objects.store(self.user_id, stored_file)
+            elif self.pk and self.blob_id and stored_file.name != previous_name:
+                # Replaced with a file written to storage directly.
+                self.blob = None
+            super().save(*args, **kwargs)
+            if previous_blob_id and previous_blob_id != self.blob_id:
+                Blob.objects.release(previous_blob_id)
+
+class StorageAccountingMixin:
+    # Keeps Folder.size and the owner's CustomUser.storage in step with this
+    # row on create, replace, trash, restore and move, and journals the
+    # change. Deletes are handled by the post_delete receivers in signals.py
+    # so cascades are covered too.
+    stored_file_field = 'file'
+    change_kind = 'file'
+
+    def get_accounting_state(self):
+        return {'folder_id': self.folder_id, 'user_id': self.user_id, 'size': self.size, 'is_trashed': self.is_trashed}
+
+    def apply_accounting_change(self, previous, current):
+        apply_size_change(previous, current)
+
+    def replace_stored_file(self):
+        # Called before an existing row is saved with a different stored file,
+        # to drop or re-read whatever was derived from the old one.
+        pass
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            # The row stays locked until the save commits, so concurrent saves
+            # each apply their change against the state the other one left.
+            previous = None
+            if self.pk:
+                previous = type(self).objects.select_for_update().filter(pk=self.pk).values(
+                    *self.get_accounting_state(), self.stored_file_field
+                ).first()
+            stored_file = getattr(self, self.stored_file_field)
+            replaced = previous is not None and previous[self.stored_file_field] != stored_file.name
+            if stored_file and (not stored_file._committed or replaced or self.size is None):
+                self.size = stored_file.size
+            if replaced:
+                self.replace_stored_file()
+            super().save(*args, **kwargs)
+            self.apply_accounting_change(previous, self.get_accounting_state())
+            Change.objects.record_save(self, previous['is_trashed'] if previous else None, [previous['folder_id']] if previous else ())
+
+class File(StorageAccountingMixin, ContentAddressedMixin, models.Model):
     folder = models.ForeignKey(Folder, on_delete=models.CASCADE, related_name='files')
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     name = models.CharField(max_length=50)
@@ -70,7 +555,8 @@ class File(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     size = models.FloatField(null=True, blank=True)
-    file = models.FileField(upload_to=user_directory_path)
+    file = models.FileField(upload_to=user_directory_path, max_length=255)
+    blob = models.ForeignKey('Blob', on_delete=models.RESTRICT, related_name='+', null=True, blank=True, editable=False)
     is_public = models.BooleanField(default=False)
     is_shared = models.BooleanField(default=False)
     shared_at = models.DateTimeField(auto_now_add=True)
@@ -87,6 +573,13 @@ class File(models.Model):
     is_protected = models.BooleanField(default=False)
     protected_at = models.DateTimeField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id']),
+            models.Index(fields=['folder', '-created_at', '-id']),
+            models.Index(fields=['trashed_at'], condition=Q(is_trashed=True), name='file_trashed_at_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if self.is_trashed and not self.trashed_at:
             self.trashed_at = timezone.now()
@@ -105,13 +598,18 @@ class File(models.Model):
     def __str__(self):
         return self.name
 
-class ImageFile(models.Model):
+class ImageFile(StorageAccountingMixin, ContentAddressedMixin, models.Model):
+    stored_file_field = 'image'
+    change_kind = 'image'
+
     folder = models.ForeignKey(Folder, on_delete=models.CASCADE, related_name='images')
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     name = models.CharField(max_length=150, default='Image')
-    image = models.ImageField(upload_to=user_image_directory_path)
+    image = models.ImageField(upload_to=user_image_directory_path, max_length=255)
+    blob = models.ForeignKey('Blob', on_delete=models.RESTRICT, related_name='+', null=True, blank=True, editable=False)
     image_height = models.IntegerField(null=True, blank=True)
     image_width = models.IntegerField(null=True, blank=True)
+    size = models.FloatField(null=True, blank=True)
     is_trashed = models.BooleanField(default=False)
     trashed_at = models.DateTimeField(null=True, blank=True)
     is_deleted = models.BooleanField(default=False)
@@ -126,6 +624,70 @@ class ImageFile(models.Model):
     protected_at = models.DateTimeField(null=True, blank=True)
     is_archived = models.BooleanField(default=False)
     is_shared = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Storage names of the generated derivatives keyed by their longest edge,
+    # and a tiny inline placeholder; both are filled in by derivatives.py.
+    thumbnails = models.JSONField(default=dict, blank=True, editable=False)
+    placeholder = models.TextField(default='', blank=True, editable=False)
+    # Read from the EXIF headers on ingest; see metadata.py. metadata_probed
+    # records that the headers were read, whether or not they had these.
+    metadata_probed = models.BooleanField(default=False, editable=False)
+    taken_at = models.DateTimeField(null=True, blank=True)
+    # Where the photo sits on the timeline: see set_timeline_at().
+    timeline_at = models.DateTimeField(null=True, blank=True, editable=False)
+    camera_model = models.CharField(max_length=100, default='', blank=True)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    # 64-bit dHash plus its four 16-bit bands, indexed for near-duplicate
+    # search; see similarity.py.
+    phash = models.BigIntegerField(null=True, blank=True, editable=False)
+    phash_0 = models.IntegerField(null=True, blank=True, editable=False)
+    phash_1 = models.IntegerField(null=True, blank=True, editable=False)
+    phash_2 = models.IntegerField(null=True, blank=True, editable=False)
+    phash_3 = models.IntegerField(null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id']),
+            models.Index(fields=['folder', '-created_at', '-id']),
+            models.Index(fields=['user', '-taken_at', '-id']),
+            models.Index(fields=['user', 'camera_model']),
+            models.Index(fields=['user', 'phash_0']),
+            models.Index(fields=['user', 'phash_1']),
+            models.Index(fields=['user', 'phash_2']),
+            models.Index(fields=['user', 'phash_3']),
+            models.Index(fields=['trashed_at'], condition=Q(is_trashed=True), name='imagefile_trashed_at_idx'),
+            models.Index(fields=['user', '-timeline_at', '-id'], condition=Q(is_trashed=False), name='imagefile_timeline_idx'),
+        ]
+
+    def get_accounting_state(self):
+        return {**super().get_accounting_state(), 'timeline_at': self.timeline_at}
+
+    def apply_accounting_change(self, previous, current):
+        super().apply_accounting_change(previous, current)
+        TimelineBucket.objects.apply_change(previous, current)
+
+    def set_timeline_at(self):
+        # The capture time when the EXIF headers have one, else the upload time.
+        self.timeline_at = self.taken_at or self.created_at or timezone.now()
+
+    def replace_stored_file(self):
+        # The metadata is read again from the new file, which also moves the
+        # photo to its timeline day. The old derivatives no longer match: they
+        # are cleared here, and the post_save receiver in signals.py deletes
+        # their files and queues new ones from stale_derivatives.
+        for name in IMAGE_METADATA_FIELDS:
+            setattr(self, name, self._meta.get_field(name).get_default())
+        self.metadata_probed = False
+        metadata = read_image_metadata(self)
+        if metadata is not None:
+            apply_image_metadata(self, metadata)
+        self.set_timeline_at()
+        self.stale_derivatives = (self.blob_id, self.thumbnails)
+        self.thumbnails = {}
+        self.placeholder = ''
+        for name in ('phash', 'phash_0', 'phash_1', 'phash_2', 'phash_3'):
+            setattr(self, name, None)
 
     def save(self, *args, **kwargs):
         if self.is_trashed and not self.trashed_at:
@@ -143,36 +705,342 @@ class ImageFile(models.Model):
         if not self.pk and (self.image_height is None or self.image_width is None):
         
             if hasattr(self.image, 'file') and self.image.file:
-                img = Image.open(self.image)
-                self.image_width, self.image_height = img.size
+                metadata = read_image_metadata(self)
+                if metadata is not None:
+                    apply_image_metadata(self, metadata)
 
-       
+        self.set_timeline_at()
         super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
 
-class VideoFile(models.Model):
+class VideoFile(StorageAccountingMixin, ContentAddressedMixin, models.Model):
+    stored_file_field = 'video'
+    change_kind = 'video'
+
     folder = models.ForeignKey(Folder, on_delete=models.CASCADE, related_name='videos')
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     name = models.CharField(max_length=150, default='Video')
     video = models.FileField(
         upload_to=user_video_directory_path,
-        validators=[FileExtensionValidator(allowed_extensions=['mp4', 'avi', 'mov', 'wmv'])]
+        validators=[FileExtensionValidator(allowed_extensions=['mp4', 'avi', 'mov', 'wmv'])],
+        max_length=255,
     )
+    blob = models.ForeignKey('Blob', on_delete=models.RESTRICT, related_name='+', null=True, blank=True, editable=False)
     video_description = models.TextField(max_length=100, null=True, blank=True)
     video_thumbnail = models.ImageField(upload_to=user_thumbnail_directory_path)
+    size = models.FloatField(null=True, blank=True)
     is_trashed = models.BooleanField(default=False)
     trashed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Read from the MP4 / MOV container headers on ingest; see metadata.py.
+    duration = models.FloatField(null=True, blank=True)
+    video_width = models.IntegerField(null=True, blank=True)
+    video_height = models.IntegerField(null=True, blank=True)
+    video_codec = models.CharField(max_length=16, default='', blank=True)
+    recorded_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id']),
+            models.Index(fields=['folder', '-created_at', '-id']),
+            models.Index(fields=['trashed_at'], condition=Q(is_trashed=True), name='videofile_trashed_at_idx'),
+            models.Index(fields=['user', '-recorded_at', '-id']),
+            models.Index(fields=['user', 'duration']),
+            models.Index(fields=['user', 'video_height']),
+            models.Index(fields=['user', 'video_codec']),
+        ]
+
+    def replace_stored_file(self):
+        for name in VIDEO_METADATA_FIELDS:
+            setattr(self, name, self._meta.get_field(name).get_default())
+        metadata = read_video_metadata(self)
+        if metadata is not None:
+            apply_video_metadata(self, metadata)
 
     def save(self, *args, **kwargs):
         if self.is_trashed and not self.trashed_at:
             self.trashed_at = timezone.now()
+        if not self.pk and self.duration is None and hasattr(self.video, 'file') and self.video.file:
+            metadata = read_video_metadata(self)
+            if metadata is not None:
+                apply_video_metadata(self, metadata)
         super().save(*args, **kwargs)
 
     def __str__(self):
         return self.name
 
     def clean(self):
-        if self.video and self.video.size > 1024 * 1024 * 1024 * 4:  # 4 GB limit
+        if self.video and self.video.size > MAX_VIDEO_SIZE:
             raise ValidationError("Video file size cannot exceed 4 GB.")
+
+
+class FolderDeletion(models.Model):
+    # A folder subtree waiting to be hard-deleted in batches by deletions.py.
+    # The row goes away with the folder once the job has finished.
+    folder = models.OneToOneField(Folder, on_delete=models.CASCADE, related_name='deletion')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='folder_deletions')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return str(self.folder_id)
+
+class UploadSession(models.Model):
+    # A resumable upload: chunks are written straight into a preallocated file
+    # under UPLOAD_SESSION_ROOT at their offsets, and the File / ImageFile /
+    # VideoFile row is only created once every chunk has arrived.
+    FILE = 'file'
+    IMAGE = 'image'
+    VIDEO = 'video'
+    KIND_CHOICES = [(FILE, 'File'), (IMAGE, 'Image'), (VIDEO, 'Video')]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    folder = models.ForeignKey(Folder, on_delete=models.CASCADE, related_name='upload_sessions')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    name = models.CharField(max_length=150)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def chunk_count(self):
+        return (self.size + self.chunk_size - 1) // self.chunk_size
+
+    @property
+    def temp_path(self):
+        return os.path.join(settings.UPLOAD_SESSION_ROOT, str(self.id))
+
+    def chunk_length(self, index):
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    def __str__(self):
+        return self.filename
+
+class UploadChunk(models.Model):
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'index'], name='unique_upload_chunk'),
+        ]
+
+class DirectUpload(models.Model):
+    # An upload going straight from the client to the S3 bucket through
+    # presigned URLs (see direct.py). The object is written under `key`, the
+    # storage name of the blob it becomes once the upload is finalized.
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='direct_uploads')
+    folder = models.ForeignKey(Folder, on_delete=models.CASCADE, related_name='direct_uploads')
+    kind = models.CharField(max_length=10, choices=UploadSession.KIND_CHOICES)
+    name = models.CharField(max_length=150)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64)
+    key = models.CharField(max_length=255, blank=True)
+    multipart_upload_id = models.CharField(max_length=255, blank=True)
+    part_size = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @property
+    def part_count(self):
+        if not self.part_size:
+            return 1
+        return (self.size + self.part_size - 1) // self.part_size
+
+    def __str__(self):
+        return self.filename
+
+class UserVersionManager(models.Manager):
+
+    def bump(self, user_ids):
+        # Also retires the users' cached responses once the change commits.
+        if response_cache.shared:
+            user_ids = set(user_ids)
+            response_cache.invalidate(user_ids)
+        self.filter(user_id__in=user_ids).update(value=F('value') + 1)
+
+class UserVersion(models.Model):
+    # Bumped whenever anything the user can see changes (Folder.bump_versions);
+    # the validator behind ETags on the user-wide listings.
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='content_version')
+    value = models.BigIntegerField(default=0)
+
+    objects = UserVersionManager()
+
+class ChangeSequence(models.Model):
+    # Last sequence number handed out in the user's change journal.
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='change_sequence')
+    value = models.BigIntegerField(default=0)
+
+class ChangeManager(models.Manager):
+
+    def record(self, kind, action, items, folders=(), subtrees=()):
+        # Appends an entry per (user_id, object_id, folder_id) item for the
+        # owner and for every user the folder is shared with (an object can be
+        # listed under several folders, e.g. before and after a move, and each
+        # user still gets one entry), under each user's next sequence numbers,
+        # in the caller's transaction. The user's sequence row stays locked
+        # until that transaction ends, so entries commit in sequence order and
+        # a reader that has seen seq N never gets an entry below N later. Users
+        # are taken in id order to keep lock order stable. `folders` and
+        # `subtrees` are the folders whose content changed; their versions are
+        # bumped in the same transaction (Folder.bump_versions).
+        items = list(items)
+        viewers = defaultdict(list)
+        folder_ids = {folder_id for _, _, folder_id in items if folder_id}
+        if folder_ids:
+            grants = FolderAccess.objects.filter(folder_id__in=folder_ids, role=FolderAccess.SHARED)
+            for folder_id, user_id in grants.values_list('folder_id', 'user_id'):
+                viewers[folder_id].append(user_id)
+        by_user = defaultdict(dict)
+        for user_id, object_id, folder_id in items:
+            for recipient in (user_id, *viewers[folder_id]):
+                by_user[recipient].setdefault(object_id)
+        created = []
+        with transaction.atomic():
+            for user_id in sorted(by_user):
+                object_ids = list(by_user[user_id])
+                sequence = ChangeSequence.objects.filter(user_id=user_id)
+                if not sequence.update(value=F('value') + len(object_ids)):
+                    ChangeSequence.objects.get_or_create(user_id=user_id)
+                    sequence.update(value=F('value') + len(object_ids))
+                first = sequence.values_list('value', flat=True).get() - len(object_ids) + 1
+                created.extend(self.bulk_create([
+                    Change(user_id=user_id, seq=first + offset, kind=kind, action=action, object_id=object_id)
+                    for offset, object_id in enumerate(object_ids)
+                ], batch_size=1000))
+            Folder.bump_versions(folders, subtrees)
+        return created
+
+    def reset(self, user_ids):
+        # Tells these users' clients to start over, for changes the entries
+        # cannot describe, such as a subtree being shared with or unshared
+        # from them.
+        return self.record('', Change.RESET, [(user_id, None, None) for user_id in user_ids])
+
+    def record_save(self, instance, previously_trashed, previous_folders=()):
+        # previously_trashed is None for a new row; previous_folders are the
+        # folders a moved row was listed under before.
+        if previously_trashed is None:
+            action = Change.CREATED
+        elif previously_trashed != instance.is_trashed:
+            action = Change.TRASHED if instance.is_trashed else Change.RESTORED
+        else:
+            action = Change.UPDATED
+        subtrees = ()
+        if instance.change_kind == Change.FOLDER:
+            folders = [instance.pk, *previous_folders]
+            listed_in = [instance.pk]
+            if action in (Change.TRASHED, Change.RESTORED):
+                subtrees = [instance.pk]
+        else:
+            folders = listed_in = [instance.folder_id, *previous_folders]
+        items = [(instance.user_id, instance.pk, folder_id) for folder_id in listed_in]
+        return self.record(instance.change_kind, action, items, folders, subtrees)
+
+class Change(models.Model):
+    # Append-only journal of creates, updates, trash/restore and deletes of a
+    # user's folders and media, read by clients through changes/?since=.
+    # Trashing, restoring or deleting a folder is a single entry that stands
+    # for its whole subtree. RESET marks where compaction cut the journal.
+    FOLDER = 'folder'
+    FILE = 'file'
+    IMAGE = 'image'
+    VIDEO = 'video'
+    KIND_CHOICES = [(FOLDER, 'Folder'), (FILE, 'File'), (IMAGE, 'Image'), (VIDEO, 'Video')]
+    CREATED = 'created'
+    UPDATED = 'updated'
+    TRASHED = 'trashed'
+    RESTORED = 'restored'
+    DELETED = 'deleted'
+    RESET = 'reset'
+    ACTION_CHOICES = [
+        (CREATED, 'Created'), (UPDATED, 'Updated'), (TRASHED, 'Trashed'),
+        (RESTORED, 'Restored'), (DELETED, 'Deleted'), (RESET, 'Reset'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='changes')
+    seq = models.BigIntegerField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, blank=True)
+    object_id = models.BigIntegerField(null=True, blank=True)
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ChangeManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'seq'], name='unique_change_seq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'kind', 'object_id', 'seq']),
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        return '{0} {1} {2}'.format(self.action, self.kind, self.object_id)
+
+class TimelineBucketManager(models.Manager):
+
+    def add_counts(self, deltas):
+        # {(user_id, day): delta} applied with one UPDATE per user. Rows are
+        # only created for days that gain photos; a day losing some already
+        # has its row.
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        self.bulk_create(
+            [TimelineBucket(user_id=user_id, day=day) for (user_id, day), delta in deltas.items() if delta > 0],
+            ignore_conflicts=True,
+        )
+        by_user = defaultdict(dict)
+        for (user_id, day), delta in deltas.items():
+            by_user[user_id][day] = delta
+        for user_id in sorted(by_user):
+            days = by_user[user_id]
+            self.filter(user_id=user_id, day__in=days).update(count=F('count') + Case(
+                *[When(day=day, then=Value(delta)) for day, delta in days.items()],
+                output_field=models.IntegerField(),
+            ))
+
+    def apply_change(self, previous, current):
+        # The accounting states of an ImageFile before and after a save or
+        # delete, as for apply_size_change(); trashed images are off the timeline.
+        deltas = Counter()
+        for state, sign in ((previous, -1), (current, 1)):
+            if state is not None and not state['is_trashed'] and state['timeline_at'] is not None:
+                deltas[(state['user_id'], timeline_day(state['timeline_at']))] += sign
+        self.add_counts(deltas)
+
+    def add_images(self, queryset, sign):
+        # Counts the images in `queryset` onto (1) or off (-1) their days with
+        # one aggregate query; call it before an UPDATE or delete moves them.
+        rows = (
+            queryset.filter(timeline_at__isnull=False).order_by()
+            .annotate(day=TruncDate('timeline_at')).values('user_id', 'day')
+            .annotate(total=Count('pk')).values_list('user_id', 'day', 'total')
+        )
+        self.add_counts({(user_id, day): sign * total for user_id, day, total in rows})
+
+class TimelineBucket(models.Model):
+    # Untrashed ImageFiles outside deleted folders per user and timeline day,
+    # kept in step on upload, trash, restore, metadata changes and delete so
+    # the timeline can list its days, months and years without scanning the
+    # images.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='timeline_buckets')
+    day = models.DateField()
+    count = models.IntegerField(default=0)
+
+    objects = TimelineBucketManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day'], name='unique_timeline_bucket'),
+        ]
+
+    def __str__(self):
+        return '{0} {1}'.format(self.day, self.count)
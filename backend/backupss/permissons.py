@@ -1,4 +1,5 @@
 from rest_framework import permissions
+from .acl import get_folder_role, get_object_folder
 
 class IsOwnerOrShared(permissions.BasePermission):
 
@@ -9,6 +10,9 @@ class IsOwnerOrShared(permissions.BasePermission):
         return False
     
     def has_object_permission(self, request, view, obj):
-        return obj.user == request.user or request.user in obj.shared_with.all()
+        if obj.user_id == request.user.pk:
+            return True
+        folder_id, version = get_object_folder(obj)
+        return get_folder_role(request, folder_id, version) is not None
 
 
@@ -0,0 +1,116 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .bulk import delete_items, top_level
+from .deletions import queue_folder_deletion, run_deletion
+from .derivatives import unreferenced_derivatives
+from .models import Blob, File, Folder, ImageFile, VideoFile
+
+# Most keys a single S3 DeleteObjects call accepts.
+S3_DELETE_BATCH_SIZE = 1000
+
+
+def delete_stored_objects(storage, names, workers):
+    # Deletes stored objects concurrently. On S3 (django-storages) they go in
+    # DeleteObjects batches of up to 1000 keys instead of one call per key.
+    names = [name for name in names if name]
+    if not names:
+        return
+    bucket = getattr(storage, 'bucket', None)
+    if bucket is not None and hasattr(storage, '_normalize_name'):
+        from storages.utils import clean_name
+
+        keys = [storage._normalize_name(clean_name(name)) for name in names]
+        client = bucket.meta.client
+
+        def delete(batch):
+            client.delete_objects(Bucket=bucket.name, Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True})
+
+        jobs = [keys[start:start + S3_DELETE_BATCH_SIZE] for start in range(0, len(keys), S3_DELETE_BATCH_SIZE)]
+    else:
+        delete, jobs = storage.delete, names
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(delete, jobs))
+
+
+def collect_blobs(blob_ids, workers):
+    # Drops the blobs nobody references any more, then their stored objects.
+    collected = Blob.objects.collect_many(blob_ids)
+    delete_stored_objects(Blob._meta.get_field('file').storage, list(collected.values()), workers)
+    return len(collected)
+
+
+class TrashPurger:
+    # Permanently removes what has been in the trash since before `cutoff`.
+    # Work is done in committed batches found through the trashed_at indexes,
+    # so an interrupted run loses nothing and the next one carries on. The
+    # pause between batches keeps the load on the database and storage down.
+
+    def __init__(self, cutoff, batch_size, workers, pause=0, limit=None):
+        self.cutoff = cutoff
+        self.batch_size = batch_size
+        self.workers = workers
+        self.pause = pause
+        self.limit = limit
+        self.purged = 0
+
+    def expired(self, model):
+        return model.objects.filter(is_trashed=True, trashed_at__lt=self.cutoff)
+
+    def remaining(self):
+        return None if self.limit is None else self.limit - self.purged
+
+    def next_batch_size(self):
+        remaining = self.remaining()
+        return self.batch_size if remaining is None else min(self.batch_size, remaining)
+
+    def throttle(self):
+        if self.pause:
+            time.sleep(self.pause)
+
+    def purge_items(self, model):
+        purged = 0
+        fields = ['pk', 'blob_id'] + (['thumbnails'] if model is ImageFile else [])
+        while self.next_batch_size() > 0:
+            rows = list(self.expired(model).order_by('trashed_at', 'pk').values_list(*fields)[:self.next_batch_size()])
+            if not rows:
+                break
+            count = delete_items(model, self.expired(model).filter(pk__in=[row[0] for row in rows]), collect=False)
+            if model is ImageFile:
+                names = unreferenced_derivatives([(row[1], row[2]) for row in rows])
+                delete_stored_objects(ImageFile._meta.get_field('image').storage, names, self.workers)
+            collect_blobs({row[1] for row in rows if row[1]}, self.workers)
+            purged += count
+            self.purged += count
+            self.throttle()
+        return purged
+
+    def purge_folders(self):
+        purged = 0
+        while self.next_batch_size() > 0:
+            folders = top_level(self.expired(Folder).filter(is_deleted=False).only('pk', 'path')[:self.next_batch_size()])
+            if not folders:
+                break
+            for folder in folders:
+                run_deletion(queue_folder_deletion(folder, schedule=False).pk)
+            purged += len(folders)
+            self.purged += len(folders)
+            self.throttle()
+        return purged
+
+    def purge_orphaned_blobs(self):
+        # Picks up blobs released by an earlier run that stopped before
+        # collecting them.
+        collected = 0
+        while True:
+            blob_ids = list(Blob.objects.filter(ref_count__lte=0).values_list('pk', flat=True)[:self.batch_size])
+            if not blob_ids:
+                break
+            collected += collect_blobs(blob_ids, self.workers)
+            self.throttle()
+        return collected
+
+    def run(self):
+        counts = {model.__name__: self.purge_items(model) for model in (File, ImageFile, VideoFile)}
+        counts['Folder'] = self.purge_folders()
+        counts['Blob'] = self.purge_orphaned_blobs()
+        return counts
@@ -0,0 +1,105 @@
+import hashlib
+import threading
+import uuid
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.http import HttpResponse
+
+
+class ResponseCache:
+    # Rendered folder tree and listing responses, per user, keyed by a
+    # generation that every change the user can see moves on, so stale
+    # entries are never looked up again and age out through eviction.
+    #
+    # With a shared backend (Redis via RESPONSE_CACHE_URL) the generation is
+    # a random token kept in the cache: Folder.bump_versions() deletes it
+    # after commit, and a hit needs no database work at all. A process-local
+    # backend (locmem, the default) cannot see other workers' deletes, so
+    # there the generation is the user's UserVersion, one primary key lookup.
+    # Either way it is read before any data, so an entry rendered from data
+    # older than a change is stored under a generation that change retired.
+    #
+    # The backend evicts by entry count (MAX_ENTRIES for locmem, maxmemory for
+    # Redis); bodies over max_entry_size are not stored, which bounds the
+    # total size. Hit/miss counters are per process.
+    key_prefix = 'backupss:responses'
+
+    def __init__(self, alias, max_entry_size, timeout):
+        self.alias = alias
+        self.max_entry_size = max_entry_size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.counts = {'hits': 0, 'misses': 0, 'stores': 0, 'too_large': 0, 'invalidations': 0}
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counts[name] += amount
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.counts)
+        lookups = counts['hits'] + counts['misses']
+        counts['hit_rate'] = counts['hits'] / lookups if lookups else None
+        return counts
+
+    def generation_key(self, user_id):
+        return '{0}:generation:{1}'.format(self.key_prefix, user_id)
+
+    @property
+    def shared(self):
+        return not isinstance(self.backend, LocMemCache)
+
+    def get_generation(self, user_id):
+        if not self.shared:
+            from .models import UserVersion
+
+            return UserVersion.objects.get_or_create(user_id=user_id)[0].value
+        key = self.generation_key(user_id)
+        generation = self.backend.get(key)
+        if generation is None:
+            # A fresh random token, never a counter restarted from zero, so
+            # entries from before an eviction of the token stay unreachable.
+            self.backend.add(key, uuid.uuid4().hex, None)
+            generation = self.backend.get(key)
+        return generation
+
+    def make_key(self, user_id, generation, *parts):
+        digest = hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+        return '{0}:{1}:{2}:{3}'.format(self.key_prefix, user_id, generation, digest)
+
+    def get(self, key):
+        # (etag, content, content_type), or None.
+        entry = self.backend.get(key)
+        self.count('hits' if entry is not None else 'misses')
+        return entry
+
+    def set(self, key, etag, response):
+        if len(response.content) > self.max_entry_size:
+            self.count('too_large')
+            return
+        self.backend.set(key, (etag, response.content, response['Content-Type']), self.timeout)
+        self.count('stores')
+
+    def invalidate(self, user_ids):
+        keys = [self.generation_key(user_id) for user_id in set(user_ids)]
+        if keys and self.shared:
+            self.count('invalidations', len(keys))
+            transaction.on_commit(lambda: self.backend.delete_many(keys))
+
+
+def cached_response(entry):
+    etag, content, content_type = entry
+    response = HttpResponse(content, content_type=content_type)
+    response['ETag'] = etag
+    return response
+
+
+response_cache = ResponseCache(
+    settings.RESPONSE_CACHE_ALIAS, settings.RESPONSE_CACHE_MAX_ENTRY_SIZE, settings.RESPONSE_CACHE_TIMEOUT,
+)
@@ -1,30 +1,167 @@
 from rest_framework import serializers
-from rest_framework.fields import HiddenField
-from .models import Folder, File, ImageFile, VideoFile
+from rest_framework.fields import HiddenField, get_error_detail
+from rest_framework.settings import api_settings
+import os
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import models
+from .models import Folder, File, ImageFile, VideoFile, UploadSession, DirectUpload, MAX_VIDEO_SIZE
+from .acl import get_folder_role
+from .signed_urls import media_url
+from django.conf import settings
 from django.contrib.auth import get_user_model
 
-class FileSerializer(serializers.ModelSerializer):
+
+def get_query_list(request, param):
+    # Parses a comma separated query parameter such as ?fields=id,name.
+    if request is None:
+        return set()
+    value = request.query_params.get(param, '')
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+def check_folder_access(request, folder):
+    # Anything created in or moved into a folder needs the caller to own it or
+    # have it shared with them; other folders are reported as missing.
+    if get_folder_role(request, folder.pk, folder.acl_version) is None:
+        raise serializers.ValidationError('Folder not found.')
+    return folder
+
+
+class FolderFieldMixin:
+
+    def validate_folder(self, folder):
+        return check_folder_access(self.context['request'], folder)
+
+
+class DynamicFieldsMixin:
+    # On reads, ?fields= limits the output to the named fields and relations in
+    # Meta.expandable_fields are only included when named in ?expand=. Dropped
+    # relations are never evaluated, so the view can skip prefetching them.
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method != 'GET' or not self.is_top_level():
+            return fields
+        expand = get_query_list(request, 'expand')
+        for name in getattr(self.Meta, 'expandable_fields', []):
+            if name not in expand:
+                fields.pop(name, None)
+        only = get_query_list(request, 'fields')
+        if only:
+            for name in list(fields):
+                if name not in only and name not in expand:
+                    fields.pop(name)
+        return fields
+
+    def is_top_level(self):
+        # Nested serializers (e.g. files inside a folder) keep all their fields.
+        return self.parent is None or (isinstance(self.parent, serializers.ListSerializer) and self.parent.parent is None)
+
+
+def get_storage_quota(user):
+    return settings.PREMIUM_STORAGE_QUOTA if user.is_premium else settings.STORAGE_QUOTA
+
+
+class StorageQuotaMixin:
+    # Rejects uploads that would take the user past their quota. Reads the
+    # running CustomUser.storage counter, so the check never aggregates. A
+    # replacement only adds the difference to the file it replaces.
+    stored_file_field = 'file'
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        upload = attrs.get(self.stored_file_field)
+        # Partial updates skip the HiddenField default; the owner stays.
+        user = attrs.get('user', getattr(self.instance, 'user', None))
+        if upload is None or user is None:
+            return attrs
+        replaced = self.instance.size or 0 if self.instance is not None else 0
+        self.check_quota(user, upload.size - replaced)
+        return attrs
+
+    def check_quota(self, user, size):
+        used = get_user_model().objects.filter(pk=user.pk).values_list('storage', flat=True).first() or 0
+        if used + size > get_storage_quota(user):
+            raise serializers.ValidationError({self.stored_file_field: 'Storage quota exceeded.'})
+
+    def validate_stored_file(self, upload, user):
+        # The upload field's checks and the quota, for a file assembled
+        # outside a regular request (see uploads.complete_session).
+        try:
+            upload = self.fields[self.stored_file_field].run_validation(upload)
+        except serializers.ValidationError as error:
+            raise serializers.ValidationError({self.stored_file_field: error.detail})
+        except DjangoValidationError as error:
+            raise serializers.ValidationError({self.stored_file_field: get_error_detail(error)})
+        self.check_quota(user, upload.size)
+        return upload
+
+
+class MediaURLMixin:
+    # FileField / ImageField output through the signed-URL cache, so listing
+    # many items does not presign every URL again.
+
+    def to_representation(self, value):
+        if not value:
+            return None
+        if not getattr(self, 'use_url', api_settings.UPLOADED_FILES_USE_URL):
+            return value.name
+        url = media_url(value.storage, value.name)
+        request = self.context.get('request', None)
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+class MediaFileField(MediaURLMixin, serializers.FileField):
+    pass
+
+class MediaImageField(MediaURLMixin, serializers.ImageField):
+    pass
+
+MEDIA_FIELD_MAPPING = {
+    **serializers.ModelSerializer.serializer_field_mapping,
+    models.FileField: MediaFileField,
+    models.ImageField: MediaImageField,
+}
+
+
+class FileSerializer(StorageQuotaMixin, FolderFieldMixin, DynamicFieldsMixin, serializers.ModelSerializer):
     user = HiddenField(default=serializers.CurrentUserDefault())
+    serializer_field_mapping = MEDIA_FIELD_MAPPING
     
     class Meta:
         model = File
         fields = '__all__'
+        read_only_fields = ['size']
         
-class ImageFileSerializer(serializers.ModelSerializer):
+class ImageFileSerializer(StorageQuotaMixin, FolderFieldMixin, DynamicFieldsMixin, serializers.ModelSerializer):
     user = HiddenField(default=serializers.CurrentUserDefault())
+    serializer_field_mapping = MEDIA_FIELD_MAPPING
+    thumbnails = serializers.SerializerMethodField()
+    stored_file_field = 'image'
     
     class Meta:
         model = ImageFile
         fields = '__all__'
+        read_only_fields = ['size', 'placeholder', 'taken_at', 'camera_model', 'latitude', 'longitude']
+
+    def get_thumbnails(self, instance):
+        # {'256': url, '1024': url}; empty until the background worker has run.
+        storage = instance.image.storage
+        return {size: media_url(storage, name) for size, name in instance.thumbnails.items()}
 
-class VideoFileSerializer(serializers.ModelSerializer):
+class VideoFileSerializer(StorageQuotaMixin, FolderFieldMixin, DynamicFieldsMixin, serializers.ModelSerializer):
     user = HiddenField(default=serializers.CurrentUserDefault())
+    serializer_field_mapping = MEDIA_FIELD_MAPPING
+    stored_file_field = 'video'
 
     class Meta:
         model = VideoFile
         fields = '__all__'
+        read_only_fields = ['size', 'duration', 'video_width', 'video_height', 'video_codec', 'recorded_at']
 
-class FolderSerializer(serializers.ModelSerializer):
+class FolderSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     user = HiddenField(default=serializers.CurrentUserDefault())
     files = FileSerializer(many=True, read_only=True)
     images = ImageFileSerializer(many=True, read_only=True)
@@ -66,10 +203,30 @@ class FolderSerializer(serializers.ModelSerializer):
             'images',
             'videos',
         ]
+        read_only_fields = ['size']
+        expandable_fields = ['files', 'images', 'videos', 'subfolders']
+
+    def validate_parent_folder(self, parent):
+        if parent is None:
+            return parent
+        check_folder_access(self.context['request'], parent)
+        if self.instance is not None and parent.path.startswith(self.instance.path):
+            raise serializers.ValidationError('A folder cannot be moved into itself or one of its subfolders.')
+        return parent
 
     def get_subfolders(self, instance):
-        # Recursively serialize subfolders
-        serializer = FolderSerializer(instance.subfolders.all(), many=True)
+        # Children come from the prebuilt subfolder map when the view loaded the
+        # tree up front; otherwise fall back to querying this level.
+        depth = self.context.get('depth')
+        if depth is not None and depth <= 0:
+            return []
+        subfolder_map = self.context.get('subfolder_map')
+        if subfolder_map is None:
+            children = instance.subfolders.all()
+        else:
+            children = subfolder_map.get(instance.pk, [])
+        context = dict(self.context, depth=None if depth is None else depth - 1)
+        serializer = FolderSerializer(children, many=True, context=context)
         return serializer.data
     
     
@@ -135,4 +292,86 @@ class FolderSerializer(serializers.ModelSerializer):
             else:
                 VideoFile.objects.create(folder=instance, **video_data)
         
-        return instance
\ No newline at end of file
+        return instance
+
+
+class ImageBatchUploadSerializer(FolderFieldMixin, serializers.Serializer):
+    folder = serializers.PrimaryKeyRelatedField(queryset=Folder.objects.all())
+    images = serializers.ListField(
+        child=serializers.FileField(max_length=255), allow_empty=False, max_length=settings.BATCH_UPLOAD_MAX_FILES,
+    )
+
+class TimelineBucketSerializer(serializers.Serializer):
+    bucket = serializers.CharField()
+    count = serializers.IntegerField()
+
+class BulkFilterSerializer(serializers.Serializer):
+    folder = serializers.IntegerField(required=False)
+    parent_folder = serializers.IntegerField(required=False, allow_null=True)
+    is_trashed = serializers.BooleanField(required=False)
+    is_starred = serializers.BooleanField(required=False)
+
+class BulkActionSerializer(FolderFieldMixin, serializers.Serializer):
+    # Selects items either by `ids` or by `filter`; `folder` is the target of a move.
+    action = serializers.ChoiceField(choices=['trash', 'restore', 'star', 'unstar', 'move', 'delete'])
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), required=False, allow_empty=False, max_length=settings.BULK_ACTION_MAX_IDS,
+    )
+    filter = BulkFilterSerializer(required=False)
+    folder = serializers.PrimaryKeyRelatedField(queryset=Folder.objects.all(), required=False)
+
+    def validate(self, attrs):
+        if ('ids' in attrs) == ('filter' in attrs):
+            raise serializers.ValidationError('Provide either ids or filter.')
+        if 'filter' in attrs and not attrs['filter']:
+            raise serializers.ValidationError({'filter': 'Provide at least one condition.'})
+        if attrs['action'] == 'move' and 'folder' not in attrs:
+            raise serializers.ValidationError({'folder': 'This field is required to move items.'})
+        return attrs
+
+class UploadLimitsMixin(FolderFieldMixin):
+    # Checks shared by uploads whose bytes arrive outside this request: the
+    # target folder, the declared size and format, and the storage quota.
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        if attrs['size'] <= 0:
+            raise serializers.ValidationError({'size': 'Must be a positive number of bytes.'})
+        if attrs['kind'] == UploadSession.VIDEO:
+            if attrs['size'] > MAX_VIDEO_SIZE:
+                raise serializers.ValidationError({'size': 'Video file size cannot exceed 4 GB.'})
+            extension = os.path.splitext(attrs['filename'])[1][1:].lower()
+            if extension not in VideoFile._meta.get_field('video').validators[0].allowed_extensions:
+                raise serializers.ValidationError({'filename': 'Unsupported video format.'})
+        user = attrs['user']
+        used = get_user_model().objects.filter(pk=user.pk).values_list('storage', flat=True).first() or 0
+        if used + attrs['size'] > get_storage_quota(user):
+            raise serializers.ValidationError({'size': 'Storage quota exceeded.'})
+        return attrs
+
+class UploadSessionSerializer(UploadLimitsMixin, serializers.ModelSerializer):
+    user = HiddenField(default=serializers.CurrentUserDefault())
+    chunk_size = serializers.IntegerField(required=False, min_value=1)
+    chunk_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'user', 'kind', 'folder', 'name', 'filename', 'size', 'chunk_size', 'chunk_count', 'created_at']
+
+    def validate(self, attrs):
+        attrs.setdefault('chunk_size', settings.UPLOAD_CHUNK_SIZE)
+        if attrs['chunk_size'] > settings.UPLOAD_MAX_CHUNK_SIZE:
+            raise serializers.ValidationError({'chunk_size': 'Chunks cannot exceed {0} bytes.'.format(settings.UPLOAD_MAX_CHUNK_SIZE)})
+        return super().validate(attrs)
+
+class DirectUploadSerializer(UploadLimitsMixin, serializers.ModelSerializer):
+    user = HiddenField(default=serializers.CurrentUserDefault())
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$')
+
+    class Meta:
+        model = DirectUpload
+        fields = ['id', 'user', 'kind', 'folder', 'name', 'filename', 'size', 'sha256', 'part_size', 'created_at']
+        read_only_fields = ['part_size']
+
+    def validate_sha256(self, value):
+        return value.lower()
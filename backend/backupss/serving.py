@@ -0,0 +1,265 @@
+import hashlib
+import mimetypes
+import os
+import uuid
+from urllib.parse import quote
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header, http_date, parse_etags, parse_http_date_safe, quote_etag
+
+READ_BLOCK_SIZE = 64 * 1024
+# More ranges than this (after merging) are answered with the whole file.
+MAX_RANGES = 16
+
+
+def is_s3_storage(storage):
+    return getattr(storage, 'bucket', None) is not None and hasattr(storage, '_normalize_name')
+
+
+def s3_key(storage, name):
+    from storages.utils import clean_name
+
+    return storage._normalize_name(clean_name(name))
+
+
+def iter_stored_range(storage, name, start, end):
+    # Yields bytes start..end (inclusive) of a stored object, reading nothing
+    # outside that span: a seek on local files, a ranged GET on S3.
+    length = end - start + 1
+    if is_s3_storage(storage):
+        body = storage.bucket.meta.client.get_object(
+            Bucket=storage.bucket.name, Key=s3_key(storage, name), Range='bytes={0}-{1}'.format(start, end),
+        )['Body']
+        yield from body.iter_chunks(READ_BLOCK_SIZE)
+        return
+    with storage.open(name, 'rb') as fileobj:
+        fileobj.seek(start)
+        while length > 0:
+            block = fileobj.read(min(READ_BLOCK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+class StoredRangeReader:
+    # A minimal seekable file over a stored S3 object that fetches only the
+    # spans being read, with a small read-ahead so header parsers doing many
+    # tiny reads cost a few ranged GETs rather than one each.
+    read_ahead = READ_BLOCK_SIZE
+
+    def __init__(self, storage, name, size):
+        self.storage = storage
+        self.name = name
+        self.size = size
+        self.position = 0
+        self.buffer_start = 0
+        self.buffer = b''
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self.position, os.SEEK_END: self.size}[whence]
+        self.position = max(base + offset, 0)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        end = self.size if size is None or size < 0 else min(self.position + size, self.size)
+        if end <= self.position:
+            return b''
+        buffer_end = self.buffer_start + len(self.buffer)
+        if not self.buffer_start <= self.position or end > buffer_end:
+            fetch_end = min(max(end, self.position + self.read_ahead), self.size)
+            self.buffer_start = self.position
+            self.buffer = b''.join(iter_stored_range(self.storage, self.name, self.position, fetch_end - 1))
+        data = self.buffer[self.position - self.buffer_start:end - self.buffer_start]
+        self.position += len(data)
+        return data
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_stored_file(storage, name, size=None):
+    # Local files are opened as usual; S3 objects get a ranged reader instead
+    # of S3File, which fetches the entire object on first read.
+    if is_s3_storage(storage):
+        return StoredRangeReader(storage, name, storage.size(name) if size is None else int(size))
+    return storage.open(name, 'rb')
+
+
+def parse_ranges(header, size):
+    # Parses "bytes=0-99,-500,1000-" into merged inclusive (start, end)
+    # pairs. None means the header should be ignored (absent, malformed or
+    # too fragmented); an empty list means none of it can be satisfied.
+    if not header or not header.startswith('bytes='):
+        return None
+    ranges = []
+    for part in header[len('bytes='):].split(','):
+        first, separator, last = part.strip().partition('-')
+        if not separator:
+            return None
+        try:
+            if first:
+                start = int(first)
+                end = min(int(last), size - 1) if last else size - 1
+                if last and int(last) < start:
+                    return None
+            else:
+                start, end = max(size - int(last), 0), size - 1
+        except ValueError:
+            return None
+        if start <= end:
+            ranges.append((start, end))
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        else:
+            merged.append((start, end))
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+class StoredFileResponder:
+    # Serves a File / ImageFile / VideoFile's stored bytes with HTTP caching
+    # validators and byte ranges, or hands the transfer to the front proxy
+    # when MEDIA_SERVE_OFFLOAD is set.
+
+    def __init__(self, request, item, as_attachment=False):
+        self.request = request
+        self.item = item
+        self.stored_file = getattr(item, item.stored_file_field)
+        self.storage = self.stored_file.storage
+        self.name = self.stored_file.name
+        self.size = int(item.size) if item.size is not None else self.storage.size(self.name)
+        self.content_type = mimetypes.guess_type(self.name)[0] or 'application/octet-stream'
+        self.as_attachment = as_attachment
+
+    @property
+    def etag(self):
+        # Content addressed, so the blob hash is a strong validator.
+        if self.item.blob_id:
+            return quote_etag(self.item.blob.sha256)
+        return quote_etag(hashlib.sha256('{0}:{1}'.format(self.name, self.size).encode()).hexdigest())
+
+    @property
+    def last_modified(self):
+        modified = getattr(self.item, 'updated_at', None) or self.item.created_at
+        return int(modified.timestamp())
+
+    @property
+    def filename(self):
+        name = self.item.name or os.path.basename(self.name)
+        extension = os.path.splitext(self.name)[1]
+        return name if not extension or name.lower().endswith(extension) else name + extension
+
+    def is_not_modified(self):
+        if_none_match = self.request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            etag = self.etag.removeprefix('W/')
+            return if_none_match.strip() == '*' or etag in [tag.removeprefix('W/') for tag in parse_etags(if_none_match)]
+        modified_since = parse_http_date_safe(self.request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        return modified_since is not None and self.last_modified <= modified_since
+
+    def range_allowed(self):
+        # If-Range: only honour the Range header if the client's copy is current.
+        if_range = self.request.META.get('HTTP_IF_RANGE')
+        if not if_range:
+            return True
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            return if_range == self.etag
+        return parse_http_date_safe(if_range) == self.last_modified
+
+    def add_headers(self, response):
+        response['ETag'] = self.etag
+        response['Last-Modified'] = http_date(self.last_modified)
+        response['Accept-Ranges'] = 'bytes'
+        response['Cache-Control'] = 'private, max-age=0, must-revalidate'
+        response['Content-Disposition'] = content_disposition_header(self.as_attachment, self.filename)
+        return response
+
+    def respond(self):
+        if self.is_not_modified():
+            return self.add_headers(HttpResponse(status=304))
+        offload = settings.MEDIA_SERVE_OFFLOAD
+        if offload:
+            return self.add_headers(self.offload(offload))
+        ranges = parse_ranges(self.request.META.get('HTTP_RANGE'), self.size) if self.range_allowed() else None
+        if ranges == []:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */{0}'.format(self.size)
+            return self.add_headers(response)
+        if ranges is None:
+            response = self.full_response()
+        elif len(ranges) == 1:
+            response = self.single_range_response(*ranges[0])
+        else:
+            response = self.multi_range_response(ranges)
+        return self.add_headers(response)
+
+    def body(self, iterator):
+        return [] if self.request.method == 'HEAD' else iterator
+
+    def offload(self, mode):
+        # The proxy does the transfer (with its own Range support) once the
+        # permission check has passed here.
+        response = HttpResponse(content_type=self.content_type)
+        if mode == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + quote(self.name)
+        else:
+            response['X-Sendfile'] = self.storage.path(self.name)
+        return response
+
+    def full_response(self):
+        if self.request.method == 'HEAD':
+            response = HttpResponse(content_type=self.content_type)
+        elif is_s3_storage(self.storage):
+            response = StreamingHttpResponse(iter_stored_range(self.storage, self.name, 0, self.size - 1), content_type=self.content_type)
+        else:
+            # FileResponse lets the WSGI server's file wrapper use sendfile().
+            response = FileResponse(self.storage.open(self.name, 'rb'), content_type=self.content_type)
+        response['Content-Length'] = self.size
+        return response
+
+    def single_range_response(self, start, end):
+        response = StreamingHttpResponse(
+            self.body(iter_stored_range(self.storage, self.name, start, end)), status=206, content_type=self.content_type,
+        )
+        response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(start, end, self.size)
+        response['Content-Length'] = end - start + 1
+        return response
+
+    def multi_range_response(self, ranges):
+        boundary = uuid.uuid4().hex
+        parts = [
+            (
+                '\r\n--{0}\r\nContent-Type: {1}\r\nContent-Range: bytes {2}-{3}/{4}\r\n\r\n'.format(
+                    boundary, self.content_type, start, end, self.size,
+                ).encode('ascii'),
+                start,
+                end,
+            )
+            for start, end in ranges
+        ]
+        closing = '\r\n--{0}--\r\n'.format(boundary).encode('ascii')
+
+        def stream():
+            for header, start, end in parts:
+                yield header
+                yield from iter_stored_range(self.storage, self.name, start, end)
+            yield closing
+
+        response = StreamingHttpResponse(
+            self.body(stream()), status=206, content_type='multipart/byteranges; boundary={0}'.format(boundary),
+        )
+        response['Content-Length'] = sum(len(header) + end - start + 1 for header, start, end in parts) + len(closing)
+        return response
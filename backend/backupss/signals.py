@@ -0,0 +1,61 @@
+from functools import partial
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from .models import Blob, Change, Folder, FolderAccess, File, ImageFile, VideoFile
+from .derivatives import discard_derivatives, schedule_derivatives
+
+
+@receiver(post_delete, sender=File)
+@receiver(post_delete, sender=ImageFile)
+@receiver(post_delete, sender=VideoFile)
+def release_storage(sender, instance, **kwargs):
+    instance.apply_accounting_change(instance.get_accounting_state(), None)
+    if instance.blob_id:
+        Blob.objects.release(instance.blob_id)
+    if sender is ImageFile:
+        discard_derivatives([(instance.blob_id, instance.thumbnails)])
+
+
+@receiver(post_delete, sender=Folder)
+@receiver(post_delete, sender=File)
+@receiver(post_delete, sender=ImageFile)
+@receiver(post_delete, sender=VideoFile)
+def journal_deletion(sender, instance, origin=None, **kwargs):
+    # Nothing to journal when the owner is deleted along with it, or for
+    # folders whose deletion was journaled when it was queued.
+    if getattr(origin, 'model', type(origin)) is get_user_model():
+        return
+    if sender is Folder and instance.is_deleted:
+        return
+    folder_id = instance.parent_folder_id if sender is Folder else instance.folder_id
+    Change.objects.record(instance.change_kind, Change.DELETED, [(instance.user_id, instance.pk, folder_id)], [folder_id])
+
+
+@receiver(m2m_changed, sender=Folder.shared_with.through)
+def sync_folder_access(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            FolderAccess.objects.sync_shares(instance)
+        return
+    # Changed from the user side: instance is the user, pk_set the folders.
+    if action == 'pre_clear':
+        instance._cleared_shared_folders = list(instance.shared_with.all())
+    elif action == 'post_clear':
+        for folder in getattr(instance, '_cleared_shared_folders', []):
+            FolderAccess.objects.sync_shares(folder)
+    elif action in ('post_add', 'post_remove'):
+        for folder in Folder.objects.filter(pk__in=pk_set):
+            FolderAccess.objects.sync_shares(folder)
+
+
+@receiver(post_save, sender=ImageFile)
+def queue_image_derivatives(sender, instance, created, **kwargs):
+    # New images, and images whose stored file was replaced, get derivatives
+    # rendered from their file; replaced ones lose the old ones first.
+    stale = instance.__dict__.pop('stale_derivatives', None)
+    if stale is not None:
+        discard_derivatives([stale])
+    if created or stale is not None:
+        transaction.on_commit(partial(schedule_derivatives, instance.pk))
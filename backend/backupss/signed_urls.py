@@ -0,0 +1,106 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from django.conf import settings
+from .serving import is_s3_storage
+
+WINDOW_SIGNATURE_VERSION = 's3v4-window-query'
+signing = threading.local()
+
+
+def register_window_signer(client):
+    # Signs GetObject URLs with SigV4 dated at signing.timestamp rather than
+    # the clock while one is set. botocore is only needed with the S3 backend.
+    from botocore.auth import AUTH_TYPE_MAPS, S3SigV4QueryAuth
+
+    if WINDOW_SIGNATURE_VERSION not in AUTH_TYPE_MAPS:
+
+        class WindowS3SigV4QueryAuth(S3SigV4QueryAuth):
+
+            def _modify_request_before_signing(self, request):
+                request.context['timestamp'] = signing.timestamp
+                super()._modify_request_before_signing(request)
+
+        AUTH_TYPE_MAPS[WINDOW_SIGNATURE_VERSION] = WindowS3SigV4QueryAuth
+    client.meta.events.register_first('choose-signer.s3.GetObject', choose_window_signer, unique_id='signed-url-window')
+
+
+def choose_window_signer(signature_version, **kwargs):
+    if signature_version == 's3v4-query' and getattr(signing, 'timestamp', None):
+        return WINDOW_SIGNATURE_VERSION
+    return None
+
+
+class SignedURLCache:
+    # Presigned URLs per object, reused for the rest of the time window they
+    # were signed in. Listings then skip the signing work for objects they
+    # have already shown, and browsers and CDNs see the same URL on every
+    # request. A window is half the signature's lifetime, so a URL always has
+    # at least half its validity left when it is handed out. The least
+    # recently used entries are evicted beyond max_entries. URLs are signed as
+    # of the window's start, so they are the same in every process and expire
+    # a full lifetime after it.
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_window_length(self, storage):
+        return max(storage.querystring_expire // 2, 1)
+
+    def get_window(self, storage, now=None):
+        return int((time.time() if now is None else now) // self.get_window_length(storage))
+
+    def sign(self, storage, name, window):
+        start = datetime.fromtimestamp(window * self.get_window_length(storage), timezone.utc)
+        register_window_signer(storage.bucket.meta.client)
+        signing.timestamp = start.strftime('%Y%m%dT%H%M%SZ')
+        try:
+            return storage.url(name)
+        finally:
+            signing.timestamp = None
+
+    def url(self, storage, name, now=None):
+        key = (storage.bucket_name, storage.location, name)
+        window = self.get_window(storage, now)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == window:
+                self.entries.move_to_end(key)
+                return entry[1]
+        url = self.sign(storage, name, window)
+        with self.lock:
+            self.entries[key] = (window, url)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return url
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+signed_url_cache = SignedURLCache(settings.SIGNED_URL_CACHE_SIZE)
+
+
+def signs_urls(storage):
+    return is_s3_storage(storage) and storage.querystring_auth
+
+
+def get_url_window(storage):
+    # The window media URLs handed out now belong to, or None when they never
+    # change; anything caching rendered URLs has to be keyed on it.
+    return signed_url_cache.get_window(storage) if signs_urls(storage) else None
+
+
+def media_url(storage, name):
+    # storage.url(name), going through the cache when the URL is signed.
+    # Unsigned URLs (local files, public buckets) are cheap and stable as is.
+    if not name:
+        return None
+    if signs_urls(storage):
+        return signed_url_cache.url(storage, name)
+    return storage.url(name)
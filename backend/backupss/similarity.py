@@ -0,0 +1,104 @@
+from collections import defaultdict
+from django.db.models import Q
+from PIL import Image
+
+BAND_COUNT = 4
+BAND_BITS = 16
+BAND_MASK = (1 << BAND_BITS) - 1
+# With four bands and one flipped bit probed per band, the pigeonhole
+# principle guarantees every match up to this distance is found.
+MAX_DISTANCE = 2 * BAND_COUNT - 1
+DEFAULT_DISTANCE = 4
+
+
+def dhash(img):
+    # 64-bit difference hash: is each pixel brighter than its right neighbour
+    # on a 9x8 grayscale thumbnail.
+    pixels = list(img.convert('L').resize((9, 8), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def to_signed(value):
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def split_bands(value):
+    value = to_unsigned(value)
+    return [(value >> (BAND_BITS * band)) & BAND_MASK for band in range(BAND_COUNT)]
+
+
+def hash_fields(value):
+    fields = {'phash': to_signed(value)}
+    for band, band_value in enumerate(split_bands(value)):
+        fields['phash_{0}'.format(band)] = band_value
+    return fields
+
+
+def hamming(a, b):
+    return (to_unsigned(a) ^ to_unsigned(b)).bit_count()
+
+
+def band_probes(band_value, distance):
+    # The band itself, plus every one-bit variant when the distance needs it.
+    if distance < BAND_COUNT:
+        return [band_value]
+    return [band_value] + [band_value ^ (1 << bit) for bit in range(BAND_BITS)]
+
+
+def clamp_distance(distance):
+    return max(0, min(int(distance), MAX_DISTANCE))
+
+
+def find_similar(queryset, value, distance=DEFAULT_DISTANCE):
+    # Candidates come from indexed exact lookups on the hash bands; only
+    # those are compared bit by bit.
+    distance = clamp_distance(distance)
+    condition = Q()
+    for band, band_value in enumerate(split_bands(value)):
+        condition |= Q(**{'phash_{0}__in'.format(band): band_probes(band_value, distance)})
+    matches = []
+    for image in queryset.filter(condition):
+        image_distance = hamming(image.phash, value)
+        if image_distance <= distance:
+            matches.append((image_distance, image))
+    matches.sort(key=lambda match: (match[0], match[1].pk))
+    return matches
+
+
+def find_clusters(hashes, distance=DEFAULT_DISTANCE):
+    # Groups (id, phash) pairs into near-duplicate clusters. Each image only
+    # looks at the ids sharing one of its (probed) band values, and matches
+    # are merged with union-find.
+    distance = clamp_distance(distance)
+    buckets = [defaultdict(list) for _ in range(BAND_COUNT)]
+    for pk, value in hashes:
+        for band, band_value in enumerate(split_bands(value)):
+            buckets[band][band_value].append((pk, value))
+
+    parent = {pk: pk for pk, _ in hashes}
+
+    def find(pk):
+        while parent[pk] != pk:
+            parent[pk] = parent[parent[pk]]
+            pk = parent[pk]
+        return pk
+
+    for pk, value in hashes:
+        for band, band_value in enumerate(split_bands(value)):
+            for probe in band_probes(band_value, distance):
+                for other_pk, other_value in buckets[band].get(probe, ()):
+                    if other_pk != pk and hamming(value, other_value) <= distance:
+                        parent[find(other_pk)] = find(pk)
+
+    clusters = defaultdict(list)
+    for pk, _ in hashes:
+        clusters[find(pk)].append(pk)
+    return sorted((sorted(ids) for ids in clusters.values() if len(ids) > 1), key=len, reverse=True)
@@ -1,3 +1,590 @@
-from django.test import TestCase
+import hashlib
+import os
+import struct
+import tempfile
+import time
+from datetime import timedelta
+from io import BytesIO
+from unittest import skipIf
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlsplit
+from PIL import Image
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .deletions import queue_folder_deletion, run_deletion
+from .journal import compact_changes
+from .models import Blob, Change, DirectUpload, File, Folder, ImageFile, TimelineBucket, VideoFile, timeline_day
+from .signed_urls import SignedURLCache
 
-# Create your tests here.
+try:
+    import boto3
+    from moto import mock_aws
+except ImportError:
+    mock_aws = None
+
+BUCKET = 'direct-upload-tests'
+S3_SETTINGS = {
+    'STORAGES': {
+        'default': {'BACKEND': 'storages.backends.s3.S3Storage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+    'AWS_STORAGE_BUCKET_NAME': BUCKET,
+    'AWS_S3_REGION_NAME': 'us-east-1',
+    'AWS_S3_SIGNATURE_VERSION': 's3v4',
+    'AWS_S3_ADDRESSING_STYLE': 'path',
+    'DIRECT_UPLOAD_PART_SIZE': 5 * 1024 * 1024,
+}
+LOCAL_SETTINGS = {
+    'STORAGES': {
+        'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+        'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    },
+    'MEDIA_ROOT': tempfile.mkdtemp(),
+}
+
+
+@skipIf(mock_aws is None, 'moto is not installed')
+@override_settings(**S3_SETTINGS)
+class DirectUploadTests(TestCase):
+    # The client side is played with boto3 against moto; the presigned URLs
+    # carry the same operations.
+
+    def setUp(self):
+        mock = mock_aws()
+        mock.start()
+        self.addCleanup(mock.stop)
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket=BUCKET)
+        self.user = get_user_model().objects.create_user(email='owner@example.com', username='owner', password='pw')
+        self.folder = Folder.objects.create(user=self.user, name='root')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def start(self, data, sha256=None, kind='file', filename='upload.bin'):
+        response = self.client.post(reverse('direct-upload-list'), {
+            'kind': kind, 'folder': self.folder.pk, 'name': 'upload', 'filename': filename,
+            'size': len(data), 'sha256': sha256 or hashlib.sha256(data).hexdigest(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return DirectUpload.objects.get(pk=response.data['id'])
+
+    def complete(self, upload):
+        return self.client.post(reverse('direct-upload-complete', args=[upload.pk]))
+
+    def upload_parts(self, upload, data):
+        for number in range(1, upload.part_count + 1):
+            self.s3.upload_part(
+                Bucket=BUCKET, Key=upload.key, UploadId=upload.multipart_upload_id, PartNumber=number,
+                Body=data[(number - 1) * upload.part_size:number * upload.part_size],
+            )
+
+    def test_single_put(self):
+        data = os.urandom(1000)
+        upload = self.start(data)
+        self.assertFalse(upload.multipart_upload_id)
+        self.s3.put_object(Bucket=BUCKET, Key=upload.key, Body=data)
+        response = self.complete(upload)
+        self.assertEqual(response.status_code, 201)
+        stored = File.objects.get()
+        self.assertEqual(stored.blob.sha256, hashlib.sha256(data).hexdigest())
+        self.assertEqual(stored.file.read(), data)
+        self.assertFalse(DirectUpload.objects.exists())
+
+    def test_multipart(self):
+        data = os.urandom(12 * 1024 * 1024)
+        upload = self.start(data)
+        self.assertEqual(upload.part_count, 3)
+        self.upload_parts(upload, data)
+        response = self.complete(upload)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(File.objects.get().blob.sha256, hashlib.sha256(data).hexdigest())
+
+    def test_single_put_checksum_mismatch(self):
+        data = os.urandom(1000)
+        upload = self.start(data)
+        self.s3.put_object(Bucket=BUCKET, Key=upload.key, Body=os.urandom(1000))
+        response = self.complete(upload)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('sha256', response.data)
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(File.objects.exists())
+
+    def test_multipart_checksum_mismatch(self):
+        data = os.urandom(12 * 1024 * 1024)
+        upload = self.start(data, sha256=hashlib.sha256(b'something else').hexdigest())
+        self.upload_parts(upload, data)
+        response = self.complete(upload)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('sha256', response.data)
+        self.assertFalse(Blob.objects.exists())
+        # The assembled object is dropped and every part is asked for again.
+        upload.refresh_from_db()
+        self.assertTrue(upload.multipart_upload_id)
+        self.assertEqual(self.s3.list_objects_v2(Bucket=BUCKET).get('KeyCount'), 0)
+        response = self.client.get(reverse('direct-upload-detail', args=[upload.pk]))
+        self.assertEqual([part['number'] for part in response.data['parts']], [1, 2, 3])
+
+    def test_undecodable_image_is_rejected(self):
+        data = os.urandom(1000)
+        upload = self.start(data, kind='image', filename='upload.jpg')
+        self.s3.put_object(Bucket=BUCKET, Key=upload.key, Body=data)
+        response = self.complete(upload)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+        self.assertFalse(ImageFile.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(DirectUpload.objects.exists())
+        self.assertEqual(self.s3.list_objects_v2(Bucket=BUCKET).get('KeyCount'), 0)
+
+    def test_quota_is_checked(self):
+        data = os.urandom(1000)
+        upload = self.start(data)
+        self.s3.put_object(Bucket=BUCKET, Key=upload.key, Body=data)
+        with override_settings(STORAGE_QUOTA=500):
+            response = self.complete(upload)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('file', response.data)
+        self.assertFalse(File.objects.exists())
+        self.assertEqual(self.s3.list_objects_v2(Bucket=BUCKET).get('KeyCount'), 0)
+
+    def test_abort(self):
+        data = os.urandom(12 * 1024 * 1024)
+        upload = self.start(data)
+        self.s3.upload_part(
+            Bucket=BUCKET, Key=upload.key, UploadId=upload.multipart_upload_id, PartNumber=1, Body=data[:upload.part_size],
+        )
+        response = self.client.delete(reverse('direct-upload-detail', args=[upload.pk]))
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(DirectUpload.objects.exists())
+        self.assertEqual(self.s3.list_multipart_uploads(Bucket=BUCKET).get('Uploads', []), [])
+
+
+@skipIf(mock_aws is None, 'moto is not installed')
+@override_settings(**S3_SETTINGS)
+class SignedURLTests(TestCase):
+
+    def setUp(self):
+        mock = mock_aws()
+        mock.start()
+        self.addCleanup(mock.stop)
+        self.storage = File._meta.get_field('file').storage
+
+    def test_urls_are_signed_as_of_the_window_start(self):
+        length = SignedURLCache(10).get_window_length(self.storage)
+        start = 1700000000 // length * length
+        # Two processes signing at different points of the same window.
+        first = SignedURLCache(10).url(self.storage, 'a/b.jpg', now=start + 1)
+        second = SignedURLCache(10).url(self.storage, 'a/b.jpg', now=start + length - 1)
+        self.assertEqual(first, second)
+        signed_at = parse_qs(urlsplit(first).query)['X-Amz-Date'][0]
+        self.assertEqual(signed_at, time.strftime('%Y%m%dT%H%M%SZ', time.gmtime(start)))
+        later = SignedURLCache(10).url(self.storage, 'a/b.jpg', now=start + length)
+        self.assertNotEqual(first, later)
+        # Outside the cache, URLs are signed at the current time as usual.
+        self.assertNotIn(signed_at, self.storage.url('a/b.jpg'))
+
+
+class JournalMixin:
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='owner@example.com', username='owner', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.folder = Folder.objects.create(user=self.user, name='root')
+
+    def get_head(self):
+        return self.client.get(reverse('change-list')).data['cursor']
+
+    def get_entries(self, since):
+        return [(entry['kind'], entry['id'], entry['action']) for entry in self.get_all(since)]
+
+    def get_all(self, since):
+        return self.client.get(reverse('change-list'), {'since': since, 'page_size': 5000}).data['changes']
+
+    def create_files(self, count):
+        return [
+            File.objects.create(
+                user=self.user, folder=self.folder, name='f{0}'.format(i), file=ContentFile(b'x%d' % i, name='f{0}.txt'.format(i)),
+            )
+            for i in range(count)
+        ]
+
+
+@override_settings(**LOCAL_SETTINGS)
+class ChangeJournalTests(JournalMixin, TestCase):
+
+    def test_cursor_paging(self):
+        head = self.get_head()
+        files = self.create_files(5)
+        response = self.client.get(reverse('change-list'), {'since': head, 'page_size': 2})
+        seen = []
+        while True:
+            seen.extend(entry['id'] for entry in response.data['changes'])
+            if response.data['next'] is None:
+                break
+            self.assertEqual(len(response.data['changes']), 2)
+            response = self.client.get(response.data['next'])
+        self.assertEqual(seen, [item.pk for item in files])
+        idle = self.client.get(reverse('change-list'), {'since': response.data['cursor']}).data
+        self.assertEqual((idle['changes'], idle['cursor'], idle['resync']), ([], response.data['cursor'], False))
+
+    def test_resync_after_truncation(self):
+        stale = self.get_head()
+        self.create_files(4)
+        Change.objects.update(created_at=timezone.now() - timedelta(days=40))
+        compact_changes(timezone.now() - timedelta(days=30), 2)
+        response = self.client.get(reverse('change-list'), {'since': stale}).data
+        self.assertTrue(response['resync'])
+        self.assertEqual(response['cursor'], self.get_head())
+        # A cursor taken after compaction reads on as usual.
+        fresh = self.get_head()
+        created = self.create_files(1)[0]
+        response = self.client.get(reverse('change-list'), {'since': fresh}).data
+        self.assertFalse(response['resync'])
+        self.assertEqual([entry['id'] for entry in response['changes']], [created.pk])
+
+    def test_compaction_keeps_subtree_entries(self):
+        head = self.get_head()
+        child = Folder.objects.create(user=self.user, name='child', parent_folder=self.folder)
+        item = self.create_files(1)[0]
+        item.name = 'renamed'
+        item.save()
+        url = reverse('folder-detail', args=[child.pk])
+        self.client.patch(url, {'is_trashed': True}, format='json')
+        self.client.patch(url, {'is_trashed': False}, format='json')
+        self.client.patch(url, {'name': 'renamed'}, format='json')
+        compact_changes(timezone.now() - timedelta(days=1), 2)
+        self.assertEqual(self.get_entries(head), [
+            (Change.FILE, item.pk, Change.UPDATED),
+            (Change.FOLDER, child.pk, Change.TRASHED),
+            (Change.FOLDER, child.pk, Change.RESTORED),
+            (Change.FOLDER, child.pk, Change.UPDATED),
+        ])
+
+    def test_bulk_actions_write_one_entry_per_item(self):
+        files = self.create_files(3)
+        ids = [item.pk for item in files]
+        target = Folder.objects.create(user=self.user, name='target')
+        for action, extra, expected in (
+            ('trash', {}, Change.TRASHED),
+            ('restore', {}, Change.RESTORED),
+            ('star', {}, Change.UPDATED),
+            ('move', {'folder': target.pk}, Change.UPDATED),
+            ('delete', {}, Change.DELETED),
+        ):
+            head = self.get_head()
+            response = self.client.post(reverse('file-bulk'), dict(extra, action=action, ids=ids), format='json')
+            self.assertEqual(response.status_code, 200, response.data)
+            self.assertEqual(self.get_entries(head), [(Change.FILE, pk, expected) for pk in ids], action)
+
+    def test_batch_upload_writes_one_entry_per_image(self):
+        head = self.get_head()
+        images = []
+        for i in range(3):
+            content = BytesIO()
+            Image.new('RGB', (8, 8), (i, 0, 0)).save(content, 'JPEG')
+            images.append(SimpleUploadedFile('{0}.jpg'.format(i), content.getvalue(), content_type='image/jpeg'))
+        response = self.client.post(reverse('image-batch-upload'), {'folder': self.folder.pk, 'images': images}, format='multipart')
+        self.assertIn(response.status_code, (200, 201), response.data)
+        created = sorted(ImageFile.objects.filter(user=self.user).values_list('pk', flat=True))
+        self.assertEqual(len(created), 3)
+        self.assertEqual(self.get_entries(head), [(Change.IMAGE, pk, Change.CREATED) for pk in created])
+
+    def test_shared_folder_changes_reach_viewers(self):
+        viewer = get_user_model().objects.create_user(email='viewer@example.com', username='viewer', password='pw')
+        viewer_client = APIClient()
+        viewer_client.force_authenticate(viewer)
+        head = viewer_client.get(reverse('change-list')).data['cursor']
+        self.folder.is_shared = True
+        self.folder.save()
+        self.folder.shared_with.add(viewer)
+        # Gaining the subtree is not something entries can describe.
+        response = viewer_client.get(reverse('change-list'), {'since': head}).data
+        self.assertTrue(response['resync'])
+        head = response['cursor']
+        item = self.create_files(1)[0]
+        self.client.post(reverse('file-bulk'), {'action': 'star', 'ids': [item.pk]}, format='json')
+        response = viewer_client.get(reverse('change-list'), {'since': head}).data
+        self.assertEqual(
+            [(entry['kind'], entry['id'], entry['action']) for entry in response['changes']],
+            [(Change.FILE, item.pk, Change.CREATED), (Change.FILE, item.pk, Change.UPDATED)],
+        )
+        head = response['cursor']
+        self.folder.shared_with.remove(viewer)
+        self.assertTrue(viewer_client.get(reverse('change-list'), {'since': head}).data['resync'])
+
+
+@override_settings(**LOCAL_SETTINGS)
+class FolderDeletionJournalTests(JournalMixin, TransactionTestCase):
+    # run_deletion() works on its own connection state, outside the test
+    # transaction TestCase would wrap it in.
+
+    def test_folder_deletion_writes_one_entry(self):
+        child = Folder.objects.create(user=self.user, name='child', parent_folder=self.folder)
+        self.create_files(3)
+        File.objects.create(user=self.user, folder=child, name='nested', file=ContentFile(b'nested', name='nested.txt'))
+        head = self.get_head()
+        deletion = queue_folder_deletion(self.folder, schedule=False)
+        run_deletion(deletion.pk)
+        self.assertFalse(Folder.objects.filter(pk=self.folder.pk).exists())
+        self.assertEqual(self.get_entries(head), [(Change.FOLDER, self.folder.pk, Change.DELETED)])
+
+
+def make_jpeg(size=(8, 8), color=(0, 0, 0), taken_at=None):
+    exif = Image.Exif()
+    if taken_at:
+        exif.get_ifd(0x8769)[0x9003] = taken_at
+    content = BytesIO()
+    Image.new('RGB', size, color).save(content, 'JPEG', exif=exif)
+    return content.getvalue()
+
+
+def make_mp4(width, height, codec, seconds):
+    # ftyp plus a moov holding mvhd and one video track, enough for probe_video().
+    def box(box_type, payload):
+        return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+    mvhd = box(b'mvhd', bytes(4) + struct.pack('>IIII', 0, 0, 1000, seconds * 1000) + bytes(80))
+    matrix = struct.pack('>9i', 65536, 0, 0, 0, 65536, 0, 0, 0, 1 << 30)
+    tkhd = box(b'tkhd', bytes(4) + bytes(36) + matrix + struct.pack('>II', width << 16, height << 16))
+    stsd = box(b'stsd', bytes(4) + struct.pack('>I', 1) + struct.pack('>I4s', 86, codec) + bytes(78))
+    hdlr = box(b'hdlr', bytes(8) + b'vide' + bytes(12))
+    trak = box(b'trak', tkhd + box(b'mdia', hdlr + box(b'minf', box(b'stbl', stsd))))
+    return box(b'ftyp', b'isom' + bytes(4)) + box(b'moov', mvhd + trak)
+
+
+@override_settings(**LOCAL_SETTINGS)
+class ReplacedMediaTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='owner@example.com', username='owner', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.folder = Folder.objects.create(user=self.user, name='root')
+
+    def upload_image(self, data):
+        with patch('backupss.signals.schedule_derivatives'):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(reverse('image-list'), {
+                    'folder': self.folder.pk, 'name': 'photo', 'image': SimpleUploadedFile('photo.jpg', data),
+                }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+        return ImageFile.objects.get(pk=response.data['id'])
+
+    def replace_image(self, image, data):
+        with patch('backupss.signals.schedule_derivatives') as schedule:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.patch(reverse('image-detail', args=[image.pk]), {
+                    'image': SimpleUploadedFile('other.jpg', data),
+                }, format='multipart')
+        self.assertEqual(response.status_code, 200, response.data)
+        image.refresh_from_db()
+        return schedule
+
+    def test_replacing_an_image_renders_new_derivatives(self):
+        image = self.upload_image(make_jpeg())
+        storage = image.image.storage
+        thumbnail = storage.save('thumbnails/old.webp', ContentFile(b'old'))
+        ImageFile.objects.filter(pk=image.pk).update(thumbnails={'256': thumbnail}, placeholder='data:old', phash=1)
+        image.refresh_from_db()
+        schedule = self.replace_image(image, make_jpeg(color=(255, 255, 255)))
+        schedule.assert_called_once_with(image.pk)
+        self.assertEqual((image.thumbnails, image.placeholder, image.phash), ({}, '', None))
+        self.assertFalse(storage.exists(thumbnail))
+
+    def test_replacing_an_image_reads_its_metadata_again(self):
+        image = self.upload_image(make_jpeg(size=(8, 6), taken_at='2019:03:14 10:20:30'))
+        self.assertEqual((image.image_width, image.taken_at.year), (8, 2019))
+        self.replace_image(image, make_jpeg(size=(4, 12)))
+        self.assertEqual((image.image_width, image.image_height, image.taken_at), (4, 12, None))
+        self.assertEqual(image.timeline_at, image.created_at)
+        buckets = dict(TimelineBucket.objects.filter(user=self.user).values_list('day', 'count'))
+        self.assertEqual({day: count for day, count in buckets.items() if count}, {timeline_day(image.created_at): 1})
+
+    def test_replacing_a_video_reads_its_headers_again(self):
+        video = VideoFile(user=self.user, folder=self.folder, video=SimpleUploadedFile('clip.mp4', make_mp4(1920, 1080, b'avc1', 75)))
+        video.save()
+        self.assertEqual((video.duration, video.video_width, video.video_codec), (75, 1920, 'avc1'))
+        video.video = SimpleUploadedFile('other.mp4', make_mp4(640, 480, b'hvc1', 12))
+        video.save()
+        video.refresh_from_db()
+        self.assertEqual((video.duration, video.video_width, video.video_height, video.video_codec), (12, 640, 480, 'hvc1'))
+
+
+@override_settings(**LOCAL_SETTINGS)
+class FolderTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='owner@example.com', username='owner', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.root = Folder.objects.create(user=self.user, name='root')
+        self.child = Folder.objects.create(user=self.user, name='child', parent_folder=self.root)
+
+    def test_moving_a_folder_into_its_subtree_is_rejected(self):
+        for parent in (self.root, self.child):
+            response = self.client.patch(reverse('folder-detail', args=[self.root.pk]), {'parent_folder': parent.pk}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('parent_folder', response.data)
+        self.root.refresh_from_db()
+        self.assertIsNone(self.root.parent_folder_id)
+
+    def test_folder_file_list_is_paginated(self):
+        files = [
+            File.objects.create(user=self.user, folder=self.root, name='f{0}'.format(i), file=ContentFile(b'x', name='f.txt'))
+            for i in range(3)
+        ]
+        response = self.client.get(reverse('folder-file-list', args=[self.root.pk]), {'page_size': 2})
+        seen = []
+        while True:
+            self.assertEqual(response.status_code, 200)
+            seen.extend(item['id'] for item in response.data['results'])
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(sorted(seen), sorted(item.pk for item in files))
+        combined = self.client.get(reverse('folder-files', args=[self.root.pk]))
+        self.assertEqual(sorted(item['id'] for item in combined.json()['files']), sorted(item.pk for item in files))
+
+    def test_items_cannot_be_put_in_other_users_folders(self):
+        stranger = get_user_model().objects.create_user(email='stranger@example.com', username='stranger', password='pw')
+        foreign = Folder.objects.create(user=stranger, name='foreign')
+        upload = SimpleUploadedFile('a.txt', b'a')
+        response = self.client.post(reverse('file-list'), {'folder': foreign.pk, 'name': 'a', 'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('folder', response.data)
+        response = self.client.patch(reverse('folder-detail', args=[self.child.pk]), {'parent_folder': foreign.pk}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('parent_folder', response.data)
+        self.assertFalse(File.objects.exists())
+        # Once shared, the folder takes new items.
+        foreign.is_shared = True
+        foreign.save()
+        foreign.shared_with.add(self.user)
+        upload = SimpleUploadedFile('a.txt', b'a')
+        response = self.client.post(reverse('file-list'), {'folder': foreign.pk, 'name': 'a', 'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+
+
+    def test_sharing_and_unsharing_a_folder(self):
+        viewer = get_user_model().objects.create_user(email='viewer@example.com', username='viewer', password='pw')
+        viewer_client = APIClient()
+        viewer_client.force_authenticate(viewer)
+        item = File.objects.create(user=self.user, folder=self.child, name='f', file=ContentFile(b'x', name='f.txt'))
+        urls = [reverse('folder-detail', args=[self.child.pk]), reverse('file-detail', args=[item.pk])]
+        self.assertEqual([viewer_client.get(url).status_code for url in urls], [404, 404])
+        root_url = reverse('folder-detail', args=[self.root.pk])
+        response = self.client.patch(root_url, {'is_shared': True, 'shared_with': [viewer.pk]}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual([viewer_client.get(url).status_code for url in urls], [200, 200])
+        response = viewer_client.get(reverse('folder-file-list', args=[self.child.pk]))
+        self.assertEqual([entry['id'] for entry in response.data['results']], [item.pk])
+        self.client.patch(root_url, {'shared_with': []}, format='json')
+        self.assertEqual([viewer_client.get(url).status_code for url in urls], [404, 404])
+
+    def test_bulk_actions_skip_items_of_other_users(self):
+        stranger = get_user_model().objects.create_user(email='stranger@example.com', username='stranger', password='pw')
+        stranger_client = APIClient()
+        stranger_client.force_authenticate(stranger)
+        item = File.objects.create(user=self.user, folder=self.child, name='f', file=ContentFile(b'x', name='f.txt'))
+        for action in ('trash', 'star', 'delete'):
+            response = stranger_client.post(reverse('file-bulk'), {'action': action, 'ids': [item.pk]}, format='json')
+            self.assertEqual((response.data['updated'], response.data['not_found']), (0, [item.pk]), action)
+        response = stranger_client.post(reverse('file-bulk'), {'action': 'trash', 'filter': {'folder': self.child.pk}}, format='json')
+        self.assertEqual(response.data['updated'], 0)
+        response = stranger_client.post(reverse('folder-bulk'), {'action': 'delete', 'ids': [self.root.pk]}, format='json')
+        self.assertEqual((response.data['updated'], response.data['not_found']), (0, [self.root.pk]))
+        # Moving into someone else's folder is refused outright.
+        own = Folder.objects.create(user=stranger, name='own')
+        response = self.client.post(reverse('file-bulk'), {'action': 'move', 'ids': [item.pk], 'folder': own.pk}, format='json')
+        self.assertEqual(response.status_code, 400)
+        item.refresh_from_db()
+        self.assertEqual((item.folder_id, item.is_trashed, item.is_starred), (self.child.pk, False, False))
+        self.assertTrue(Folder.objects.filter(pk=self.root.pk, is_deleted=False).exists())
+
+
+@override_settings(**LOCAL_SETTINGS)
+class TimelineTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='owner@example.com', username='owner', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.folder = Folder.objects.create(user=self.user, name='root')
+
+    def upload_image(self, data):
+        with patch('backupss.signals.schedule_derivatives'):
+            response = self.client.post(reverse('image-list'), {
+                'folder': self.folder.pk, 'name': 'photo', 'image': SimpleUploadedFile('photo.jpg', data),
+            }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def test_folder_parameter_does_not_scope_the_etag(self):
+        other = Folder.objects.create(user=self.user, name='other')
+        taken_at = '2020:03:01 10:00:00'
+        self.upload_image(make_jpeg(taken_at=taken_at))
+        urls = [reverse('image-timeline'), reverse('image-timeline-bucket', args=['2020-03'])]
+        etags = [self.client.get(url, {'folder': other.pk})['ETag'] for url in urls]
+        self.upload_image(make_jpeg(color=(0, 0, 255), taken_at=taken_at))
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, {'folder': other.pk}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, url)
+
+
+@override_settings(**LOCAL_SETTINGS)
+class FolderSubtreeSizeTests(TransactionTestCase):
+    # Folder.size counts what is not trashed below a folder; the owner's
+    # storage counts everything they still store.
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(email='owner@example.com', username='owner', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.root = Folder.objects.create(user=self.user, name='root')
+        self.child = Folder.objects.create(user=self.user, name='child', parent_folder=self.root)
+        self.grandchild = Folder.objects.create(user=self.user, name='grandchild', parent_folder=self.child)
+        self.create_file(self.root, b'abc')
+        self.create_file(self.child, b'abcde')
+        self.nested = self.create_file(self.grandchild, b'abcdefg')
+
+    def create_file(self, folder, data):
+        return File.objects.create(user=self.user, folder=folder, name='f', file=ContentFile(data, name='f.txt'))
+
+    def assertSizes(self, root, child, grandchild, storage):
+        sizes = dict(Folder.objects.values_list('pk', 'size'))
+        self.assertEqual(
+            [sizes.get(folder.pk) or 0 for folder in (self.root, self.child, self.grandchild)], [root, child, grandchild],
+        )
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.storage, storage)
+
+    def test_trash_restore_and_delete_subtree(self):
+        self.assertSizes(15, 12, 7, 15)
+        url = reverse('folder-detail', args=[self.child.pk])
+        self.assertEqual(self.client.patch(url, {'is_trashed': True}, format='json').status_code, 200)
+        self.assertSizes(3, 0, 0, 15)
+        self.assertEqual(File.objects.filter(is_trashed=True).count(), 2)
+        self.assertEqual(self.client.patch(url, {'is_trashed': False}, format='json').status_code, 200)
+        self.assertSizes(15, 12, 7, 15)
+        self.assertFalse(File.objects.filter(is_trashed=True).exists())
+        run_deletion(queue_folder_deletion(self.child, schedule=False).pk)
+        self.assertEqual(list(Folder.objects.values_list('pk', flat=True)), [self.root.pk])
+        self.assertEqual(File.objects.count(), 1)
+        self.assertSizes(3, 0, 0, 3)
+
+    def test_restore_leaves_items_trashed_on_their_own(self):
+        self.nested.is_trashed = True
+        self.nested.save()
+        self.assertSizes(8, 5, 0, 15)
+        url = reverse('folder-detail', args=[self.child.pk])
+        self.client.patch(url, {'is_trashed': True}, format='json')
+        self.client.patch(url, {'is_trashed': False}, format='json')
+        self.assertSizes(8, 5, 0, 15)
+        self.nested.refresh_from_db()
+        self.assertTrue(self.nested.is_trashed)
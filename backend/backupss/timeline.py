@@ -0,0 +1,53 @@
+import re
+from datetime import date, datetime, time, timedelta
+from django.db.models import DateField, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+from .models import ImageFile, TimelineBucket
+
+BUCKET_FORMATS = {'day': '%Y-%m-%d', 'month': '%Y-%m', 'year': '%Y'}
+BUCKET_PATTERN = re.compile(r'^(\d{4})(?:-(\d{2})(?:-(\d{2}))?)?$')
+
+
+def get_buckets(user, granularity):
+    # Photo counts per day, month or year, newest first, from the day rows of
+    # TimelineBucket alone: a few thousand rows even for a large library.
+    rows = TimelineBucket.objects.filter(user=user, count__gt=0)
+    if granularity == 'day':
+        rows = rows.values_list('day', 'count').order_by('-day')
+    else:
+        rows = (
+            rows.annotate(period=Trunc('day', granularity, output_field=DateField()))
+            .values('period').annotate(total=Sum('count')).values_list('period', 'total').order_by('-period')
+        )
+    label = BUCKET_FORMATS[granularity]
+    return [{'bucket': period.strftime(label), 'count': count} for period, count in rows]
+
+
+def parse_bucket(bucket):
+    # 'YYYY', 'YYYY-MM' or 'YYYY-MM-DD' -> the [start, end) dates it covers,
+    # or None.
+    match = BUCKET_PATTERN.match(bucket)
+    if match is None:
+        return None
+    year, month, day = (int(part) if part else None for part in match.groups())
+    try:
+        if day is not None:
+            start = date(year, month, day)
+            return start, start + timedelta(days=1)
+        if month is not None:
+            start = date(year, month, 1)
+            return start, date(year + month // 12, month % 12 + 1, 1)
+        return date(year, 1, 1), date(year + 1, 1, 1)
+    except (OverflowError, ValueError):
+        return None
+
+
+def bucket_images(user, start, end):
+    # The user's untrashed images on the timeline from start up to end, a
+    # range scan on the (user, timeline_at, id) index. Folders waiting for
+    # run_deletion() are already off the timeline.
+    start, end = (timezone.make_aware(datetime.combine(day, time.min)) for day in (start, end))
+    return ImageFile.objects.filter(
+        user=user, is_trashed=False, folder__is_deleted=False, timeline_at__gte=start, timeline_at__lt=end,
+    )
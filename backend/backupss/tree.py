@@ -0,0 +1,30 @@
+from collections import defaultdict
+from django.db.models import Q
+from .models import Folder
+
+
+def get_descendants(folders, depth=None):
+    # Every folder below `folders` (at most `depth` levels down) in a single
+    # query on the path index, instead of one query per level.
+    roots = sorted((f for f in folders if f.path), key=lambda f: f.path)
+    condition = Q()
+    prefix = None
+    for folder in roots:
+        if prefix and folder.path.startswith(prefix) and depth is None:
+            continue
+        prefix = folder.path
+        level = Q(path__startswith=folder.path, depth__gt=folder.depth)
+        if depth is not None:
+            level &= Q(depth__lte=folder.depth + depth)
+        condition |= level
+    if not condition:
+        return Folder.objects.none()
+    return Folder.objects.filter(condition).order_by('path')
+
+
+def build_subfolder_map(descendants):
+    # parent id -> direct children, assembled in memory from the flat list.
+    subfolder_map = defaultdict(list)
+    for folder in descendants:
+        subfolder_map[folder.parent_folder_id].append(folder)
+    return subfolder_map
@@ -0,0 +1,90 @@
+import os
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files import File as DjangoFile
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+from .models import File, ImageFile, VideoFile, UploadChunk, UploadSession
+
+UPLOAD_MODELS = {UploadSession.FILE: File, UploadSession.IMAGE: ImageFile, UploadSession.VIDEO: VideoFile}
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class AssembledUpload(DjangoFile):
+    # Exposes the assembled file's path so FileSystemStorage moves it into
+    # place instead of copying it; other backends stream it once.
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def start_session(session):
+    os.makedirs(settings.UPLOAD_SESSION_ROOT, exist_ok=True)
+    with open(session.temp_path, 'wb') as target:
+        # Sparse preallocation: chunks are written at their offsets as they come.
+        target.truncate(session.size)
+
+
+def write_chunk(session, index, stream):
+    if index >= session.chunk_count:
+        raise ValidationError({'index': 'Chunk index out of range.'})
+    expected = session.chunk_length(index)
+    written = 0
+    with open(session.temp_path, 'r+b') as target:
+        target.seek(index * session.chunk_size)
+        while True:
+            block = stream.read(min(READ_BLOCK_SIZE, expected - written + 1))
+            if not block:
+                break
+            written += len(block)
+            if written > expected:
+                raise ValidationError({'index': 'Chunk is larger than {0} bytes.'.format(expected)})
+            target.write(block)
+    if written != expected:
+        raise ValidationError({'index': 'Expected {0} bytes, received {1}.'.format(expected, written)})
+    UploadChunk.objects.get_or_create(session=session, index=index)
+
+
+def get_missing_chunks(session):
+    received = set(session.chunks.values_list('index', flat=True))
+    return [index for index in range(session.chunk_count) if index not in received]
+
+
+def complete_session(session, serializer):
+    # The assembled file goes through the same field checks as a plain upload
+    # through serializer (format, image decoding) and the model's clean().
+    missing = get_missing_chunks(session)
+    if missing:
+        raise ValidationError({'missing': missing})
+    model = UPLOAD_MODELS[session.kind]
+    instance = model(folder=session.folder, user=session.user, name=session.name)
+    temp_path = session.temp_path
+    with open(temp_path, 'rb') as assembled:
+        with transaction.atomic():
+            # Holding the owner's row makes concurrent completions take turns
+            # at the quota check, so each one sees the others' usage.
+            get_user_model().objects.select_for_update().get(pk=session.user_id)
+            upload = serializer.validate_stored_file(AssembledUpload(assembled, name=session.filename), session.user)
+            # Left uncommitted so the model's save() stores it via the blob store.
+            setattr(instance, model.stored_file_field, upload)
+            try:
+                instance.clean()
+            except DjangoValidationError as error:
+                raise ValidationError({model.stored_file_field: error.messages})
+            instance.save()
+            session.delete()
+    discard_session_file(temp_path)
+    return instance
+
+
+def abort_session(session):
+    temp_path = session.temp_path
+    session.delete()
+    discard_session_file(temp_path)
+
+
+def discard_session_file(temp_path):
+    try:
+        os.remove(temp_path)
+    except FileNotFoundError:
+        pass
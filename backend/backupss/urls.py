@@ -6,7 +6,13 @@ from .views import (
     FileDetailView, 
     ImageFileListView, 
     ImageFileDetailView, VideoFileListView, VideoFileDetailView,
-    get_folder_files
+    get_folder_files,
+    UploadSessionListView, UploadSessionDetailView, UploadChunkView, UploadSessionCompleteView,
+    ManifestDiffView, SimilarImagesView, DuplicateClustersView, ImageBatchUploadView,
+    FileBulkView, ImageFileBulkView, VideoFileBulkView, FolderBulkView,
+    FileContentView, ImageFileContentView, VideoFileContentView,
+    DirectUploadListView, DirectUploadDetailView, DirectUploadCompleteView,
+    ChangeListView, ResponseCacheStatsView, TimelineView, TimelineBucketView,
 )
 
 urlpatterns = [
@@ -14,14 +20,45 @@ urlpatterns = [
     path('folders/<int:pk>/', FolderDetailView.as_view(), name='folder-detail'),
     path('files/', FileListView.as_view(), name='file-list'),
     path('files/<int:pk>/', FileDetailView.as_view(), name='file-detail'),
+    path('files/<int:pk>/content/', FileContentView.as_view(), name='file-content'),
     path('images/', ImageFileListView.as_view(), name='image-list'),
     path('images/<int:pk>/', ImageFileDetailView.as_view(), name='image-detail'),
-    path('folders/<int:pk>/files/', get_folder_files, name='folder-files'),
+    path('images/<int:pk>/content/', ImageFileContentView.as_view(), name='image-content'),
+    path('images/<int:pk>/similar/', SimilarImagesView.as_view(), name='image-similar'),
+    path('images/batch/', ImageBatchUploadView.as_view(), name='image-batch-upload'),
+    path('images/duplicates/', DuplicateClustersView.as_view(), name='image-duplicates'),
+    path('images/timeline/', TimelineView.as_view(), name='image-timeline'),
+    path('images/timeline/<str:bucket>/', TimelineBucketView.as_view(), name='image-timeline-bucket'),
+    path('folders/<int:pk>/contents/', get_folder_files, name='folder-files'),
     path('videos/', VideoFileListView.as_view(), name='video-list'),
     path('videos/<int:pk>/', VideoFileDetailView.as_view(), name='video-detail'),
+    path('videos/<int:pk>/content/', VideoFileContentView.as_view(), name='video-content'),
     
     # New URL patterns for filtering files and images by folder
     path('folders/<int:folder_id>/files/', FileListView.as_view(), name='folder-file-list'),
     path('folders/<int:folder_id>/images/', ImageFileListView.as_view(), name='folder-image-list'),
     path('folders/<int:folder_id>/videos/', VideoFileListView.as_view(), name='folder-video-list'),
+
+    # Resumable chunked uploads
+    path('uploads/', UploadSessionListView.as_view(), name='upload-list'),
+    path('uploads/<uuid:pk>/', UploadSessionDetailView.as_view(), name='upload-detail'),
+    path('uploads/<uuid:pk>/chunks/<int:index>/', UploadChunkView.as_view(), name='upload-chunk'),
+    path('uploads/<uuid:pk>/complete/', UploadSessionCompleteView.as_view(), name='upload-complete'),
+
+    # Uploads straight to the S3 bucket through presigned URLs
+    path('uploads/direct/', DirectUploadListView.as_view(), name='direct-upload-list'),
+    path('uploads/direct/<uuid:pk>/', DirectUploadDetailView.as_view(), name='direct-upload-detail'),
+    path('uploads/direct/<uuid:pk>/complete/', DirectUploadCompleteView.as_view(), name='direct-upload-complete'),
+
+    path('manifest/diff/', ManifestDiffView.as_view(), name='manifest-diff'),
+
+    # Change journal for delta sync
+    path('changes/', ChangeListView.as_view(), name='change-list'),
+    path('cache/stats/', ResponseCacheStatsView.as_view(), name='response-cache-stats'),
+
+    # Set-based actions on many items at once
+    path('folders/bulk/', FolderBulkView.as_view(), name='folder-bulk'),
+    path('files/bulk/', FileBulkView.as_view(), name='file-bulk'),
+    path('images/bulk/', ImageFileBulkView.as_view(), name='image-bulk'),
+    path('videos/bulk/', VideoFileBulkView.as_view(), name='video-bulk'),
 ]
\ No newline at end of file
@@ -1,50 +1,168 @@
-from rest_framework import generics
-from .models import Folder, File, ImageFile, VideoFile
-from .serializers import FolderSerializer, FileSerializer, ImageFileSerializer, VideoFileSerializer
+import json
+from rest_framework import generics, permissions, status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.views import APIView
+from .models import Folder, File, ImageFile, VideoFile, UploadSession, DirectUpload
+from .serializers import (
+    FolderSerializer, FileSerializer, ImageFileSerializer, VideoFileSerializer, UploadSessionSerializer,
+    ImageBatchUploadSerializer, BulkActionSerializer, DirectUploadSerializer, TimelineBucketSerializer, get_query_list,
+)
+from .uploads import abort_session, complete_session, get_missing_chunks, start_session, write_chunk
+from .direct import abort_direct_upload, finalize_direct_upload, get_upload_instructions, start_direct_upload
+from .manifest import find_missing, iter_ndjson_entries
+from .journal import CHANGES_MAX_PAGE_SIZE, CHANGES_PAGE_SIZE, get_changes, get_head
+from .timeline import BUCKET_FORMATS, bucket_images, get_buckets, parse_bucket
+from .batch import ingest_images
+from .bulk import delete_items, move_folders, move_items, set_flag, set_folders_trashed
+from .deletions import delete_folders, queue_folder_deletion
+from .signed_urls import media_url
+from .serving import StoredFileResponder
+from .similarity import DEFAULT_DISTANCE, MAX_DISTANCE, find_clusters, find_similar
 from .permissons import IsOwnerOrShared
+from .tree import get_descendants, build_subfolder_map
+from .pagination import KeysetPagination, TimelinePagination
+from .conditional import get_cached_response, get_folder_version, get_user_version, make_etag, not_modified
+from .response_cache import response_cache
+from .access import accessible_folders, accessible_items, shared_with_me
+from .acl import get_folder_roles
 from django.shortcuts import get_object_or_404
-from django.http import JsonResponse
-from django.db.models import Q
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import FileField, Prefetch
+from django.contrib.auth import get_user_model
     
 
-class VideoFileListView(generics.ListAPIView):
+class ConditionalGetMixin:
+    # Strong ETags on GET from a version counter: the folder's for views
+    # scoped to one folder, the caller's UserVersion otherwise. A matching
+    # If-None-Match gets a 304 from that single lookup, before any queryset
+    # or serializer work. Rendered 200s go to the response cache.
+
+    def get_version_folder(self):
+        folder_id = self.kwargs.get('folder_id') or self.request.query_params.get('folder')
+        return int(folder_id) if folder_id and str(folder_id).isdigit() else None
+
+    def get(self, request, *args, **kwargs):
+        key, response = get_cached_response(request)
+        if response is not None:
+            return response
+        folder_id = self.get_version_folder()
+        if folder_id is None:
+            scope, version = 'user', get_user_version(request.user)
+        else:
+            scope, version = folder_id, get_folder_version(request.user, folder_id)
+        if version is None:
+            # No access; let the view give its usual answer.
+            return super().get(request, *args, **kwargs)
+        etag = make_etag(request, scope, version)
+        response = not_modified(request, etag)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                response['ETag'] = etag
+                response['X-Cache'] = 'MISS'
+                response.add_post_render_callback(lambda rendered: response_cache.set(key, etag, rendered))
+        return response
+
+class VideoFileListView(ConditionalGetMixin, generics.ListAPIView):
     serializer_class = VideoFileSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        folder_id = self.kwargs.get('folder_id')
+        folder_id = self.kwargs.get('folder_id') or self.request.query_params.get('folder', None)
+        queryset = accessible_items(VideoFile, self.request.user).filter(is_trashed=False)
         if folder_id:
-            return VideoFile.objects.filter(Folder_id=folder_id, is_trashed=False)
-        return VideoFile.objects.filter(is_trashed=False)
+            queryset = queryset.filter(folder_id=folder_id)
+        return queryset
     
 class VideoFileDetailView(generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [IsOwnerOrShared]
     serializer_class =  VideoFileSerializer
 
     def get_queryset(self):
-        return VideoFile.objects.filter(Q(user=self.request.user) | Q(folder__is_shared=True, folder__shared_with=self.request.user))
+        return accessible_items(VideoFile, self.request.user)
     
 
-class FolderListView(generics.ListCreateAPIView):
+class FolderTreeMixin:
+    # Loads the subtree of the folders being serialized with one query on the
+    # path index and hands it to FolderSerializer, honouring ?depth=. Only the
+    # relations requested through ?fields= / ?expand= are prefetched.
+    expandable_prefetch = {'files': File, 'images': ImageFile, 'videos': VideoFile}
+
+    def get_depth(self):
+        depth = self.request.query_params.get('depth')
+        if depth in (None, ''):
+            return None
+        try:
+            depth = int(depth)
+        except ValueError:
+            raise ValidationError({'depth': 'Must be a non-negative integer.'})
+        if depth < 0:
+            raise ValidationError({'depth': 'Must be a non-negative integer.'})
+        return depth
+
+    def get_folder_prefetch(self):
+        expand = get_query_list(self.request, 'expand')
+        only = get_query_list(self.request, 'fields')
+        prefetch = [
+            Prefetch(name, queryset=model.objects.all())
+            for name, model in self.expandable_prefetch.items()
+            if name in expand
+        ]
+        if not only or 'shared_with' in only:
+            prefetch.append(Prefetch('shared_with', queryset=get_user_model().objects.only('id')))
+        return prefetch
+
+    def get_serializer(self, *args, **kwargs):
+        if args and self.request.method == 'GET':
+            context = self.get_serializer_context()
+            context['depth'] = self.get_depth()
+            if 'subfolders' in get_query_list(self.request, 'expand') and context['depth'] != 0:
+                folders = args[0] if kwargs.get('many') else [args[0]]
+                descendants = get_descendants(folders, context['depth']).prefetch_related(*self.get_folder_prefetch())
+                context['subfolder_map'] = build_subfolder_map(descendants)
+            kwargs['context'] = context
+        return super().get_serializer(*args, **kwargs)
+
+class FolderListView(ConditionalGetMixin, FolderTreeMixin, generics.ListCreateAPIView):
     permission_classes = [IsOwnerOrShared]
     serializer_class = FolderSerializer
 
+    def get_version_folder(self):
+        return None
+
     def get_queryset(self):
-        return Folder.objects.filter(Q(user=self.request.user) | Q(is_shared=True, shared_with=self.request.user))
+        if self.request.query_params.get('shared') in ('1', 'true'):
+            queryset = shared_with_me(self.request.user)
+        else:
+            queryset = accessible_folders(self.request.user)
+        return queryset.prefetch_related(*self.get_folder_prefetch())
 
-class FolderDetailView(generics.RetrieveUpdateDestroyAPIView):
+class FolderDetailView(ConditionalGetMixin, FolderTreeMixin, generics.RetrieveUpdateDestroyAPIView):
     permission_classes = [IsOwnerOrShared]
     serializer_class = FolderSerializer
 
+    def get_version_folder(self):
+        return self.kwargs['pk']
+
     def get_queryset(self):
-        return Folder.objects.filter(Q(user=self.request.user) | Q(is_shared=True, shared_with=self.request.user))
+        return accessible_folders(self.request.user).prefetch_related(*self.get_folder_prefetch())
 
-class FileListView(generics.ListCreateAPIView):
+    def perform_destroy(self, instance):
+        queue_folder_deletion(instance)
+
+class FileListView(ConditionalGetMixin, generics.ListCreateAPIView):
     permission_classes = [IsOwnerOrShared]
     serializer_class = FileSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        folder_id = self.request.query_params.get('folder', None)
-        queryset = File.objects.filter(Q(user=self.request.user) | Q(folder__is_shared=True, folder__shared_with=self.request.user))
+        folder_id = self.kwargs.get('folder_id') or self.request.query_params.get('folder', None)
+        queryset = accessible_items(File, self.request.user)
         if folder_id:
             queryset = queryset.filter(folder_id=folder_id)
         return queryset
@@ -54,15 +172,16 @@ class FileDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = FileSerializer
 
     def get_queryset(self):
-        return File.objects.filter(Q(user=self.request.user) | Q(folder__is_shared=True, folder__shared_with=self.request.user))
+        return accessible_items(File, self.request.user)
 
-class ImageFileListView(generics.ListCreateAPIView):
+class ImageFileListView(ConditionalGetMixin, generics.ListCreateAPIView):
     permission_classes = [IsOwnerOrShared]
     serializer_class = ImageFileSerializer
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        folder_id = self.request.query_params.get('folder', None)
-        queryset = ImageFile.objects.filter(Q(user=self.request.user) | Q(folder__is_shared=True, folder__shared_with=self.request.user))
+        folder_id = self.kwargs.get('folder_id') or self.request.query_params.get('folder', None)
+        queryset = accessible_items(ImageFile, self.request.user)
         if folder_id:
             queryset = queryset.filter(folder_id=folder_id)
         return queryset
@@ -72,65 +191,429 @@ class ImageFileDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = ImageFileSerializer
 
     def get_queryset(self):
-        return ImageFile.objects.filter(Q(user=self.request.user) | Q(folder__is_shared=True, folder__shared_with=self.request.user))
+        return accessible_items(ImageFile, self.request.user)
+
+class MediaContentView(APIView):
+    # The stored bytes of a file, image or video for anyone who can see it,
+    # with Range / If-None-Match support so videos can be scrubbed and
+    # unchanged media revalidated cheaply. ?download=1 asks for an attachment.
+    permission_classes = [IsOwnerOrShared]
+    model = None
+
+    def get(self, request, pk):
+        item = get_object_or_404(accessible_items(self.model, request.user).select_related('blob'), pk=pk)
+        self.check_object_permissions(request, item)
+        if not getattr(item, self.model.stored_file_field):
+            raise Http404
+        as_attachment = request.query_params.get('download') in ('1', 'true')
+        return StoredFileResponder(request, item, as_attachment).respond()
+
+    def perform_content_negotiation(self, request, force=False):
+        # The response is the file itself, whatever the Accept header asks for.
+        return super().perform_content_negotiation(request, force=True)
+
+class FileContentView(MediaContentView):
+    model = File
+
+class ImageFileContentView(MediaContentView):
+    model = ImageFile
+
+class VideoFileContentView(MediaContentView):
+    model = VideoFile
+
+class BulkActionView(APIView):
+    # POST {"action": ..., "ids": [...]} or {"action": ..., "filter": {...}}
+    # to trash, restore, star, unstar, move ("folder": target) or delete many
+    # items at once. Only items the caller can access are touched; the rest
+    # of `ids` come back as not_found. Access to `ids` is resolved once per
+    # distinct folder through the folder ACL cache.
+    model = None
+    filter_fields = ('folder', 'is_trashed', 'is_starred')
+    flag_actions = {
+        'trash': ('is_trashed', True),
+        'restore': ('is_trashed', False),
+        'star': ('is_starred', True),
+        'unstar': ('is_starred', False),
+    }
+
+    def get_queryset(self):
+        return accessible_items(self.model, self.request.user)
+
+    def get_permitted_ids(self, ids):
+        rows = list(self.model.objects.filter(pk__in=ids).values_list('pk', 'folder_id'))
+        roles = get_folder_roles(self.request, {folder_id for _, folder_id in rows})
+        return [pk for pk, folder_id in rows if roles[folder_id] is not None]
+
+    def get_selection(self, data):
+        if 'ids' in data:
+            return self.model.objects.filter(pk__in=self.get_permitted_ids(data['ids']))
+        queryset = self.get_queryset()
+        unknown = set(data['filter']) - set(self.filter_fields)
+        if unknown:
+            raise ValidationError({'filter': 'Unsupported conditions: {0}.'.format(', '.join(sorted(unknown)))})
+        return queryset.filter(**data['filter'])
+
+    def post(self, request):
+        serializer = BulkActionSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        action = data['action']
+        if action in self.flag_actions and self.flag_actions[action][0] not in self.filter_fields:
+            raise ValidationError({'action': '"{0}" is not supported here.'.format(action)})
+        selection = self.get_selection(data)
+        response = {'action': action}
+        if 'ids' in data:
+            found = set(selection.values_list('pk', flat=True))
+            response['not_found'] = sorted(set(data['ids']) - found)
+        response['updated'] = self.perform_action(action, selection, data)
+        return Response(response)
+
+    def perform_action(self, action, selection, data):
+        if action in self.flag_actions:
+            return set_flag(self.model, selection, *self.flag_actions[action])
+        if action == 'move':
+            return move_items(self.model, selection, data['folder'])
+        return delete_items(self.model, selection)
+
+class FileBulkView(BulkActionView):
+    model = File
+
+class ImageFileBulkView(BulkActionView):
+    model = ImageFile
+
+class VideoFileBulkView(BulkActionView):
+    model = VideoFile
+    filter_fields = ('folder', 'is_trashed')
+
+class FolderBulkView(BulkActionView):
+    model = Folder
+    filter_fields = ('parent_folder', 'is_trashed', 'is_starred')
+
+    def get_queryset(self):
+        return accessible_folders(self.request.user)
+
+    def get_permitted_ids(self, ids):
+        roles = get_folder_roles(self.request, set(ids))
+        return [pk for pk in set(ids) if roles[pk] is not None]
+
+    def perform_action(self, action, selection, data):
+        if action == 'move':
+            return move_folders(selection, data['folder'])
+        if action == 'delete':
+            return delete_folders(selection)
+        if action in ('trash', 'restore'):
+            return set_folders_trashed(selection, action == 'trash')
+        return super().perform_action(action, selection, data)
+
+class ImageBatchUploadView(APIView):
+    # Many images in one multipart request: `folder` plus repeated `images`
+    # parts. Each file gets its own entry in `results`; the response is 207
+    # when some of them were rejected.
+
+    def post(self, request):
+        serializer = ImageBatchUploadSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        outcomes = ingest_images(request.user, serializer.validated_data['folder'], serializer.validated_data['images'])
+        results = []
+        for index, (upload, image, error) in enumerate(outcomes):
+            if error:
+                results.append({'index': index, 'filename': upload.name, 'status': 'error', 'error': error})
+            else:
+                image_data = ImageFileSerializer(image, context={'request': request}).data
+                results.append({'index': index, 'filename': upload.name, 'status': 'created', 'image': image_data})
+        failed = any(error for _, _, error in outcomes)
+        return Response({'results': results}, status=status.HTTP_207_MULTI_STATUS if failed else status.HTTP_201_CREATED)
+
+def get_distance(request):
+    distance = request.query_params.get('distance')
+    if distance in (None, ''):
+        return DEFAULT_DISTANCE
+    try:
+        distance = int(distance)
+    except ValueError:
+        distance = -1
+    if not 0 <= distance <= MAX_DISTANCE:
+        raise ValidationError({'distance': 'Must be an integer between 0 and {0}.'.format(MAX_DISTANCE)})
+    return distance
+
+class SimilarImagesView(APIView):
+    # Images whose perceptual hash is within ?distance= bits of this one,
+    # closest first. Looked up through the indexed hash bands.
+    permission_classes = [IsOwnerOrShared]
+    max_results = 200
+
+    def get(self, request, pk):
+        image = get_object_or_404(accessible_items(ImageFile, request.user), pk=pk)
+        self.check_object_permissions(request, image)
+        if image.phash is None:
+            return Response({'results': []})
+        candidates = (
+            accessible_items(ImageFile, request.user)
+            .filter(user_id=image.user_id, is_trashed=False)
+            .exclude(pk=image.pk)
+        )
+        matches = find_similar(candidates, image.phash, get_distance(request))[:self.max_results]
+        context = {'request': request}
+        return Response({'results': [
+            dict(ImageFileSerializer(match, context=context).data, distance=distance)
+            for distance, match in matches
+        ]})
+
+class DuplicateClustersView(APIView):
+    # Groups of the user's own images that are near-duplicates of each other
+    # (bursts, re-encodes, edited copies), largest groups first.
+    max_clusters = 500
+
+    def get(self, request):
+        hashes = list(
+            ImageFile.objects.filter(user=request.user, is_trashed=False, phash__isnull=False)
+            .values_list('pk', 'phash')
+            .iterator(chunk_size=STREAM_CHUNK_SIZE)
+        )
+        clusters = find_clusters(hashes, get_distance(request))[:self.max_clusters]
+        images = ImageFile.objects.in_bulk([pk for cluster in clusters for pk in cluster])
+        context = {'request': request}
+        return Response({'clusters': [
+            ImageFileSerializer([images[pk] for pk in cluster], many=True, context=context).data
+            for cluster in clusters
+        ]})
 
+class TimelineView(ConditionalGetMixin, generics.ListAPIView):
+    # The user's own photos counted per ?granularity=day|month|year (month by
+    # default), newest first. A bucket's photos are paged through at
+    # images/timeline/<bucket>/, e.g. images/timeline/2019-03/.
+    serializer_class = TimelineBucketSerializer
+    pagination_class = None
+
+    def get_queryset(self):
+        granularity = self.request.query_params.get('granularity', 'month')
+        if granularity not in BUCKET_FORMATS:
+            raise ValidationError({'granularity': 'Must be one of: day, month, year.'})
+        return get_buckets(self.request.user, granularity)
+
+    def get_version_folder(self):
+        # The timeline spans all of the user's folders; ?folder does not scope it.
+        return None
+
+class TimelineBucketView(ConditionalGetMixin, generics.ListAPIView):
+    serializer_class = ImageFileSerializer
+    pagination_class = TimelinePagination
+
+    def get_queryset(self):
+        bounds = parse_bucket(self.kwargs['bucket'])
+        if bounds is None:
+            raise Http404
+        return bucket_images(self.request.user, *bounds)
+
+    def get_version_folder(self):
+        # The timeline spans all of the user's folders; ?folder does not scope it.
+        return None
+
+FOLDER_FILE_FIELDS = {
+    File: [
+        'id', 'name', 'description', 'created_at', 'updated_at', 'size', 'is_public', 'is_shared', 'shared_at',
+        'is_trashed', 'trashed_at', 'is_deleted', 'deleted_at', 'is_starred', 'starred_at', 'is_encrypted',
+        'encrypted_at', 'is_locked', 'locked_at', 'is_protected', 'protected_at', 'file',
+    ],
+    ImageFile: [
+        'id', 'name', 'is_trashed', 'trashed_at', 'is_deleted', 'deleted_at', 'is_starred', 'starred_at',
+        'is_encrypted', 'encrypted_at', 'is_locked', 'locked_at', 'is_protected', 'protected_at', 'is_archived',
+        'is_shared', 'image',
+    ],
+    VideoFile: [
+        'id', 'name', 'video_description', 'is_trashed', 'trashed_at', 'created_at', 'video', 'video_thumbnail',
+    ],
+}
+FOLDER_FILE_SECTIONS = [('files', 'file', File), ('images', 'image', ImageFile), ('videos', 'video', VideoFile)]
+STREAM_CHUNK_SIZE = 2000
+
+
+def iter_folder_rows(model, folder):
+    # Plain dicts straight from the cursor; no model instances are built.
+    file_fields = [f for f in FOLDER_FILE_FIELDS[model] if isinstance(model._meta.get_field(f), FileField)]
+    rows = model.objects.filter(folder=folder).values(*FOLDER_FILE_FIELDS[model]).iterator(chunk_size=STREAM_CHUNK_SIZE)
+    for row in rows:
+        for field in file_fields:
+            row[field] = media_url(model._meta.get_field(field).storage, row[field])
+        yield row
+
+
+def stream_folder_json(folder):
+    yield '{'
+    for index, (section, _, model) in enumerate(FOLDER_FILE_SECTIONS):
+        yield '{0}{1}: ['.format(', ' if index else '', json.dumps(section))
+        separator = ''
+        for row in iter_folder_rows(model, folder):
+            yield separator + json.dumps(row, cls=DjangoJSONEncoder)
+            separator = ', '
+        yield ']'
+    yield '}'
+
+
+def stream_folder_ndjson(folder):
+    for _, kind, model in FOLDER_FILE_SECTIONS:
+        for row in iter_folder_rows(model, folder):
+            row['type'] = kind
+            yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+@api_view(['GET'])
+@permission_classes([IsOwnerOrShared])
 def get_folder_files(request, pk):
-    folder = get_object_or_404(Folder, pk=pk)
-    files = folder.files.all()
-    images = folder.images.all()
-
-    files_data = [
-        {
-            'id': file.id,
-            'name': file.name,
-            'description': file.description,
-            'created_at': file.created_at,
-            'updated_at': file.updated_at,
-            'size': file.size,
-            'is_public': file.is_public,
-            'is_shared': file.is_shared,
-            'shared_at': file.shared_at,
-            'is_trashed': file.is_trashed,
-            'trashed_at': file.trashed_at,
-            'is_deleted': file.is_deleted,
-            'deleted_at': file.deleted_at,
-            'is_starred': file.is_starred,
-            'starred_at': file.starred_at,
-            'is_encrypted': file.is_encrypted,
-            'encrypted_at': file.encrypted_at,
-            'is_locked': file.is_locked,
-            'locked_at': file.locked_at,
-            'is_protected': file.is_protected,
-            'protected_at': file.protected_at,
-            'file': file.file.url,
-        }
-        for file in files
-    ]
-
-    images_data = [
-        {
-            'id': image.id,
-            'name': image.name,
-            'is_trashed': image.is_trashed,
-            'trashed_at': image.trashed_at,
-            'is_deleted': image.is_deleted,
-            'deleted_at': image.deleted_at,
-            'is_starred': image.is_starred,
-            'starred_at': image.starred_at,
-            'is_encrypted': image.is_encrypted,
-            'encrypted_at': image.encrypted_at,
-            'is_locked': image.is_locked,
-            'locked_at': image.locked_at,
-            'is_protected': image.is_protected,
-            'protected_at': image.protected_at,
-            'is_archived': image.is_archived,
-            'is_shared': image.is_shared,
-            'image': image.image.url,
-        }
-        for image in images
-    ]
-
-    return JsonResponse({'files': files_data, 'images': images_data})
+    stream = request.query_params.get('stream')
+    # Anything but the two streaming formats gets the plain, cached response.
+    if stream not in ('ndjson', 'json'):
+        key, response = get_cached_response(request)
+        if response is not None:
+            return response
+    folder = get_object_or_404(accessible_folders(request.user), pk=pk)
+    etag = make_etag(request, folder.pk, folder.version)
+    unchanged = not_modified(request, etag)
+    if unchanged is not None:
+        return unchanged
+    if stream == 'ndjson':
+        response = StreamingHttpResponse(stream_folder_ndjson(folder), content_type='application/x-ndjson')
+    elif stream == 'json':
+        response = StreamingHttpResponse(stream_folder_json(folder), content_type='application/json')
+    else:
+        response = JsonResponse({
+            section: list(iter_folder_rows(model, folder))
+            for section, _, model in FOLDER_FILE_SECTIONS
+        })
+        response_cache.set(key, etag, response)
+        response['X-Cache'] = 'MISS'
+    response['ETag'] = etag
+    return response
+
+
+class UploadSessionListView(generics.CreateAPIView):
+    serializer_class = UploadSessionSerializer
+
+    def perform_create(self, serializer):
+        start_session(serializer.save())
+
+class UploadSessionDetailView(generics.RetrieveDestroyAPIView):
+    serializer_class = UploadSessionSerializer
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(user=self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
+        session = self.get_object()
+        data = self.get_serializer(session).data
+        data['missing'] = get_missing_chunks(session)
+        return Response(data)
+
+    def perform_destroy(self, instance):
+        abort_session(instance)
+
+class UploadChunkView(APIView):
+    # PUT the raw bytes of chunk <index>; it lands at index * chunk_size.
+    # Chunks may arrive in any order and in parallel, and re-sending one is
+    # harmless.
+
+    def put(self, request, pk, index):
+        session = get_object_or_404(UploadSession, pk=pk, user=request.user)
+        write_chunk(session, index, request.stream)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class UploadSessionCompleteView(APIView):
+    serializer_classes = {
+        UploadSession.FILE: FileSerializer,
+        UploadSession.IMAGE: ImageFileSerializer,
+        UploadSession.VIDEO: VideoFileSerializer,
+    }
+
+    def post(self, request, pk):
+        session = get_object_or_404(UploadSession, pk=pk, user=request.user)
+        serializer_class = self.serializer_classes[session.kind]
+        instance = complete_session(session, serializer_class(context={'request': request}))
+        return Response(serializer_class(instance, context={'request': request}).data, status=status.HTTP_201_CREATED)
+
+class DirectUploadListView(generics.CreateAPIView):
+    # Starts an upload that goes straight to the bucket. The response says
+    # where to PUT the bytes: one presigned URL, or one per part for large
+    # files (parts can go in parallel). "exists" means the content is already
+    # stored and the upload can be completed right away.
+    serializer_class = DirectUploadSerializer
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic():
+            upload = start_direct_upload(serializer.save())
+        data = dict(self.get_serializer(upload).data, **get_upload_instructions(upload))
+        return Response(data, status=status.HTTP_201_CREATED)
+
+class DirectUploadDetailView(generics.RetrieveDestroyAPIView):
+    serializer_class = DirectUploadSerializer
+
+    def get_queryset(self):
+        return DirectUpload.objects.filter(user=self.request.user)
+
+    def retrieve(self, request, *args, **kwargs):
+        # Fresh URLs for whatever has not been uploaded yet.
+        upload = self.get_object()
+        return Response(dict(self.get_serializer(upload).data, **get_upload_instructions(upload)))
+
+    def perform_destroy(self, instance):
+        abort_direct_upload(instance)
+
+class DirectUploadCompleteView(APIView):
+
+    def post(self, request, pk):
+        upload = get_object_or_404(DirectUpload, pk=pk, user=request.user)
+        serializer_class = UploadSessionCompleteView.serializer_classes[upload.kind]
+        instance = finalize_direct_upload(upload, serializer_class(context={'request': request}))
+        return Response(serializer_class(instance, context={'request': request}).data, status=status.HTTP_201_CREATED)
+
+class ChangeListView(APIView):
+    # Delta sync for backup clients. Without ?since= this returns the current
+    # cursor only: take it, list everything once, then poll with
+    # ?since=<cursor> for the entries after it, oldest first. Each entry says
+    # which object changed and how; fetch it again unless it was deleted. A
+    # folder's trashed, restored and deleted entries cover its whole subtree.
+    # "resync" means the cursor predates compaction: start over as without
+    # ?since=.
+
+    def get(self, request):
+        since = request.query_params.get('since')
+        if since is None:
+            return Response({'changes': [], 'cursor': get_head(request.user), 'next': None, 'resync': False})
+        try:
+            since = int(since)
+        except ValueError:
+            raise ValidationError({'since': 'Invalid cursor.'})
+        try:
+            page_size = max(1, min(int(request.query_params['page_size']), CHANGES_MAX_PAGE_SIZE))
+        except (KeyError, ValueError):
+            page_size = CHANGES_PAGE_SIZE
+        changes, has_more, resync = get_changes(request.user, since, page_size)
+        if resync:
+            return Response({'changes': [], 'cursor': get_head(request.user), 'next': None, 'resync': True})
+        cursor = changes[-1]['seq'] if changes else since
+        next_url = replace_query_param(request.build_absolute_uri(), 'since', cursor) if has_more else None
+        return Response({'changes': changes, 'cursor': cursor, 'next': next_url, 'resync': False})
+
+class ResponseCacheStatsView(APIView):
+    # Hit/miss counters of this worker process's response cache.
+    permission_classes = [permissions.IsAdminUser]
 
+    def get(self, request):
+        return Response(response_cache.stats())
 
+class ManifestDiffView(APIView):
+    # Takes a backup client's manifest of {client_path, size, mtime, hash}
+    # entries and returns only those whose content is not stored yet. Send
+    # JSON {"entries": [...]} or, for large manifests, one entry per line as
+    # application/x-ndjson to get the answer streamed back the same way.
 
+    def post(self, request):
+        if request.content_type.startswith('application/x-ndjson'):
+            missing = find_missing(request.user, iter_ndjson_entries(request.stream))
+            lines = (json.dumps(entry) + '\n' for entry in missing)
+            return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+        entries = request.data.get('entries') if isinstance(request.data, dict) else None
+        if not isinstance(entries, list):
+            raise ValidationError({'entries': 'Expected a list of manifest entries.'})
+        return Response({'missing': list(find_missing(request.user, entries))})
@@ -177,3 +177,85 @@ AWS_S3_REGION_NAME = os.environ.get('AWS_S3_REGION_NAME', '')
 AWS_S3_ADDRESSING_STYLE = os.environ.get('AWS_S3_ADDRESSING_STYLE', '')
 
 DEFAULT_FILE_STORAGE = os.environ.get('DEFAULT_FILE_STORAGE', '')
+
+# Hash uploads while they stream in so the blob store can deduplicate them.
+FILE_UPLOAD_HANDLERS = [
+    'backupss.blobs.HashingMemoryFileUploadHandler',
+    'backupss.blobs.HashingTemporaryFileUploadHandler',
+]
+
+# Per-user storage quotas in bytes, checked against CustomUser.storage on upload.
+STORAGE_QUOTA = int(os.environ.get('STORAGE_QUOTA', 15 * 1024 ** 3))
+PREMIUM_STORAGE_QUOTA = int(os.environ.get('PREMIUM_STORAGE_QUOTA', 1024 ** 4))
+
+# Image derivatives generated in the background after each upload.
+THUMBNAIL_SIZES = (256, 1024)
+THUMBNAIL_FORMAT = os.environ.get('THUMBNAIL_FORMAT', 'WEBP')
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+
+# Resumable uploads are assembled here before being handed to the storage backend.
+UPLOAD_SESSION_ROOT = os.environ.get('UPLOAD_SESSION_ROOT', str(BASE_DIR / 'upload_sessions'))
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Batch image uploads: files accepted per request and storage writes in flight.
+BATCH_UPLOAD_MAX_FILES = int(os.environ.get('BATCH_UPLOAD_MAX_FILES', 200))
+BATCH_UPLOAD_WORKERS = int(os.environ.get('BATCH_UPLOAD_WORKERS', 8))
+DATA_UPLOAD_MAX_NUMBER_FILES = BATCH_UPLOAD_MAX_FILES
+
+# Largest id list accepted by the bulk action endpoints.
+BULK_ACTION_MAX_IDS = int(os.environ.get('BULK_ACTION_MAX_IDS', 10000))
+
+# Rows removed per transaction by background folder deletions.
+DELETION_BATCH_SIZE = int(os.environ.get('DELETION_BATCH_SIZE', 500))
+
+# Trash retention, enforced by the purge_trash management command.
+TRASH_RETENTION_DAYS = int(os.environ.get('TRASH_RETENTION_DAYS', 30))
+TRASH_PURGE_BATCH_SIZE = int(os.environ.get('TRASH_PURGE_BATCH_SIZE', 500))
+TRASH_PURGE_WORKERS = int(os.environ.get('TRASH_PURGE_WORKERS', 8))
+TRASH_PURGE_PAUSE = float(os.environ.get('TRASH_PURGE_PAUSE', 0.2))
+
+# Media downloads: '' streams from the app; 'x-accel-redirect' (nginx) or
+# 'x-sendfile' (Apache/lighttpd) hand the transfer to the front proxy after
+# the permission check. For nginx, map MEDIA_ACCEL_REDIRECT_PREFIX to
+# MEDIA_ROOT in an internal location.
+MEDIA_SERVE_OFFLOAD = os.environ.get('MEDIA_SERVE_OFFLOAD', '')
+MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get('MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+
+# Direct-to-S3 uploads: presigned URL lifetime (seconds) and multipart part size.
+DIRECT_UPLOAD_URL_EXPIRY = int(os.environ.get('DIRECT_UPLOAD_URL_EXPIRY', 3600))
+DIRECT_UPLOAD_PART_SIZE = int(os.environ.get('DIRECT_UPLOAD_PART_SIZE', 64 * 1024 * 1024))
+
+# Presigned media URLs kept per worker process and reused within their
+# validity window, so listings stay cheap and URLs stay cacheable.
+SIGNED_URL_CACHE_SIZE = int(os.environ.get('SIGNED_URL_CACHE_SIZE', 100000))
+
+# Change journal entries older than this are compacted away by
+# compact_changes; clients with an older cursor are told to resync.
+CHANGE_JOURNAL_RETENTION_DAYS = int(os.environ.get('CHANGE_JOURNAL_RETENTION_DAYS', 30))
+
+# Rendered folder and listing responses, cached per user until something they
+# can see changes. Per worker process by default; set RESPONSE_CACHE_URL
+# (redis://...) to share one cache between processes and skip the database
+# on hits; Django's Redis backend needs the redis package (pip install redis),
+# which requirements.txt leaves out since the default needs nothing. Entries
+# over RESPONSE_CACHE_MAX_ENTRY_SIZE bytes are not cached.
+RESPONSE_CACHE_ALIAS = 'responses'
+RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL', '')
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 5000))
+RESPONSE_CACHE_MAX_ENTRY_SIZE = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRY_SIZE', 2 * 1024 * 1024))
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get('RESPONSE_CACHE_TIMEOUT', 24 * 3600))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    RESPONSE_CACHE_ALIAS: {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': RESPONSE_CACHE_URL,
+    } if RESPONSE_CACHE_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'backupss-responses',
+        'OPTIONS': {'MAX_ENTRIES': RESPONSE_CACHE_MAX_ENTRIES},
+    },
+}
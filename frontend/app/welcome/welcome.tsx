@@ -107,7 +107,7 @@ export function Welcome() {
     .then((response) => {
       console.log("Images fetched successfully:", response.data);
       // Transform and set the photos
-      const transformedPhotos = transformApiPhotos(response.data);
+      const transformedPhotos = transformApiPhotos(response.data.results);
       setPhotos(transformedPhotos);
     })
     .catch((error) => {